@@ -0,0 +1,113 @@
+"""
+Adaptive admission control with priority classes.
+
+The limiter caps the number of requests in flight in this worker. The cap
+adapts to observed latency (AIMD): it grows by roughly one per round of
+fast requests and shrinks multiplicatively when latency exceeds the target,
+for example when the database slows down. Each priority class may only fill
+a share of the current cap and may only queue for a bounded time, so under
+overload low-priority routes are shed with 503 first while license
+validation and activation keep their headroom.
+"""
+from dataclasses import dataclass
+import asyncio
+import os
+import time
+
+
+@dataclass(frozen=True)
+class PriorityClass:
+    name: str
+    share: float  # Fraction of the concurrency limit this class may fill
+    max_wait: float  # Seconds a request may queue before it is shed
+
+
+CRITICAL = PriorityClass("critical", 1.0, float(os.getenv("ADMISSION_CRITICAL_MAX_WAIT_MS", "2000")) / 1000)
+NORMAL = PriorityClass("normal", 0.8, float(os.getenv("ADMISSION_NORMAL_MAX_WAIT_MS", "500")) / 1000)
+LOW = PriorityClass("low", 0.5, float(os.getenv("ADMISSION_LOW_MAX_WAIT_MS", "50")) / 1000)
+
+# End-user software depends on these; everything else is admin or integration traffic
+ROUTE_PRIORITIES = {
+    ("POST", "/licenses/validate"): CRITICAL,
+    ("POST", "/licenses/activate"): CRITICAL,
+}
+
+
+def classify(method: str, path: str) -> PriorityClass:
+    priority = ROUTE_PRIORITIES.get((method, path))
+    if priority is not None:
+        return priority
+    if method in ("GET", "HEAD"):
+        return LOW
+    return NORMAL
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit shared by all requests of one worker."""
+
+    def __init__(self, initial_limit: float = 10, min_limit: float = 2, max_limit: float = 30,
+                 target_latency: float = 0.25, backoff: float = 0.9):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.inflight = 0
+        self._last_decrease = 0.0
+        self._condition = None
+        self._loop = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            initial_limit=float(os.getenv("ADMISSION_INITIAL_LIMIT", "10")),
+            min_limit=float(os.getenv("ADMISSION_MIN_LIMIT", "2")),
+            # Default matches the PostgreSQL pool (pool_size + max_overflow)
+            max_limit=float(os.getenv("ADMISSION_MAX_LIMIT", "30")),
+            target_latency=float(os.getenv("ADMISSION_TARGET_LATENCY_MS", "250")) / 1000,
+        )
+
+    def _admissible(self, priority: PriorityClass) -> bool:
+        # Every class may run at least one request, so nothing starves completely
+        return self.inflight < max(self.limit * priority.share, 1)
+
+    def _get_condition(self) -> asyncio.Condition:
+        """asyncio primitives are bound to one event loop; create them inside the running one."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    async def acquire(self, priority: PriorityClass) -> bool:
+        """Wait for a slot for up to the class's max_wait. False means shed the request."""
+        condition = self._get_condition()
+        async with condition:
+            if not self._admissible(priority):
+                try:
+                    await asyncio.wait_for(
+                        condition.wait_for(lambda: self._admissible(priority)),
+                        timeout=priority.max_wait,
+                    )
+                except asyncio.TimeoutError:
+                    return False
+            self.inflight += 1
+            return True
+
+    async def release(self, latency: float):
+        condition = self._get_condition()
+        async with condition:
+            self.inflight -= 1
+            self._adjust(latency)
+            condition.notify_all()
+
+    def _adjust(self, latency: float):
+        now = time.monotonic()
+        if latency > self.target_latency:
+            # Decrease at most once per target interval so one slow burst does not collapse the limit
+            if now - self._last_decrease >= self.target_latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+        elif self.inflight + 1 >= self.limit * 0.5:
+            # Only grow while the limit is actually being used
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
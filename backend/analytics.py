@@ -0,0 +1,243 @@
+"""
+Usage analytics rollups.
+
+The rollup tables are updated incrementally by the crud mutations, inside
+the same transaction as the write, so analytics endpoints read a few small
+rows instead of scanning ``licenses`` and ``activations``. ``rebuild``
+recomputes them from the base tables for backfills and drift repair.
+
+The daily activation rollup is the only record of deactivations and of
+activations whose seats were released, so ``rebuild`` leaves it alone once
+it has rows. It is only backfilled when empty, or when history is reset
+explicitly.
+
+Usage:
+    python -m backend.analytics rebuild [--reset-history]
+"""
+from datetime import date, datetime
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Optional
+import argparse
+import logging
+import os
+import random
+
+from . import models, seats
+
+logger = logging.getLogger(__name__)
+
+# Seat and activation counters are spread over shard rows so busy products do not
+# serialise activations on one rollup row. Readers always sum over shards.
+ROLLUP_SHARDS = max(int(os.getenv("ANALYTICS_ROLLUP_SHARDS", "8")), 1)
+
+
+def _increment(db: Session, model, key: dict, **deltas):
+    """Add deltas to a rollup row, creating it on first use."""
+    values = {getattr(model, column): getattr(model, column) + delta for column, delta in deltas.items()}
+    if db.query(model).filter_by(**key).update(values, synchronize_session=False):
+        return
+    try:
+        with db.begin_nested():
+            db.add(model(**key, **deltas))
+    except IntegrityError:
+        # Another transaction created the row first
+        db.query(model).filter_by(**key).update(values, synchronize_session=False)
+
+
+def _shard() -> int:
+    return random.randrange(ROLLUP_SHARDS)
+
+
+def _month(value: datetime) -> str:
+    return value.strftime("%Y-%m")
+
+
+# Incremental maintenance, called by crud before its commit
+def record_license_created(db: Session, db_license: models.License):
+    _increment(
+        db, models.ProductUsageRollup, {"product_id": db_license.product_id, "shard": _shard()},
+        licenses_total=1,
+        licenses_active=1 if db_license.is_active else 0,
+        seats_total=db_license.max_seats or 0,
+        seats_used=db_license.active_seats or 0,
+    )
+    if db_license.expiration_date:
+        _increment(
+            db, models.LicenseExpiryRollup,
+            {"month": _month(db_license.expiration_date), "product_id": db_license.product_id},
+            licenses=1,
+        )
+
+
+def record_license_status_changed(db: Session, product_id: int, is_active: bool):
+    _increment(
+        db, models.ProductUsageRollup, {"product_id": product_id, "shard": _shard()},
+        licenses_active=1 if is_active else -1,
+    )
+
+
+def record_seats_changed(db: Session, product_id: int, seats: int, day: Optional[date] = None):
+    """Positive seats are activations, negative seats are deactivations."""
+    day = day or datetime.utcnow().date()
+    shard = _shard()
+    _increment(db, models.ProductUsageRollup, {"product_id": product_id, "shard": shard}, seats_used=seats)
+    daily_key = {"day": day, "product_id": product_id, "shard": shard}
+    if seats > 0:
+        _increment(db, models.ActivationDailyRollup, daily_key, activations=seats)
+    elif seats < 0:
+        _increment(db, models.ActivationDailyRollup, daily_key, deactivations=-seats)
+
+
+def record_seats_repaired(db: Session, product_id: int, seats: int):
+    """Seat drift repaired by reconciliation; not an activation, so the daily history is left alone."""
+    _increment(db, models.ProductUsageRollup, {"product_id": product_id, "shard": _shard()}, seats_used=seats)
+
+
+# Readers
+def _scoped(query, brand_id: Optional[int]):
+    if brand_id is None:
+        return query
+    return query.filter(models.Product.brand_id == brand_id)
+
+
+def get_seat_utilization(db: Session, group_by: str = "product", brand_id: Optional[int] = None):
+    rollup = models.ProductUsageRollup
+    if group_by == "brand":
+        group_columns = (models.Product.brand_id,)
+    else:
+        group_columns = (rollup.product_id, models.Product.name, models.Product.brand_id)
+    query = db.query(
+        *group_columns,
+        func.sum(rollup.licenses_total).label("licenses_total"),
+        func.sum(rollup.licenses_active).label("licenses_active"),
+        func.sum(rollup.seats_total).label("seats_total"),
+        func.sum(rollup.seats_used).label("seats_used"),
+    ).join(models.Product, models.Product.id == rollup.product_id)
+    rows = _scoped(query, brand_id).group_by(*group_columns).order_by(*group_columns).all()
+
+    results = []
+    for row in rows:
+        item = row._asdict()
+        item["utilization"] = round(item["seats_used"] / item["seats_total"], 4) if item["seats_total"] else 0.0
+        results.append(item)
+    return results
+
+
+def get_activation_counts(db: Session, start: Optional[date] = None, end: Optional[date] = None,
+                          product_id: Optional[int] = None, brand_id: Optional[int] = None):
+    rollup = models.ActivationDailyRollup
+    query = db.query(
+        rollup.day,
+        func.sum(rollup.activations).label("activations"),
+        func.sum(rollup.deactivations).label("deactivations"),
+    ).join(models.Product, models.Product.id == rollup.product_id)
+    if start:
+        query = query.filter(rollup.day >= start)
+    if end:
+        query = query.filter(rollup.day <= end)
+    if product_id is not None:
+        query = query.filter(rollup.product_id == product_id)
+    return [row._asdict() for row in _scoped(query, brand_id).group_by(rollup.day).order_by(rollup.day).all()]
+
+
+def get_expirations(db: Session, start_month: Optional[str] = None, end_month: Optional[str] = None,
+                    product_id: Optional[int] = None, brand_id: Optional[int] = None):
+    rollup = models.LicenseExpiryRollup
+    query = db.query(
+        rollup.month,
+        func.sum(rollup.licenses).label("licenses"),
+    ).join(models.Product, models.Product.id == rollup.product_id)
+    if start_month:
+        query = query.filter(rollup.month >= start_month)
+    if end_month:
+        query = query.filter(rollup.month <= end_month)
+    if product_id is not None:
+        query = query.filter(rollup.product_id == product_id)
+    return [row._asdict() for row in _scoped(query, brand_id).group_by(rollup.month).order_by(rollup.month).all()]
+
+
+# Backfill
+def rebuild(db: Session, reset_history: bool = False):
+    """
+    Recompute the rollups from licenses and activations in one transaction.
+
+    The daily activation rollup is only recomputed when it is empty or
+    reset_history is set. The base tables do not keep deactivations, so a
+    recomputed day only counts activations that are still present.
+    """
+    db.query(models.ProductUsageRollup).delete(synchronize_session=False)
+    db.query(models.LicenseExpiryRollup).delete(synchronize_session=False)
+    rebuild_history = reset_history or db.query(models.ActivationDailyRollup).first() is None
+    if rebuild_history:
+        db.query(models.ActivationDailyRollup).delete(synchronize_session=False)
+
+    License = models.License
+    usage = db.query(
+        License.product_id,
+        func.count(License.id),
+        func.sum(case((License.is_active == True, 1), else_=0)),
+        func.sum(func.coalesce(License.max_seats, 0)),
+        func.sum(func.coalesce(seats.active_seats_expr, 0)),
+    ).filter(License.product_id.isnot(None)).group_by(License.product_id)
+    db.add_all(
+        models.ProductUsageRollup(
+            product_id=product_id, licenses_total=total, licenses_active=active or 0,
+            seats_total=seats_total or 0, seats_used=seats_used or 0,
+        )
+        for product_id, total, active, seats_total, seats_used in usage
+    )
+
+    if rebuild_history:
+        activations = db.query(
+            func.date(models.Activation.activated_at), License.product_id, func.count(models.Activation.id)
+        ).join(License, License.id == models.Activation.license_id).filter(
+            models.Activation.activated_at.isnot(None)
+        ).group_by(func.date(models.Activation.activated_at), License.product_id)
+        db.add_all(
+            models.ActivationDailyRollup(
+                day=date.fromisoformat(day) if isinstance(day, str) else day,
+                product_id=product_id, activations=count, deactivations=0,
+            )
+            for day, product_id, count in activations
+        )
+
+    expiry_counts = {}
+    expiring = db.query(License.expiration_date, License.product_id).filter(
+        License.expiration_date.isnot(None)
+    ).yield_per(10000)
+    for expiration_date, product_id in expiring:
+        key = (_month(expiration_date), product_id)
+        expiry_counts[key] = expiry_counts.get(key, 0) + 1
+    db.add_all(
+        models.LicenseExpiryRollup(month=month, product_id=product_id, licenses=count)
+        for (month, product_id), count in expiry_counts.items()
+    )
+
+    db.commit()
+    logger.info("Analytics rollups rebuilt")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain usage analytics rollups.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument(
+        "--reset-history", action="store_true",
+        help="Also recompute daily activation counts (drops recorded deactivations)",
+    )
+    args = parser.parse_args()
+
+    from .database import SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        rebuild(db, reset_history=args.reset_history)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
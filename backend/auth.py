@@ -2,6 +2,7 @@ from fastapi import Security, HTTPException, status
 from fastapi.security import APIKeyHeader
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
+from typing import Optional
 import secrets
 import logging
 from . import models, crud
@@ -39,6 +40,15 @@ async def get_api_key(api_key: str = Security(api_key_header)) -> models.APIKey:
     Dependency to validate API key and return the associated APIKey object.
     Raises 401 if key is invalid or missing.
     """
+    # Get database session
+    db = SessionLocal()
+    try:
+        return authenticate(db, api_key)
+    finally:
+        db.close()
+
+def authenticate(db: Session, api_key: Optional[str]) -> models.APIKey:
+    """Return the active APIKey matching a plain key; raises 401 if it is invalid or missing."""
     if not api_key:
         logger.warning("API request without API key")
         raise HTTPException(
@@ -46,45 +56,40 @@ async def get_api_key(api_key: str = Security(api_key_header)) -> models.APIKey:
             detail="API key is required. Include it in the X-API-Key header.",
             headers={"WWW-Authenticate": "ApiKey"},
         )
+
+    # Find all active API keys
+    db_keys = crud.get_all_api_keys(db)
     
-    # Get database session
-    db = SessionLocal()
-    try:
-        # Find all active API keys
-        db_keys = crud.get_all_api_keys(db)
-        
-        for db_key in db_keys:
-            if db_key.is_active and verify_api_key_hash(api_key, db_key.key_hash):
-                # Update last used timestamp
-                crud.update_api_key_last_used(db, db_key.id)
-                
-                # Check if key has expired
-                if db_key.expires_at:
-                    from datetime import datetime
-                    if db_key.expires_at < datetime.utcnow():
-                        logger.warning(
-                            "Expired API key used",
-                            extra={"api_key_id": db_key.id, "expired_at": db_key.expires_at.isoformat()}
-                        )
-                        raise HTTPException(
-                            status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="API key has expired",
-                        )
-                
-                logger.info(
-                    "API key validated successfully",
-                    extra={"api_key_id": db_key.id, "api_key_name": db_key.name}
-                )
-                return db_key
-        
-        # No matching key found
-        logger.warning(
-            "Invalid API key attempt",
-            extra={"api_key_prefix": api_key[:15] if len(api_key) > 15 else "***"}
-        )
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API key",
-        )
-    finally:
-        db.close()
+    for db_key in db_keys:
+        if db_key.is_active and verify_api_key_hash(api_key, db_key.key_hash):
+            # Update last used timestamp
+            crud.update_api_key_last_used(db, db_key.id)
+            
+            # Check if key has expired
+            if db_key.expires_at:
+                from datetime import datetime
+                if db_key.expires_at < datetime.utcnow():
+                    logger.warning(
+                        "Expired API key used",
+                        extra={"api_key_id": db_key.id, "expired_at": db_key.expires_at.isoformat()}
+                    )
+                    raise HTTPException(
+                        status_code=status.HTTP_401_UNAUTHORIZED,
+                        detail="API key has expired",
+                    )
+            
+            logger.info(
+                "API key validated successfully",
+                extra={"api_key_id": db_key.id, "api_key_name": db_key.name}
+            )
+            return db_key
+    
+    # No matching key found
+    logger.warning(
+        "Invalid API key attempt",
+        extra={"api_key_prefix": api_key[:15] if len(api_key) > 15 else "***"}
+    )
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid API key",
+    )
@@ -0,0 +1,94 @@
+"""
+Microbenchmark: Python overhead per hot-path lookup.
+
+Compares building a new ``db.query(...).filter(...)`` on every call with
+executing the module-level pre-built statements in crud.py, for the
+lookups on the request hot path. The database is an in-memory SQLite
+file with a handful of indexed rows, so the numbers are dominated by
+Python-side statement construction, compilation-cache lookup and result
+processing rather than by the lookup itself.
+
+Usage:
+    python -m backend.benchmarks.query_overhead [--iterations 20000]
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from .. import crud, models
+from ..database import Base
+
+
+def seed(db):
+    brand = models.Brand(name="Bench", email="bench@brand.com")
+    product = models.Product(name="Bench", brand=brand)
+    customer = models.Customer(email="bench@cust.com")
+    db.add_all([brand, product, customer])
+    db.flush()
+    license = models.License(key="BENCH-KEY", customer_id=customer.id, product_id=product.id, max_seats=5)
+    db.add(license)
+    db.flush()
+    db.add(models.Activation(license_id=license.id, machine_id="BENCH-MACHINE"))
+    db.add(models.APIKey(key_hash="hash", name="bench"))
+    db.commit()
+    return license.id
+
+
+def per_call_us(fn, iterations: int) -> float:
+    for _ in range(min(iterations // 10, 1000)):
+        fn()  # Warm caches
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    license_id = seed(db)
+
+    lookups = [
+        (
+            "get_license_by_key",
+            lambda: db.query(models.License).filter(models.License.key == "BENCH-KEY").first(),
+            lambda: crud.get_license_by_key(db, key="BENCH-KEY"),
+        ),
+        (
+            "get_activation",
+            lambda: db.query(models.Activation).filter(
+                models.Activation.license_id == license_id,
+                models.Activation.machine_id == "BENCH-MACHINE",
+            ).first(),
+            lambda: crud.get_activation(db, license_id=license_id, machine_id="BENCH-MACHINE"),
+        ),
+        (
+            "get_api_key",
+            lambda: db.query(models.APIKey).filter(models.APIKey.id == 1).first(),
+            lambda: crud.get_api_key(db, api_key_id=1),
+        ),
+        (
+            "get_customer_by_email",
+            lambda: db.query(models.Customer).filter(models.Customer.email == "bench@cust.com").first(),
+            lambda: crud.get_customer_by_email(db, email="bench@cust.com"),
+        ),
+    ]
+
+    print(f"{'lookup':<24} {'db.query() us':>14} {'pre-built us':>13} {'saved':>7}")
+    for name, ad_hoc, prebuilt in lookups:
+        assert ad_hoc() is prebuilt()
+        before = per_call_us(ad_hoc, args.iterations)
+        after = per_call_us(prebuilt, args.iterations)
+        print(f"{name:<24} {before:>14.1f} {after:>13.1f} {(1 - after / before):>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark: CPU time per 1,000-item list response.
+
+Compares the original path (ORM objects -> Pydantic response model ->
+stdlib json) with the column-tuple + orjson fast path used by the list
+endpoints, against an in-memory SQLite database seeded with 1,000 licenses
+carrying two activations each.
+
+The headline number is the serialization step alone: both paths get their
+rows loaded up front, so it measures Pydantic + json against orjson and
+nothing else. The end-to-end figures add the queries. There, both paths
+batch-load activations (selectinload vs one IN query), so the N+1 lazy
+loads the old endpoint also did are not counted as a serialization gain.
+
+Usage:
+    python -m backend.benchmarks.serialization [--items 1000] [--rounds 50]
+"""
+import argparse
+import datetime
+import json
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import selectinload, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from .. import crud, models, schemas, serializers
+from ..database import Base
+
+
+def seed(session, items: int):
+    brand = models.Brand(name="Bench", email="bench@brand.com")
+    product = models.Product(name="BenchProduct", brand=brand)
+    customer = models.Customer(email="bench@cust.com")
+    session.add_all([brand, product, customer])
+    session.flush()
+    now = datetime.datetime.utcnow()
+    for i in range(items):
+        license = models.License(
+            key=f"BENCH-{i:06d}",
+            customer_id=customer.id,
+            product_id=product.id,
+            max_seats=5,
+            active_seats=2,
+            expiration_date=now + datetime.timedelta(days=365),
+            created_at=now,
+        )
+        license.activations = [
+            models.Activation(machine_id=f"M-{i}-{n}", friendly_name=f"Machine {n}", activated_at=now)
+            for n in range(2)
+        ]
+        session.add(license)
+    session.commit()
+    return customer.id
+
+
+def load_objects(session, customer_id: int):
+    """ORM licenses with their activations, loaded in two queries like the fast path."""
+    session.expunge_all()
+    return session.query(models.License).options(selectinload(models.License.activations)).filter(
+        models.License.customer_id == customer_id
+    ).all()
+
+
+def load_rows(session, customer_id: int):
+    return crud.get_license_rows_by_customer(session, customer_id=customer_id)
+
+
+def pydantic_serialize(licenses, adapter: TypeAdapter) -> bytes:
+    validated = adapter.validate_python(licenses, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_serialize(rows) -> bytes:
+    license_rows, activation_rows = rows
+    return serializers.json_response(serializers.licenses_to_dicts(license_rows, activation_rows)).body
+
+
+def measure(fn, rounds: int) -> float:
+    """Median CPU milliseconds per call."""
+    samples = []
+    for _ in range(rounds):
+        start = time.process_time()
+        fn()
+        samples.append((time.process_time() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    customer_id = seed(session, args.items)
+    adapter = TypeAdapter(List[schemas.License])
+
+    licenses = load_objects(session, customer_id)
+    rows = load_rows(session, customer_id)
+    # Both paths must produce the same document
+    assert json.loads(pydantic_serialize(licenses, adapter)) == json.loads(fast_serialize(rows))
+
+    scale = 1000 / args.items
+    print(f"items per response:           {args.items}")
+    print("serialization only (rows already loaded):")
+    slow = measure(lambda: pydantic_serialize(licenses, adapter), args.rounds)
+    fast = measure(lambda: fast_serialize(rows), args.rounds)
+    print(f"  ORM + Pydantic + json:      {slow * scale:8.2f} ms CPU per 1,000 items")
+    print(f"  column tuples + orjson:     {fast * scale:8.2f} ms CPU per 1,000 items")
+    print(f"  speedup:                    {slow / fast:8.2f}x")
+
+    print("end to end (queries batch-load activations on both paths):")
+    slow = measure(lambda: pydantic_serialize(load_objects(session, customer_id), adapter), args.rounds)
+    fast = measure(lambda: fast_serialize(load_rows(session, customer_id)), args.rounds)
+    print(f"  ORM + Pydantic + json:      {slow * scale:8.2f} ms CPU per 1,000 items")
+    print(f"  column tuples + orjson:     {fast * scale:8.2f} ms CPU per 1,000 items")
+    print(f"  speedup:                    {slow / fast:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Benchmark: requests/sec of the production launcher against a single process.
+
+Seeds a throwaway SQLite database with one license and an API key, then
+runs the API twice on a local port. The first run is the old container
+setup, a single ``uvicorn backend.main:app`` with default settings. The
+second run is ``python -m backend.server``. Both runs get the same
+keep-alive load from several client processes, the way nginx connects.
+For each endpoint the benchmark reports throughput, p50/p99 latency and
+errors.
+
+``GET /`` shows raw server overhead. ``POST /licenses/validate`` includes
+API key verification, which is CPU-bound and runs on the event loop, so it
+only scales with more processes. Rate limiting, admission control and the
+webhook dispatcher are turned off in the servers under test. The gain
+depends on the number of cores: on a single core the launcher can only
+win through uvloop and httptools.
+
+Usage:
+    python -m backend.benchmarks.server_throughput [--duration 10] [--clients 4] [--concurrency 32]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import auth, models
+from ..database import Base
+from ..server import available_cpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(url: str) -> dict:
+    """One license and an admin API key; returns what the load needs."""
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        plain_key = auth.generate_api_key()
+        brand = models.Brand(name="Bench", email="bench@example.com")
+        product = models.Product(name="Bench", brand=brand)
+        customer = models.Customer(email="bench-customer@example.com")
+        license_key = str(uuid.uuid4())
+        db.add_all([
+            brand, product, customer,
+            models.APIKey(key_hash=auth.hash_api_key(plain_key), name="bench"),
+            models.License(key=license_key, customer=customer, product=product, max_seats=5),
+        ])
+        db.commit()
+        return {"api_key": plain_key, "license_key": license_key, "product_id": product.id}
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def start_server(command, url: str, base_url: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DATABASE_URL=url,
+        LOG_LEVEL="WARNING",
+        LOG_FORMAT="text",
+        RATE_LIMIT_READ="1000000",
+        RATE_LIMIT_LICENSE="1000000",
+        ADMISSION_CONTROL_ENABLED="false",
+        WEBHOOK_DISPATCHER_ENABLED="false",
+    )
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError(f"{command} exited with {process.returncode}")
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{command} did not start")
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def _load(base_url: str, request: dict, concurrency: int, duration: float):
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+
+        async def loop():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(**request)
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def _client(args):
+    return asyncio.run(_load(*args))
+
+
+def measure(base_url: str, request: dict, clients: int, concurrency: int, duration: float) -> dict:
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(_client, [(base_url, request, concurrency, duration)] * clients)
+    latencies = sorted(latency for result, _ in results for latency in result)
+    errors = sum(errors for _, errors in results)
+    if not latencies:
+        return {"rps": 0.0, "p50": 0.0, "p99": 0.0, "errors": errors}
+    return {
+        "rps": len(latencies) / duration,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per endpoint")
+    parser.add_argument("--clients", type=int, default=4, help="Load generator processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="Connections per client process")
+    parser.add_argument("--workers", type=int, help="Launcher workers (default: one per core)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    fixtures = seed(url)
+    base_url = f"http://127.0.0.1:{args.port}"
+    requests = {
+        "GET /": {"method": "GET", "url": "/"},
+        "POST /licenses/validate": {
+            "method": "POST",
+            "url": "/licenses/validate",
+            "headers": {"X-API-Key": fixtures["api_key"]},
+            "json": {"key": fixtures["license_key"], "product_id": fixtures["product_id"]},
+        },
+    }
+    launcher = [sys.executable, "-m", "backend.server", "--bind", f"127.0.0.1:{args.port}"]
+    if args.workers:
+        launcher += ["--workers", str(args.workers)]
+    servers = {
+        "single uvicorn": [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(args.port)],
+        "backend.server": launcher,
+    }
+
+    print(f"{available_cpus()} cores, {args.clients} x {args.concurrency} keep-alive connections, {args.duration:.0f}s each")
+    print(f"{'server':<16} {'endpoint':<26} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, command in servers.items():
+        process = start_server(command, url, base_url)
+        try:
+            for label, request in requests.items():
+                result = measure(base_url, request, args.clients, args.concurrency, args.duration)
+                print(f"{name:<16} {label:<26} {result['rps']:>9.0f} {result['p50']:>8.1f} "
+                      f"{result['p99']:>8.1f} {result['errors']:>7}")
+        finally:
+            stop_server(process)
+
+
+if __name__ == "__main__":
+    main()
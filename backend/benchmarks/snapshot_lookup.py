@@ -0,0 +1,76 @@
+"""
+Benchmark: validation lookups against a memory-mapped snapshot.
+
+Writes a synthetic snapshot with N licenses (no database needed), opens it
+with SnapshotReader and reports the open time, the time per validate() call
+for hits and misses, and how much the process RSS grew. Growth is split
+into anonymous memory (heap) and file-backed pages of the mapping; the
+latter are shared page cache that the kernel can evict at any time. Opening
+with body verification reads every page once, so pass --no-verify to see
+only the pages the lookups touch.
+
+Usage:
+    python -m backend.benchmarks.snapshot_lookup [--licenses 1000000] [--lookups 200000]
+"""
+import argparse
+import os
+import random
+import secrets
+import tempfile
+import time
+import uuid
+
+from ..snapshot import write_snapshot
+from ..snapshot_reader import FLAG_ACTIVE, RECORD, SnapshotReader, hash_key
+
+
+def rss_mb():
+    """(anonymous, file-backed) resident memory in MiB, from /proc (Linux)."""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            fields[name] = value.split()[0] if value.split() else "0"
+    return int(fields["RssAnon"]) / 1024, int(fields["RssFile"]) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--licenses", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--no-verify", action="store_true", help="Skip the records digest check on open")
+    args = parser.parse_args()
+
+    signing_key = b"benchmark"
+    salt = secrets.token_bytes(16)
+    path = os.path.join(tempfile.mkdtemp(), "bench.snap")
+    sample_keys = []
+    records = []
+    for n in range(args.licenses):
+        key = str(uuid.uuid4())
+        if n % max(args.licenses // 10000, 1) == 0:
+            sample_keys.append(key)
+        records.append(RECORD.pack(hash_key(salt, key), n % 50 + 1, FLAG_ACTIVE, 0, 5, n % 5))
+    write_snapshot(path, records, signing_key, salt)
+    del records
+    print(f"snapshot: {args.licenses} licenses, {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    hits = [random.choice(sample_keys) for _ in range(args.lookups)]
+    misses = [str(uuid.uuid4()) for _ in range(args.lookups)]
+
+    anon_before, file_before = rss_mb()
+    start = time.perf_counter()
+    reader = SnapshotReader(path, signing_key, verify_body=not args.no_verify)
+    print(f"open{'' if args.no_verify else ' + verify'}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    for label, keys in (("hit", hits), ("miss", misses)):
+        start = time.perf_counter()
+        for key in keys:
+            reader.validate(key, 1)
+        print(f"validate ({label}): {(time.perf_counter() - start) / len(keys) * 1e6:.2f} us")
+    anon_after, file_after = rss_mb()
+    print(f"RSS growth: {anon_after - anon_before:.1f} MiB anonymous, {file_after - file_before:.1f} MiB file-backed")
+    reader.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+HTTP conditional request helpers (ETag / If-None-Match).
+
+ETags are derived from the per-table versions in ``table_versions`` plus the
+request path and query string, so an unchanged listing can be answered with
+304 Not Modified after one small indexed lookup, without querying or
+serializing the rows. Tables written on every activation keep their
+version in shard rows that are summed on read (see crud.py).
+"""
+from fastapi import Request, Response
+import hashlib
+import os
+
+# Browsers revalidate on every use; nginx does not store "private" responses.
+CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "private, no-cache")
+
+# Responses depend on the caller's API key
+VARY = "X-API-Key"
+
+
+def compute_etag(request: Request, versions: dict, scope=None) -> str:
+    """Strong ETag for a read of the given table versions at this URL, as seen by a brand scope."""
+    digest = hashlib.sha1()
+    digest.update(f"{scope}|".encode())
+    digest.update(request.url.path.encode())
+    digest.update(b"?")
+    digest.update(str(sorted(request.query_params.multi_items())).encode())
+    for table_name in sorted(versions):
+        digest.update(f"|{table_name}={versions[table_name]}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """True when the request's If-None-Match header matches the current ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison function (RFC 9110 13.1.2)
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": VARY}
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
@@ -1,10 +1,121 @@
+from sqlalchemy import bindparam, or_, select
 from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
+from . import models, schemas, serializers, analytics, search, seats, webhooks
 import uuid
 import logging
+import os
+import random
 
 logger = logging.getLogger(__name__)
 
+BULK_DEACTIVATE_BATCH_SIZE = int(os.getenv("BULK_DEACTIVATE_BATCH_SIZE", "1000"))
+
+# Tables written on every activation keep their version in shard rows ("licenses:3"),
+# so concurrent activations do not queue on one row. Readers sum the shards.
+SHARDED_VERSION_TABLES = {"licenses", "activations"}
+TABLE_VERSION_SHARDS = max(int(os.getenv("TABLE_VERSION_SHARDS", "16")), 1)
+
+# Tenant scoping
+# brand_id is the calling API key's brand; None means an unscoped (admin) key.
+def _brand_product_ids(brand_id: int):
+    """Product ids owned by a brand, served by ix_products_brand_id_id."""
+    return select(models.Product.id).where(models.Product.brand_id == brand_id)
+
+def _scope_licenses(query, brand_id: Optional[int]):
+    if brand_id is None:
+        return query
+    return query.filter(models.License.product_id.in_(_brand_product_ids(brand_id)))
+
+def _scope_customers(query, brand_id: Optional[int]):
+    """Customers are visible to a brand once they hold one of its licenses."""
+    if brand_id is None:
+        return query
+    # Driven from the brand's licenses (ix_licenses_product_id_customer_id), so a small
+    # brand never walks other tenants' customers
+    return query.filter(models.Customer.id.in_(
+        select(models.License.customer_id).where(
+            models.License.product_id.in_(_brand_product_ids(brand_id))
+        ).distinct()
+    ))
+
+# Pre-built statements for hot lookups
+# Built once at import and executed with bound parameters, so each call skips
+# Query construction and hits SQLAlchemy's compiled-statement cache directly.
+_BRAND_PRODUCT_IDS = select(models.Product.id).where(models.Product.brand_id == bindparam("brand_id"))
+
+def _with_license_scope(statement):
+    return statement.where(models.License.product_id.in_(_BRAND_PRODUCT_IDS))
+
+_LICENSE_BY_ID = select(models.License).where(models.License.id == bindparam("license_id")).limit(1)
+_LICENSE_BY_ID_SCOPED = _with_license_scope(_LICENSE_BY_ID)
+_LICENSE_BY_KEY = select(models.License).where(models.License.key == bindparam("key")).limit(1)
+_LICENSE_BY_KEY_SCOPED = _with_license_scope(_LICENSE_BY_KEY)
+_VALIDATION_ROW_BY_KEY = select(*serializers.VALIDATION_COLUMNS).where(models.License.key == bindparam("key")).limit(1)
+_VALIDATION_ROW_BY_KEY_SCOPED = _with_license_scope(_VALIDATION_ROW_BY_KEY)
+_CUSTOMER_BY_EMAIL = select(models.Customer).where(models.Customer.email == bindparam("email")).limit(1)
+_CUSTOMER_BY_EMAIL_SCOPED = _CUSTOMER_BY_EMAIL.where(
+    select(models.License.id).where(
+        models.License.customer_id == models.Customer.id,
+        models.License.product_id.in_(_BRAND_PRODUCT_IDS),
+    ).exists()
+)
+_ACTIVATION_BY_MACHINE = select(models.Activation).where(
+    models.Activation.license_id == bindparam("license_id"),
+    models.Activation.machine_id == bindparam("machine_id"),
+).limit(1)
+_API_KEY_BY_ID = select(models.APIKey).where(models.APIKey.id == bindparam("api_key_id")).limit(1)
+_API_KEY_BY_ID_SCOPED = _API_KEY_BY_ID.where(models.APIKey.brand_id == bindparam("brand_id"))
+_ACTIVE_API_KEYS = select(models.APIKey).where(models.APIKey.is_active == True)
+
+def _first_entity(db: Session, statement, params: dict):
+    return db.execute(statement, params).scalars().first()
+
+def product_in_brand(db: Session, product_id: int, brand_id: Optional[int]) -> bool:
+    query = db.query(models.Product.id).filter(models.Product.id == product_id)
+    if brand_id is not None:
+        query = query.filter(models.Product.brand_id == brand_id)
+    return query.first() is not None
+
+# Table versions (ETags)
+def _increment_version(db: Session, row_name: str):
+    updated = db.query(models.TableVersion).filter(
+        models.TableVersion.table_name == row_name
+    ).update({models.TableVersion.version: models.TableVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        try:
+            with db.begin_nested():
+                db.add(models.TableVersion(table_name=row_name, version=1))
+        except IntegrityError:
+            # Another transaction created the row first
+            db.query(models.TableVersion).filter(
+                models.TableVersion.table_name == row_name
+            ).update({models.TableVersion.version: models.TableVersion.version + 1}, synchronize_session=False)
+
+def bump_table_versions(db: Session, *table_names: str):
+    """Increment the change counters for tables; committed together with the caller's write."""
+    # Read by the commit hooks in singleflight.py
+    db.info.setdefault("changed_tables", set()).update(table_names)
+    # One shard per transaction and a fixed row order, so two writers cannot deadlock
+    shard = random.randrange(TABLE_VERSION_SHARDS)
+    for table_name in sorted(set(table_names)):
+        _increment_version(db, f"{table_name}:{shard}" if table_name in SHARDED_VERSION_TABLES else table_name)
+
+def get_table_versions(db: Session, *table_names: str):
+    """Current change counters for tables (summed over shards), 0 for tables that were never written."""
+    conditions = [models.TableVersion.table_name.in_(table_names)]
+    conditions += [
+        models.TableVersion.table_name.like(f"{table_name}:%")
+        for table_name in table_names if table_name in SHARDED_VERSION_TABLES
+    ]
+    rows = db.query(models.TableVersion.table_name, models.TableVersion.version).filter(or_(*conditions)).all()
+    versions = dict.fromkeys(table_names, 0)
+    for row_name, version in rows:
+        table_name = row_name.partition(":")[0]
+        versions[table_name] += version
+    return versions
+
 # Brand CRUD
 def get_brand(db: Session, brand_id: int):
     return db.query(models.Brand).filter(models.Brand.id == brand_id).first()
@@ -12,24 +123,46 @@ def get_brand(db: Session, brand_id: int):
 def get_brand_by_name(db: Session, name: str):
     return db.query(models.Brand).filter(models.Brand.name == name).first()
 
-def get_brands(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Brand).offset(skip).limit(limit).all()
+def get_brands(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    query = db.query(models.Brand)
+    if brand_id is not None:
+        query = query.filter(models.Brand.id == brand_id)
+    return query.offset(skip).limit(limit).all()
+
+def get_brand_rows(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    """Column tuples for the brand listing fast path (see serializers.py)."""
+    query = db.query(*serializers.BRAND_COLUMNS)
+    if brand_id is not None:
+        query = query.filter(models.Brand.id == brand_id)
+    return query.offset(skip).limit(limit).all()
 
 def create_brand(db: Session, brand: schemas.BrandCreate):
     db_brand = models.Brand(name=brand.name, email=brand.email)
     db.add(db_brand)
+    bump_table_versions(db, "brands")
     db.commit()
     db.refresh(db_brand)
     logger.info(f"Brand created: {db_brand.name} (ID: {db_brand.id})")
     return db_brand
 
 # Product CRUD
-def get_products(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Product).offset(skip).limit(limit).all()
+def get_products(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    query = db.query(models.Product)
+    if brand_id is not None:
+        query = query.filter(models.Product.brand_id == brand_id)
+    return query.offset(skip).limit(limit).all()
+
+def get_product_rows(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    """Column tuples for the product listing fast path."""
+    query = db.query(*serializers.PRODUCT_COLUMNS)
+    if brand_id is not None:
+        query = query.filter(models.Product.brand_id == brand_id)
+    return query.offset(skip).limit(limit).all()
 
 def create_product(db: Session, product: schemas.ProductCreate):
     db_product = models.Product(**product.model_dump())
     db.add(db_product)
+    bump_table_versions(db, "products")
     db.commit()
     db.refresh(db_product)
     logger.info(f"Product created: {db_product.name} (ID: {db_product.id}, Brand ID: {db_product.brand_id})")
@@ -39,83 +172,243 @@ def create_product(db: Session, product: schemas.ProductCreate):
 def get_customer(db: Session, customer_id: int):
     return db.query(models.Customer).filter(models.Customer.id == customer_id).first()
 
-def get_customer_by_email(db: Session, email: str):
-    return db.query(models.Customer).filter(models.Customer.email == email).first()
+def get_customer_by_email(db: Session, email: str, brand_id: Optional[int] = None):
+    if brand_id is None:
+        return _first_entity(db, _CUSTOMER_BY_EMAIL, {"email": email})
+    return _first_entity(db, _CUSTOMER_BY_EMAIL_SCOPED, {"email": email, "brand_id": brand_id})
 
-def create_customer(db: Session, customer: schemas.CustomerCreate):
+def create_customer(db: Session, customer: schemas.CustomerCreate, brand_id: Optional[int] = None):
     db_customer = models.Customer(email=customer.email)
     db.add(db_customer)
+    db.flush()
+    if brand_id is not None:
+        db.add(models.BrandCustomer(brand_id=brand_id, customer_id=db_customer.id))
+    search.index_customer(db, db_customer)
+    bump_table_versions(db, "customers")
     db.commit()
     db.refresh(db_customer)
     return db_customer
 
+def attach_customer(db: Session, db_customer: models.Customer, brand_id: int):
+    """Let a brand license an existing customer whose email it knows."""
+    if not db.get(models.BrandCustomer, (brand_id, db_customer.id)):
+        try:
+            with db.begin_nested():
+                db.add(models.BrandCustomer(brand_id=brand_id, customer_id=db_customer.id))
+        except IntegrityError:
+            pass  # Attached concurrently
+        db.commit()
+        logger.info(f"Customer ID {db_customer.id} attached to brand ID {brand_id}")
+    return db_customer
+
+def customer_in_brand(db: Session, customer_id: int, brand_id: Optional[int]) -> bool:
+    """Whether a key may issue licenses to a customer: one its brand registered, attached or already licenses."""
+    if brand_id is None:
+        return True
+    attached = select(models.BrandCustomer.customer_id).where(
+        models.BrandCustomer.brand_id == brand_id, models.BrandCustomer.customer_id == customer_id
+    ).exists()
+    licensed = select(models.License.id).where(
+        models.License.customer_id == customer_id, models.License.product_id.in_(_brand_product_ids(brand_id))
+    ).exists()
+    return db.scalar(select(or_(attached, licensed)))
+
 # License CRUD
-def get_license(db: Session, license_id: int):
-    return db.query(models.License).filter(models.License.id == license_id).first()
+def get_license(db: Session, license_id: int, brand_id: Optional[int] = None):
+    if brand_id is None:
+        return _first_entity(db, _LICENSE_BY_ID, {"license_id": license_id})
+    return _first_entity(db, _LICENSE_BY_ID_SCOPED, {"license_id": license_id, "brand_id": brand_id})
 
-def get_license_by_key(db: Session, key: str):
-    return db.query(models.License).filter(models.License.key == key).first()
+def get_license_by_key(db: Session, key: str, brand_id: Optional[int] = None):
+    if brand_id is None:
+        return _first_entity(db, _LICENSE_BY_KEY, {"key": key})
+    return _first_entity(db, _LICENSE_BY_KEY_SCOPED, {"key": key, "brand_id": brand_id})
 
 def create_license(db: Session, license: schemas.LicenseCreate):
-    db_license = models.License(**license.model_dump())
+    license_data = license.model_dump()
+    seat_slots = license_data.pop("seat_slots")
+    db_license = models.License(**license_data)
     db.add(db_license)
+    db.flush()
+    seats.create_slots(db, db_license, seats.default_slots(db_license.max_seats) if seat_slots is None else seat_slots)
+    analytics.record_license_created(db, db_license)
+    search.index_license(db, db_license)
+    bump_table_versions(db, "licenses")
     db.commit()
     db.refresh(db_license)
     logger.info(f"License created for customer ID {db_license.customer_id}, product ID {db_license.product_id}")
     return db_license
 
-def get_licenses_by_customer(db: Session, customer_id: int):
-    return db.query(models.License).filter(models.License.customer_id == customer_id).all()
+def get_licenses_by_customer(db: Session, customer_id: int, brand_id: Optional[int] = None):
+    query = db.query(models.License).filter(models.License.customer_id == customer_id)
+    return _scope_licenses(query, brand_id).all()
+
+def get_license_rows_by_customer(db: Session, customer_id: int, brand_id: Optional[int] = None):
+    """
+    Column tuples for a customer's licenses and their activations.
+
+    Returns (license_rows, activation_rows). Activations are fetched in a
+    single IN query instead of one lazy load per license.
+    """
+    license_rows = _scope_licenses(
+        db.query(*serializers.LICENSE_COLUMNS).filter(models.License.customer_id == customer_id),
+        brand_id,
+    ).all()
+    if not license_rows:
+        return license_rows, []
+    license_ids = [row.id for row in license_rows]
+    activation_rows = db.query(*serializers.ACTIVATION_COLUMNS).filter(
+        models.Activation.license_id.in_(license_ids)
+    ).order_by(models.Activation.id).all()
+    return license_rows, activation_rows
+
+def get_license_validation_row(db: Session, key: str, brand_id: Optional[int] = None):
+    """Only the columns validate_license needs, without building an ORM object."""
+    if brand_id is None:
+        return db.execute(_VALIDATION_ROW_BY_KEY, {"key": key}).first()
+    return db.execute(_VALIDATION_ROW_BY_KEY_SCOPED, {"key": key, "brand_id": brand_id}).first()
 
 # Activation CRUD
 def get_activation(db: Session, license_id: int, machine_id: str):
-    return db.query(models.Activation).filter(
-        models.Activation.license_id == license_id,
-        models.Activation.machine_id == machine_id
-    ).first()
+    return _first_entity(db, _ACTIVATION_BY_MACHINE, {"license_id": license_id, "machine_id": machine_id})
 
 def create_activation(db: Session, license_id: int, machine_id: str, friendly_name: str = None):
+    """Claim a seat and record the activation. Returns None when the license has no free seat."""
+    db_license = get_license(db, license_id)
+    if db_license:
+        if not seats.claim_seat(db, db_license):
+            db.rollback()
+            return None
+        analytics.record_seats_changed(db, db_license.product_id, 1)
+
     db_activation = models.Activation(
         license_id=license_id,
         machine_id=machine_id,
         friendly_name=friendly_name
     )
     db.add(db_activation)
-    
-    # Increment seat count on license
-    db_license = get_license(db, license_id)
+    db.flush()
+    search.index_activation(db, db_activation)
     if db_license:
-        db_license.active_seats += 1
-        
+        webhooks.record_activated(db, db_license, db_activation)
+    bump_table_versions(db, "activations", "licenses")
     db.commit()
     db.refresh(db_activation)
     logger.info(f"License activated on machine {machine_id} for license ID {license_id}")
     return db_activation
 
-def delete_activation(db: Session, activation_id: int):
-    db_activation = db.query(models.Activation).filter(models.Activation.id == activation_id).first()
+def delete_activation(db: Session, activation_id: int, brand_id: Optional[int] = None):
+    query = db.query(models.Activation).filter(models.Activation.id == activation_id)
+    if brand_id is not None:
+        query = query.join(models.License).filter(models.License.product_id.in_(_brand_product_ids(brand_id)))
+    db_activation = query.first()
     if db_activation:
         # Decrement seat count
         db_license = get_license(db, db_activation.license_id)
-        if db_license and db_license.active_seats > 0:
-            db_license.active_seats -= 1
+        if db_license and seats.release_seats(db, db_license, 1):
+            analytics.record_seats_changed(db, db_license.product_id, -1)
+        if db_license:
+            webhooks.record_deactivated(db, db_license, db_activation)
             
+        search.remove_activations(db, [db_activation.id])
         db.delete(db_activation)
+        bump_table_versions(db, "activations", "licenses")
         db.commit()
         return True
     return False
 
+def bulk_delete_activations(db: Session, machine_id: Optional[str] = None, license_id: Optional[int] = None,
+                            activation_ids: Optional[List[int]] = None, brand_id: Optional[int] = None,
+                            batch_size: int = BULK_DEACTIVATE_BATCH_SIZE):
+    """
+    Delete activations by machine, by license or by id with set-based statements.
+
+    Each batch is one SELECT of (id, license_id), one DELETE ... WHERE id IN,
+    grouped seat-count UPDATEs and a commit, so transactions stay bounded.
+    Returns a summary dict.
+    """
+    def select_batch(chunk=None):
+        query = db.query(
+            models.Activation.id, models.Activation.license_id, models.Activation.machine_id, models.License.product_id
+        ).outerjoin(models.License, models.License.id == models.Activation.license_id)
+        if machine_id is not None:
+            query = query.filter(models.Activation.machine_id == machine_id)
+        if license_id is not None:
+            query = query.filter(models.Activation.license_id == license_id)
+        if chunk is not None:
+            query = query.filter(models.Activation.id.in_(chunk))
+        if brand_id is not None:
+            query = query.filter(models.Activation.license_id.in_(
+                select(models.License.id).where(models.License.product_id.in_(_brand_product_ids(brand_id)))
+            ))
+        return query.order_by(models.Activation.id).limit(batch_size).all()
+
+    if activation_ids is not None:
+        unique_ids = sorted(set(activation_ids))
+        chunks = (unique_ids[i:i + batch_size] for i in range(0, len(unique_ids), batch_size))
+    else:
+        chunks = None
+
+    deleted = batches = 0
+    licenses_affected = set()
+    while True:
+        if chunks is not None:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            rows = select_batch(chunk)
+        else:
+            rows = select_batch()
+            if not rows:
+                break
+        if not rows:
+            continue
+
+        ids = [row.id for row in rows]
+        counts = {}
+        for row in rows:
+            counts[row.license_id] = counts.get(row.license_id, 0) + 1
+
+        db.query(models.Activation).filter(models.Activation.id.in_(ids)).delete(synchronize_session=False)
+        search.remove_activations(db, ids)
+        webhooks.record_deactivations(db, rows)
+        for product_id, released in seats.release_seats_bulk(db, counts).items():
+            if released:
+                analytics.record_seats_changed(db, product_id, -released)
+        bump_table_versions(db, "activations", "licenses")
+        db.commit()
+
+        deleted += len(ids)
+        batches += 1
+        licenses_affected.update(counts)
+
+    logger.info(f"Bulk deactivation removed {deleted} activations across {len(licenses_affected)} licenses")
+    return {"deleted": deleted, "licenses_affected": len(licenses_affected), "batches": batches}
+
 def update_license_status(db: Session, license_id: int, is_active: bool):
     db_license = get_license(db, license_id)
     if db_license:
+        changed = db_license.is_active != is_active
+        if changed:
+            analytics.record_license_status_changed(db, db_license.product_id, is_active)
         db_license.is_active = is_active
+        if changed:
+            webhooks.record_status_changed(db, db_license)
+        if db_license.seat_slots:
+            # Refresh the snapshot so the response shows the live seat count
+            db_license.active_seats = seats.get_active_seats(db, db_license)
+        bump_table_versions(db, "licenses")
         db.commit()
         db.refresh(db_license)
         return db_license
     return None
 
-def get_customers(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Customer).offset(skip).limit(limit).all()
+def get_customers(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    return _scope_customers(db.query(models.Customer), brand_id).offset(skip).limit(limit).all()
+
+def get_customer_rows(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    """Column tuples for the customer listing fast path."""
+    return _scope_customers(db.query(*serializers.CUSTOMER_COLUMNS), brand_id).offset(skip).limit(limit).all()
 
 # API Key CRUD
 def create_api_key(db: Session, key_hash: str, api_key: schemas.APIKeyCreate):
@@ -131,17 +424,26 @@ def create_api_key(db: Session, key_hash: str, api_key: schemas.APIKeyCreate):
     db.refresh(db_api_key)
     return db_api_key
 
-def get_api_key(db: Session, api_key_id: int):
+def get_api_key(db: Session, api_key_id: int, brand_id: Optional[int] = None):
     """Get a specific API key by ID."""
-    return db.query(models.APIKey).filter(models.APIKey.id == api_key_id).first()
+    if brand_id is None:
+        return _first_entity(db, _API_KEY_BY_ID, {"api_key_id": api_key_id})
+    return _first_entity(db, _API_KEY_BY_ID_SCOPED, {"api_key_id": api_key_id, "brand_id": brand_id})
+
+def has_api_keys(db: Session) -> bool:
+    """Whether any API key was ever created, active or not."""
+    return db.query(models.APIKey.id).first() is not None
 
 def get_all_api_keys(db: Session):
     """Get all API keys (for validation purposes)."""
-    return db.query(models.APIKey).filter(models.APIKey.is_active == True).all()
+    return db.execute(_ACTIVE_API_KEYS).scalars().all()
 
-def list_api_keys(db: Session, skip: int = 0, limit: int = 100):
-    """List all API keys (for admin purposes)."""
-    return db.query(models.APIKey).offset(skip).limit(limit).all()
+def list_api_keys(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    """List all API keys (for admin purposes). Brand keys only see their brand's keys."""
+    query = db.query(models.APIKey)
+    if brand_id is not None:
+        query = query.filter(models.APIKey.brand_id == brand_id)
+    return query.offset(skip).limit(limit).all()
 
 def update_api_key_last_used(db: Session, api_key_id: int):
     """Update the last_used_at timestamp for an API key."""
@@ -152,11 +454,78 @@ def update_api_key_last_used(db: Session, api_key_id: int):
         db.commit()
     return db_api_key
 
-def revoke_api_key(db: Session, api_key_id: int):
+def revoke_api_key(db: Session, api_key_id: int, brand_id: Optional[int] = None):
     """Revoke (deactivate) an API key."""
-    db_api_key = get_api_key(db, api_key_id)
+    db_api_key = get_api_key(db, api_key_id, brand_id=brand_id)
     if db_api_key:
         db_api_key.is_active = False
         db.commit()
         db.refresh(db_api_key)
     return db_api_key
+
+# Webhook CRUD
+def create_webhook_endpoint(db: Session, endpoint: schemas.WebhookEndpointCreate, brand_id: int, secret: str):
+    db_endpoint = models.WebhookEndpoint(
+        brand_id=brand_id,
+        url=endpoint.url,
+        secret=secret,
+        event_types=",".join(endpoint.event_types) if endpoint.event_types else None,
+        max_concurrency=endpoint.max_concurrency,
+    )
+    db.add(db_endpoint)
+    db.commit()
+    db.refresh(db_endpoint)
+    logger.info(f"Webhook endpoint created for brand ID {brand_id} (ID: {db_endpoint.id})")
+    return db_endpoint
+
+def get_webhook_endpoint(db: Session, endpoint_id: int, brand_id: Optional[int] = None):
+    query = db.query(models.WebhookEndpoint).filter(models.WebhookEndpoint.id == endpoint_id)
+    if brand_id is not None:
+        query = query.filter(models.WebhookEndpoint.brand_id == brand_id)
+    return query.first()
+
+def list_webhook_endpoints(db: Session, skip: int = 0, limit: int = 100, brand_id: Optional[int] = None):
+    query = db.query(models.WebhookEndpoint)
+    if brand_id is not None:
+        query = query.filter(models.WebhookEndpoint.brand_id == brand_id)
+    return query.order_by(models.WebhookEndpoint.id).offset(skip).limit(limit).all()
+
+def disable_webhook_endpoint(db: Session, endpoint_id: int, brand_id: Optional[int] = None):
+    """Deactivate an endpoint and dead-letter its pending deliveries."""
+    db_endpoint = get_webhook_endpoint(db, endpoint_id, brand_id=brand_id)
+    if db_endpoint:
+        db_endpoint.is_active = False
+        db.query(models.WebhookDelivery).filter(
+            models.WebhookDelivery.endpoint_id == endpoint_id, models.WebhookDelivery.status == "pending"
+        ).update({
+            models.WebhookDelivery.status: "dead",
+            models.WebhookDelivery.last_error: "Endpoint disabled",
+        }, synchronize_session=False)
+        db.commit()
+        db.refresh(db_endpoint)
+    return db_endpoint
+
+def get_webhook_deliveries(db: Session, endpoint_id: int, status: Optional[str] = None, skip: int = 0, limit: int = 100):
+    query = db.query(models.WebhookDelivery).filter(models.WebhookDelivery.endpoint_id == endpoint_id)
+    if status is not None:
+        query = query.filter(models.WebhookDelivery.status == status)
+    return query.order_by(models.WebhookDelivery.id.desc()).offset(skip).limit(limit).all()
+
+def retry_webhook_delivery(db: Session, delivery_id: int, brand_id: Optional[int] = None):
+    """Requeue a dead-lettered delivery with a fresh set of attempts."""
+    from datetime import datetime
+    query = db.query(models.WebhookDelivery).join(models.WebhookEndpoint).filter(
+        models.WebhookDelivery.id == delivery_id,
+        models.WebhookDelivery.status == "dead",
+        models.WebhookEndpoint.is_active == True,
+    )
+    if brand_id is not None:
+        query = query.filter(models.WebhookEndpoint.brand_id == brand_id)
+    db_delivery = query.first()
+    if db_delivery:
+        db_delivery.status = "pending"
+        db_delivery.attempts = 0
+        db_delivery.next_attempt_at = datetime.utcnow()
+        db.commit()
+        db.refresh(db_delivery)
+    return db_delivery
@@ -0,0 +1,143 @@
+"""
+Dashboard summary in one round trip.
+
+Returns counters, the most recent licenses and activations, and compact
+id -> name maps for the dropdowns, instead of the dashboard downloading the
+full brand, product and customer lists. License and seat counters come from
+the analytics rollups; the other counts are index-only COUNTs.
+
+The maps are synced incrementally. Every response carries an opaque cursor
+(the highest brand, product, customer and license id sent so far); passing
+it back as ``since`` returns only rows added after it. Brands, products and
+customers are never updated or deleted through the API, so new ids are the
+only changes the maps can have. Each map is capped at ``limit`` rows per
+response; ``complete`` is false until the client has caught up.
+
+For a brand-scoped key a customer becomes visible when it gets one of the
+brand's licenses, which can happen long after the customer row was
+created, so scoped customer maps advance on the license id instead.
+"""
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from . import analytics, models
+
+CURSOR_PARTS = ("brands", "products", "customers", "licenses")
+
+RECENT_LICENSE_COLUMNS = (
+    models.License.id,
+    models.License.key,
+    models.License.customer_id,
+    models.License.product_id,
+    models.License.is_active,
+    models.License.created_at,
+)
+RECENT_ACTIVATION_COLUMNS = (
+    models.Activation.id,
+    models.Activation.license_id,
+    models.Activation.machine_id,
+    models.Activation.friendly_name,
+    models.Activation.activated_at,
+)
+
+
+def parse_cursor(cursor: Optional[str]) -> dict:
+    """Watermarks from a cursor string; raises ValueError when it is malformed."""
+    if not cursor:
+        return dict.fromkeys(CURSOR_PARTS, 0)
+    parts = [int(part) for part in cursor.split(".")]
+    if len(parts) != len(CURSOR_PARTS) or any(part < 0 for part in parts):
+        raise ValueError("Invalid cursor")
+    return dict(zip(CURSOR_PARTS, parts))
+
+
+def format_cursor(watermarks: dict) -> str:
+    return ".".join(str(watermarks[part]) for part in CURSOR_PARTS)
+
+
+def _brand_products(brand_id: int):
+    return select(models.Product.id).where(models.Product.brand_id == brand_id)
+
+
+def _brand_licenses(brand_id: int):
+    return select(models.License.id).where(models.License.product_id.in_(_brand_products(brand_id)))
+
+
+def _counts(db: Session, brand_id: Optional[int]) -> dict:
+    brands = select(func.count(models.Brand.id))
+    products = select(func.count(models.Product.id))
+    customers = select(func.count(models.Customer.id))
+    activations = select(func.count(models.Activation.id))
+    if brand_id is not None:
+        brands = brands.where(models.Brand.id == brand_id)
+        products = products.where(models.Product.brand_id == brand_id)
+        customers = select(func.count(func.distinct(models.License.customer_id))).where(
+            models.License.product_id.in_(_brand_products(brand_id))
+        )
+        activations = activations.where(models.Activation.license_id.in_(_brand_licenses(brand_id)))
+    counts = {
+        "brands": db.scalar(brands),
+        "products": db.scalar(products),
+        "customers": db.scalar(customers),
+        "activations": db.scalar(activations),
+        "licenses": 0,
+        "licenses_active": 0,
+        "seats_total": 0,
+        "seats_used": 0,
+    }
+    for row in analytics.get_seat_utilization(db, group_by="brand", brand_id=brand_id):
+        for field in ("licenses", "licenses_active", "seats_total", "seats_used"):
+            counts[field] += row["licenses_total" if field == "licenses" else field] or 0
+    return counts
+
+
+def summary(db: Session, since: Optional[str] = None, recent: int = 10, limit: int = 5000,
+            brand_id: Optional[int] = None) -> dict:
+    """Counters, recent items and the map rows added after the since cursor."""
+    watermarks = parse_cursor(since)
+    complete = True
+
+    def page(statement, id_column, part):
+        nonlocal complete
+        rows = db.execute(statement.where(id_column > watermarks[part]).order_by(id_column).limit(limit)).all()
+        if len(rows) == limit:
+            complete = False
+        if rows:
+            watermarks[part] = rows[-1][0]
+        return rows
+
+    brands = select(models.Brand.id, models.Brand.name)
+    products = select(models.Product.id, models.Product.name, models.Product.brand_id)
+    if brand_id is not None:
+        brands = brands.where(models.Brand.id == brand_id)
+        products = products.where(models.Product.brand_id == brand_id)
+        # The same customer may come back once per new license; the client map absorbs repeats
+        customer_rows = [row[1:] for row in page(
+            select(models.License.id, models.Customer.id, models.Customer.email)
+            .join(models.Customer, models.Customer.id == models.License.customer_id)
+            .where(models.License.product_id.in_(_brand_products(brand_id))),
+            models.License.id, "licenses",
+        )]
+    else:
+        customer_rows = page(select(models.Customer.id, models.Customer.email), models.Customer.id, "customers")
+
+    recent_licenses = select(*RECENT_LICENSE_COLUMNS).order_by(models.License.id.desc()).limit(recent)
+    recent_activations = select(*RECENT_ACTIVATION_COLUMNS).order_by(models.Activation.id.desc()).limit(recent)
+    if brand_id is not None:
+        recent_licenses = recent_licenses.where(models.License.product_id.in_(_brand_products(brand_id)))
+        recent_activations = recent_activations.where(models.Activation.license_id.in_(_brand_licenses(brand_id)))
+
+    return {
+        "brands": {str(row.id): row.name for row in page(brands, models.Brand.id, "brands")},
+        "products": {
+            str(row.id): {"name": row.name, "brand_id": row.brand_id}
+            for row in page(products, models.Product.id, "products")
+        },
+        "customers": {str(customer_id): email for customer_id, email in customer_rows},
+        "cursor": format_cursor(watermarks),
+        "complete": complete,
+        "counts": _counts(db, brand_id),
+        "recent_licenses": [row._asdict() for row in db.execute(recent_licenses)],
+        "recent_activations": [row._asdict() for row in db.execute(recent_activations)],
+    }
@@ -10,19 +10,47 @@ load_dotenv()
 # Get database URL from environment variable, fallback to SQLite for development
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./license_system.db")
 
+# Compiled-statement cache entries per engine (SQLAlchemy default is 500)
+QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+
+# Connection budget for the whole deployment. Every worker process has its own
+# pool (the webhook dispatcher draws from it too), so each gets an equal share,
+# capped at the single-process default of 10 + 20 overflow. Keep the budget
+# below PostgreSQL's max_connections (100 by default) minus room for CLIs.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "80"))
+
+
+def pool_limits() -> tuple:
+    """(pool_size, max_overflow) for this worker; DB_POOL_SIZE / DB_MAX_OVERFLOW override the share."""
+    workers = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+    share = min(max(DB_MAX_CONNECTIONS // workers, 2), 30)
+    pool_size = int(os.getenv("DB_POOL_SIZE", str(max(share // 3, 1))))
+    max_overflow = int(os.getenv("DB_MAX_OVERFLOW", str(max(share - pool_size, 0))))
+    return pool_size, max_overflow
+
+
 # Create engine with appropriate settings
 if DATABASE_URL.startswith("postgresql"):
+    connect_args = {}
+    if DATABASE_URL.startswith("postgresql+psycopg:"):
+        # psycopg 3 prepares a statement server-side once it has run this many
+        # times on a connection (0 = always). psycopg2 has no server-side prepare.
+        connect_args["prepare_threshold"] = int(os.getenv("DB_PREPARE_THRESHOLD", "1"))
+    pool_size, max_overflow = pool_limits()
     engine = create_engine(
         DATABASE_URL,
         pool_pre_ping=True,  # Verify connections before using
-        pool_size=10,        # Connection pool size
-        max_overflow=20      # Max overflow connections
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        query_cache_size=QUERY_CACHE_SIZE,
+        connect_args=connect_args,
     )
 else:
     # SQLite settings
     engine = create_engine(
         DATABASE_URL,
-        connect_args={"check_same_thread": False}
+        connect_args={"check_same_thread": False},
+        query_cache_size=QUERY_CACHE_SIZE,
     )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
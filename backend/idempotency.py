@@ -0,0 +1,159 @@
+"""
+Idempotency-Key store for mutating endpoints.
+
+The first request with a given key inserts an ``in_progress`` claim row; the
+primary key on ``key_hash`` guarantees only one concurrent duplicate wins
+that insert and executes. The others see the claim and wait, then replay
+the stored response once the winner completes. Records expire after a TTL
+and are purged lazily.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from typing import Optional
+import hashlib
+import logging
+import os
+import time
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# A claim older than this is treated as abandoned (e.g. the worker died)
+IDEMPOTENCY_LOCK_TIMEOUT_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT_SECONDS", "60"))
+PURGE_INTERVAL_SECONDS = 60
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# Outcomes of IdempotencyStore.begin()
+EXECUTE = "execute"
+REPLAY = "replay"
+MISMATCH = "mismatch"
+BUSY = "busy"
+
+
+@dataclass
+class Outcome:
+    action: str
+    status_code: Optional[int] = None
+    content_type: Optional[str] = None
+    body: Optional[bytes] = None
+
+
+def hash_key(api_key: str, idempotency_key: str) -> str:
+    """Scope the client's key to the calling API key."""
+    return hashlib.sha256(f"{api_key}\0{idempotency_key}".encode()).hexdigest()
+
+
+def hash_request(method: str, path: str, body: bytes) -> str:
+    digest = hashlib.sha256(f"{method} {path}\0".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """Database-backed idempotency records, shared by all workers."""
+
+    def __init__(self, session_factory, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS,
+                 lock_timeout_seconds: int = IDEMPOTENCY_LOCK_TIMEOUT_SECONDS):
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.lock_timeout = timedelta(seconds=lock_timeout_seconds)
+        self._last_purge = 0.0
+
+    def begin(self, key_hash: str, request_hash: str) -> Outcome:
+        """Claim the key for execution, or report how to answer a duplicate."""
+        self._maybe_purge()
+        db = self.session_factory()
+        try:
+            for _ in range(3):
+                now = datetime.utcnow()
+                db.add(models.IdempotencyRecord(
+                    key_hash=key_hash,
+                    request_hash=request_hash,
+                    status=IN_PROGRESS,
+                    created_at=now,
+                    expires_at=now + self.ttl,
+                ))
+                try:
+                    db.commit()
+                    return Outcome(EXECUTE)
+                except IntegrityError:
+                    db.rollback()
+
+                record = db.get(models.IdempotencyRecord, key_hash)
+                if record is None:
+                    continue  # Purged between our insert and read
+                if record.expires_at < now:
+                    db.delete(record)
+                    db.commit()
+                    continue
+                if record.request_hash != request_hash:
+                    return Outcome(MISMATCH)
+                if record.status == COMPLETED:
+                    return Outcome(REPLAY, record.status_code, record.content_type, record.response_body)
+                if record.created_at + self.lock_timeout < now:
+                    # Take over an abandoned claim; the guarded UPDATE lets only one waiter win
+                    taken = db.query(models.IdempotencyRecord).filter(
+                        models.IdempotencyRecord.key_hash == key_hash,
+                        models.IdempotencyRecord.status == IN_PROGRESS,
+                        models.IdempotencyRecord.created_at == record.created_at,
+                    ).update({models.IdempotencyRecord.created_at: now}, synchronize_session=False)
+                    db.commit()
+                    if taken:
+                        logger.warning("Took over abandoned idempotency claim", extra={"key_hash": key_hash[:12]})
+                        return Outcome(EXECUTE)
+                return Outcome(BUSY)
+            return Outcome(BUSY)
+        finally:
+            db.close()
+
+    def complete(self, key_hash: str, status_code: int, content_type: Optional[str], body: bytes):
+        """Store the response so duplicates replay it."""
+        db = self.session_factory()
+        try:
+            db.query(models.IdempotencyRecord).filter(
+                models.IdempotencyRecord.key_hash == key_hash
+            ).update({
+                models.IdempotencyRecord.status: COMPLETED,
+                models.IdempotencyRecord.status_code: status_code,
+                models.IdempotencyRecord.content_type: content_type,
+                models.IdempotencyRecord.response_body: body,
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def release(self, key_hash: str):
+        """Drop a claim whose request failed, so a retry can execute again."""
+        db = self.session_factory()
+        try:
+            db.query(models.IdempotencyRecord).filter(
+                models.IdempotencyRecord.key_hash == key_hash,
+                models.IdempotencyRecord.status == IN_PROGRESS,
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def purge_expired(self) -> int:
+        db = self.session_factory()
+        try:
+            deleted = db.query(models.IdempotencyRecord).filter(
+                models.IdempotencyRecord.expires_at < datetime.utcnow()
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge >= PURGE_INTERVAL_SECONDS:
+            self._last_purge = now
+            deleted = self.purge_expired()
+            if deleted:
+                logger.info("Purged expired idempotency records", extra={"count": deleted})
@@ -1,14 +1,19 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Security
 from sqlalchemy.orm import Session
-from typing import List
-from . import crud, models, schemas, auth
+from typing import List, Literal, Optional
+import datetime
+from . import crud, models, schemas, auth, serializers, caching, analytics, dashboard, migrate, search, webhooks
 from .database import SessionLocal, engine
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from .logging_config import setup_logging, get_logger
-from .middleware import RequestIDMiddleware, LoggingMiddleware
+from .middleware import RequestIDMiddleware, LoggingMiddleware, IdempotencyMiddleware, AdmissionControlMiddleware
+from .idempotency import IdempotencyStore
+from .singleflight import SingleFlight, invalidate_on_commit
+from contextlib import asynccontextmanager
+import asyncio
 import uuid
 import os
 
@@ -20,15 +25,43 @@ models.Base.metadata.create_all(bind=engine)
 
 logger.info("Database tables created/verified")
 
+# Indexes added to existing tables are built by an explicit command, never at boot
+_missing_indexes = migrate.missing_indexes(engine)
+if _missing_indexes:
+    logger.warning(f"Indexes missing, run `python -m backend.migrate`: {', '.join(_missing_indexes)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Deliver webhooks from the outbox in the background; claims are leased, so every worker can run one
+    dispatcher_task = None
+    if os.getenv("WEBHOOK_DISPATCHER_ENABLED", "true").lower() == "true":
+        dispatcher_task = asyncio.create_task(webhooks.Dispatcher(SessionLocal).run_forever())
+    yield
+    if dispatcher_task is not None:
+        dispatcher_task.cancel()
+        try:
+            await dispatcher_task
+        except asyncio.CancelledError:
+            pass
+
 # Rate limiting configuration
 limiter = Limiter(key_func=get_remote_address)
 app = FastAPI(
     title=os.getenv("APP_NAME", "Centralized License System"),
-    version=os.getenv("APP_VERSION", "1.0.0")
+    version=os.getenv("APP_VERSION", "1.0.0"),
+    lifespan=lifespan,
 )
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# Idempotency-Key replay for mutating requests (innermost, so replays are still logged)
+app.state.idempotency_store = IdempotencyStore(SessionLocal)
+app.add_middleware(IdempotencyMiddleware)
+
+# Adaptive admission control: sheds low-priority routes first under overload
+if os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true":
+    app.add_middleware(AdmissionControlMiddleware)
+
 # Add logging middleware
 app.add_middleware(RequestIDMiddleware)
 app.add_middleware(LoggingMiddleware)
@@ -44,6 +77,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Coalesce concurrent identical validations (e.g. a fleet restart) into one lookup
+validation_flight = SingleFlight(
+    window_seconds=float(os.getenv("VALIDATE_COALESCE_WINDOW_MS", "0")) / 1000,
+    max_keys=int(os.getenv("VALIDATE_COALESCE_MAX_KEYS", "10000")),
+)
+invalidate_on_commit(validation_flight, "licenses")
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -58,10 +98,20 @@ def read_root():
     return {"message": "Welcome to the Centralized License System API", "docs": "/docs", "status": "healthy"}
 
 # API Key Management Endpoints
+def get_api_key_creator(db: Session = Depends(get_db), plain_key: Optional[str] = Security(auth.api_key_header)) -> Optional[models.APIKey]:
+    """The key calling POST /api-keys/, or None while no key exists yet (bootstrapping the first admin key)."""
+    if not crud.has_api_keys(db):
+        return None
+    return auth.authenticate(db, plain_key)
+
 @app.post("/api-keys/", response_model=schemas.APIKeyResponse)
 @limiter.limit(f"{os.getenv('RATE_LIMIT_AUTH', '10')}/minute")
-def create_api_key(request: Request, api_key: schemas.APIKeyCreate, db: Session = Depends(get_db)):
+def create_api_key(request: Request, api_key: schemas.APIKeyCreate, db: Session = Depends(get_db), caller: Optional[models.APIKey] = Depends(get_api_key_creator)):
     """Generate a new API key. The plain key is only shown once!"""
+    # Brand keys may only mint keys for their own brand; admin keys come from admin keys
+    if caller is not None and caller.brand_id is not None and api_key.brand_id != caller.brand_id:
+        raise HTTPException(status_code=403, detail="API key is not authorized for this brand")
+
     # Generate plain API key
     plain_key = auth.generate_api_key()
     
@@ -85,13 +135,13 @@ def create_api_key(request: Request, api_key: schemas.APIKeyCreate, db: Session
 @limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
 def list_api_keys(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
     """List all API keys (requires authentication)"""
-    return crud.list_api_keys(db, skip=skip, limit=limit)
+    return crud.list_api_keys(db, skip=skip, limit=limit, brand_id=api_key.brand_id)
 
 @app.delete("/api-keys/{api_key_id}")
 @limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
 def revoke_api_key(request: Request, api_key_id: int, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
     """Revoke (deactivate) an API key"""
-    db_api_key = crud.revoke_api_key(db, api_key_id=api_key_id)
+    db_api_key = crud.revoke_api_key(db, api_key_id=api_key_id, brand_id=api_key.brand_id)
     if not db_api_key:
         raise HTTPException(status_code=404, detail="API key not found")
     return {"detail": "API key revoked"}
@@ -100,6 +150,8 @@ def revoke_api_key(request: Request, api_key_id: int, db: Session = Depends(get_
 @app.post("/brands/", response_model=schemas.Brand)
 @limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
 def create_brand(request: Request, brand: schemas.BrandCreate, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    if api_key.brand_id is not None:
+        raise HTTPException(status_code=403, detail="Brand-scoped API keys cannot create brands")
     db_brand = crud.get_brand_by_name(db, name=brand.name)
     if db_brand:
         raise HTTPException(status_code=400, detail="Brand already registered")
@@ -108,44 +160,76 @@ def create_brand(request: Request, brand: schemas.BrandCreate, db: Session = Dep
 @app.get("/brands/", response_model=List[schemas.Brand])
 @limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
 def read_brands(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    brands = crud.get_brands(db, skip=skip, limit=limit)
-    return brands
+    etag = caching.compute_etag(request, crud.get_table_versions(db, "brands"), scope=api_key.brand_id)
+    if caching.is_not_modified(request, etag):
+        return caching.not_modified_response(etag)
+    rows = crud.get_brand_rows(db, skip=skip, limit=limit, brand_id=api_key.brand_id)
+    return serializers.json_response(
+        serializers.rows_to_dicts(rows, serializers.BRAND_FIELDS), headers=caching.cache_headers(etag)
+    )
 
 # Product Endpoints
 @app.post("/products/", response_model=schemas.Product)
 @limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
 def create_product(request: Request, product: schemas.ProductCreate, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    if api_key.brand_id is not None and product.brand_id != api_key.brand_id:
+        raise HTTPException(status_code=403, detail="API key is not authorized for this brand")
     return crud.create_product(db=db, product=product)
 
 @app.get("/products/", response_model=List[schemas.Product])
 @limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
 def read_products(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    products = crud.get_products(db, skip=skip, limit=limit)
-    return products
+    etag = caching.compute_etag(request, crud.get_table_versions(db, "products"), scope=api_key.brand_id)
+    if caching.is_not_modified(request, etag):
+        return caching.not_modified_response(etag)
+    rows = crud.get_product_rows(db, skip=skip, limit=limit, brand_id=api_key.brand_id)
+    return serializers.json_response(
+        serializers.rows_to_dicts(rows, serializers.PRODUCT_FIELDS), headers=caching.cache_headers(etag)
+    )
 
 # Customer Endpoints
 @app.post("/customers/", response_model=schemas.Customer)
 @limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
 def create_customer(request: Request, customer: schemas.CustomerCreate, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    """Register a customer. A brand key gets the existing customer for a known email, attached to its brand."""
     db_customer = crud.get_customer_by_email(db, email=customer.email)
     if db_customer:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_customer(db=db, customer=customer)
+        if api_key.brand_id is None:
+            raise HTTPException(status_code=400, detail="Email already registered")
+        return crud.attach_customer(db, db_customer, brand_id=api_key.brand_id)
+    return crud.create_customer(db=db, customer=customer, brand_id=api_key.brand_id)
 
 @app.get("/customers/", response_model=List[schemas.Customer])
 @limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
 def read_customers(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    customers = crud.get_customers(db, skip=skip, limit=limit)
-    return customers
+    # Brand-scoped customer visibility follows license issuance
+    etag = caching.compute_etag(request, crud.get_table_versions(db, "customers", "licenses"), scope=api_key.brand_id)
+    if caching.is_not_modified(request, etag):
+        return caching.not_modified_response(etag)
+    rows = crud.get_customer_rows(db, skip=skip, limit=limit, brand_id=api_key.brand_id)
+    return serializers.json_response(
+        serializers.rows_to_dicts(rows, serializers.CUSTOMER_FIELDS), headers=caching.cache_headers(etag)
+    )
 
 
 @app.get("/customers/{email}/licenses", response_model=List[schemas.License])
 @limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
 def read_customer_licenses(request: Request, email: str, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    db_customer = crud.get_customer_by_email(db, email=email)
+    # The email is part of the URL, so it is covered by the ETag
+    etag = caching.compute_etag(
+        request, crud.get_table_versions(db, "customers", "licenses", "activations"), scope=api_key.brand_id
+    )
+    if caching.is_not_modified(request, etag):
+        return caching.not_modified_response(etag)
+    db_customer = crud.get_customer_by_email(db, email=email, brand_id=api_key.brand_id)
     if not db_customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return crud.get_licenses_by_customer(db, customer_id=db_customer.id)
+    license_rows, activation_rows = crud.get_license_rows_by_customer(
+        db, customer_id=db_customer.id, brand_id=api_key.brand_id
+    )
+    return serializers.json_response(
+        serializers.licenses_to_dicts(license_rows, activation_rows), headers=caching.cache_headers(etag)
+    )
 
 
 # License Endpoints
@@ -158,6 +242,13 @@ def create_license(request: Request, license: schemas.LicenseCreate, db: Session
     if not license.key:
          license.key = str(uuid.uuid4())
     
+    if not crud.product_in_brand(db, product_id=license.product_id, brand_id=api_key.brand_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    # Brand keys cannot reach customers by id alone; they register or attach them by email first
+    if not crud.customer_in_brand(db, customer_id=license.customer_id, brand_id=api_key.brand_id):
+        raise HTTPException(status_code=404, detail="Customer not found")
+
+    # Keys are unique across all brands, so the duplicate check is not scoped
     db_license = crud.get_license_by_key(db, key=license.key)
     if db_license:
         raise HTTPException(status_code=400, detail="License key already exists")
@@ -166,7 +257,10 @@ def create_license(request: Request, license: schemas.LicenseCreate, db: Session
 @app.post("/licenses/validate", response_model=dict)
 @limiter.limit(f"{os.getenv('RATE_LIMIT_LICENSE', '60')}/minute")
 def validate_license(request: Request, validation: schemas.LicenseValidate, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    db_license = crud.get_license_by_key(db, key=validation.key)
+    db_license = validation_flight.do(
+        (validation.key, validation.product_id, api_key.brand_id),
+        lambda: crud.get_license_validation_row(db, key=validation.key, brand_id=api_key.brand_id),
+    )
     if not db_license:
         raise HTTPException(status_code=404, detail="License not found")
     
@@ -174,20 +268,20 @@ def validate_license(request: Request, validation: schemas.LicenseValidate, db:
          raise HTTPException(status_code=400, detail="License invalid for this product")
 
     if not db_license.is_active:
-         return {"valid": False, "reason": "License is inactive"}
+         return serializers.json_response({"valid": False, "reason": "License is inactive"})
     
     # Check expiration if set
     if db_license.expiration_date:
         import datetime
         if db_license.expiration_date < datetime.datetime.utcnow():
-             return {"valid": False, "reason": "License expired"}
+             return serializers.json_response({"valid": False, "reason": "License expired"})
 
-    return {"valid": True, "seats_available": db_license.max_seats - db_license.active_seats, "activations_count": db_license.active_seats}
+    return serializers.json_response({"valid": True, "seats_available": db_license.max_seats - db_license.active_seats, "activations_count": db_license.active_seats})
 
 @app.put("/licenses/{license_id}/suspend", response_model=schemas.License)
 @limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
 def suspend_license(request: Request, license_id: int, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    db_license = crud.get_license(db, license_id=license_id)
+    db_license = crud.get_license(db, license_id=license_id, brand_id=api_key.brand_id)
     if not db_license:
         raise HTTPException(status_code=404, detail="License not found")
     return crud.update_license_status(db=db, license_id=license_id, is_active=False)
@@ -195,7 +289,7 @@ def suspend_license(request: Request, license_id: int, db: Session = Depends(get
 @app.put("/licenses/{license_id}/resume", response_model=schemas.License)
 @limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
 def resume_license(request: Request, license_id: int, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    db_license = crud.get_license(db, license_id=license_id)
+    db_license = crud.get_license(db, license_id=license_id, brand_id=api_key.brand_id)
     if not db_license:
         raise HTTPException(status_code=404, detail="License not found")
     return crud.update_license_status(db=db, license_id=license_id, is_active=True)
@@ -205,7 +299,7 @@ def resume_license(request: Request, license_id: int, db: Session = Depends(get_
 @limiter.limit(f"{os.getenv('RATE_LIMIT_LICENSE', '60')}/minute")
 def activate_license(request: Request, activation: schemas.ActivationCreate, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
     # 1. Find License
-    db_license = crud.get_license_by_key(db, key=activation.license_key)
+    db_license = crud.get_license_by_key(db, key=activation.license_key, brand_id=api_key.brand_id)
     if not db_license:
          raise HTTPException(status_code=404, detail="License not found")
     
@@ -223,19 +317,118 @@ def activate_license(request: Request, activation: schemas.ActivationCreate, db:
     if existing_activation:
         return existing_activation
 
-    # 4. Check Seats
-    if db_license.active_seats >= db_license.max_seats:
+    # 4. Claim a seat and create the activation (the seat check is part of the claim)
+    db_activation = crud.create_activation(db=db, license_id=db_license.id, machine_id=activation.machine_id, friendly_name=activation.friendly_name)
+    if db_activation is None:
          raise HTTPException(status_code=400, detail="Max seats reached")
+    return db_activation
 
-    # 5. Create Activation
-    return crud.create_activation(db=db, license_id=db_license.id, machine_id=activation.machine_id, friendly_name=activation.friendly_name)
+@app.post("/activations/bulk-deactivate", response_model=schemas.BulkDeactivateResult)
+@limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
+def bulk_deactivate(request: Request, selection: schemas.BulkDeactivate, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    """Deactivate all activations of a machine, of a license, or a list of activation ids"""
+    if selection.license_id is not None and not crud.get_license(db, license_id=selection.license_id, brand_id=api_key.brand_id):
+        raise HTTPException(status_code=404, detail="License not found")
+    return crud.bulk_delete_activations(
+        db,
+        machine_id=selection.machine_id,
+        license_id=selection.license_id,
+        activation_ids=selection.activation_ids,
+        brand_id=api_key.brand_id,
+    )
 
 @app.delete("/activations/{activation_id}")
 @limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
 def delete_activation(request: Request, activation_id: int, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
-    success = crud.delete_activation(db, activation_id=activation_id)
+    success = crud.delete_activation(db, activation_id=activation_id, brand_id=api_key.brand_id)
     if not success:
         raise HTTPException(status_code=404, detail="Activation not found")
     return {"detail": "Activation deleted"}
 
 
+
+# Analytics Endpoints (read only the rollup tables)
+@app.get("/analytics/seat-utilization", response_model=List[schemas.SeatUtilization])
+@limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
+def read_seat_utilization(request: Request, group_by: Literal["product", "brand"] = "product", db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    return analytics.get_seat_utilization(db, group_by=group_by, brand_id=api_key.brand_id)
+
+@app.get("/analytics/activations", response_model=List[schemas.ActivationCount])
+@limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
+def read_activation_counts(request: Request, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, product_id: Optional[int] = None, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    return analytics.get_activation_counts(db, start=start, end=end, product_id=product_id, brand_id=api_key.brand_id)
+
+@app.get("/analytics/expirations", response_model=List[schemas.ExpiryCount])
+@limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
+def read_expirations(request: Request, start_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"), end_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"), product_id: Optional[int] = None, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    return analytics.get_expirations(db, start_month=start_month, end_month=end_month, product_id=product_id, brand_id=api_key.brand_id)
+
+# Webhook Endpoints
+@app.post("/webhooks/", response_model=schemas.WebhookEndpointResponse)
+@limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
+def create_webhook_endpoint(request: Request, endpoint: schemas.WebhookEndpointCreate, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    """Register a webhook endpoint. The signing secret is only shown once!"""
+    brand_id = endpoint.brand_id if endpoint.brand_id is not None else api_key.brand_id
+    if brand_id is None:
+        raise HTTPException(status_code=422, detail="brand_id is required")
+    if api_key.brand_id is not None and brand_id != api_key.brand_id:
+        raise HTTPException(status_code=403, detail="API key is not authorized for this brand")
+    if not crud.get_brand(db, brand_id=brand_id):
+        raise HTTPException(status_code=404, detail="Brand not found")
+    try:
+        webhooks.check_url(endpoint.url)
+    except webhooks.UnsafeTargetError as exc:
+        raise HTTPException(status_code=400, detail=f"Webhook URL is not allowed: {exc}")
+    db_endpoint = crud.create_webhook_endpoint(db, endpoint, brand_id=brand_id, secret=webhooks.generate_secret())
+    return schemas.WebhookEndpointResponse.model_validate(db_endpoint)
+
+@app.get("/webhooks/", response_model=List[schemas.WebhookEndpoint])
+@limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
+def list_webhook_endpoints(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    return crud.list_webhook_endpoints(db, skip=skip, limit=limit, brand_id=api_key.brand_id)
+
+@app.delete("/webhooks/{endpoint_id}", response_model=schemas.WebhookEndpoint)
+@limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
+def disable_webhook_endpoint(request: Request, endpoint_id: int, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    """Stop delivering to an endpoint; its pending deliveries are dead-lettered"""
+    db_endpoint = crud.disable_webhook_endpoint(db, endpoint_id=endpoint_id, brand_id=api_key.brand_id)
+    if not db_endpoint:
+        raise HTTPException(status_code=404, detail="Webhook endpoint not found")
+    return db_endpoint
+
+@app.get("/webhooks/{endpoint_id}/deliveries", response_model=List[schemas.WebhookDelivery])
+@limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
+def read_webhook_deliveries(request: Request, endpoint_id: int, status: Optional[Literal["pending", "delivered", "dead"]] = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    if not crud.get_webhook_endpoint(db, endpoint_id=endpoint_id, brand_id=api_key.brand_id):
+        raise HTTPException(status_code=404, detail="Webhook endpoint not found")
+    return crud.get_webhook_deliveries(db, endpoint_id=endpoint_id, status=status, skip=skip, limit=limit)
+
+@app.post("/webhooks/deliveries/{delivery_id}/retry", response_model=schemas.WebhookDelivery)
+@limiter.limit(f"{os.getenv('RATE_LIMIT_WRITE', '30')}/minute")
+def retry_webhook_delivery(request: Request, delivery_id: int, db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    """Requeue a dead-lettered delivery"""
+    db_delivery = crud.retry_webhook_delivery(db, delivery_id=delivery_id, brand_id=api_key.brand_id)
+    if not db_delivery:
+        raise HTTPException(status_code=404, detail="Dead-lettered delivery not found")
+    return db_delivery
+
+# Dashboard
+@app.get("/dashboard/summary", response_model=schemas.DashboardSummary)
+@limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
+def read_dashboard_summary(request: Request, since: Optional[str] = None, recent: int = Query(10, ge=0, le=100), limit: int = Query(5000, ge=1, le=50000), db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    versions = crud.get_table_versions(db, "brands", "products", "customers", "licenses", "activations")
+    etag = caching.compute_etag(request, versions, scope=api_key.brand_id)
+    if caching.is_not_modified(request, etag):
+        return caching.not_modified_response(etag)
+    try:
+        content = dashboard.summary(db, since=since, recent=recent, limit=limit, brand_id=api_key.brand_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return serializers.json_response(content, headers=caching.cache_headers(etag))
+
+# Search
+@app.get("/search", response_model=List[schemas.SearchHit])
+@limiter.limit(f"{os.getenv('RATE_LIMIT_READ', '100')}/minute")
+def search_records(request: Request, q: str = Query(..., min_length=search.MIN_TERM_LENGTH, max_length=256), kind: Optional[List[Literal["customer", "license", "activation"]]] = Query(None), skip: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db), api_key: models.APIKey = Depends(auth.get_api_key)):
+    rows = search.search(db, term=q, kinds=kind, skip=skip, limit=limit, brand_id=api_key.brand_id)
+    return serializers.json_response(serializers.rows_to_dicts(rows, serializers.SEARCH_FIELDS))
@@ -1,9 +1,14 @@
 from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp
+from . import admission, idempotency
+import asyncio
 import uuid
 import time
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -96,3 +101,126 @@ class LoggingMiddleware(BaseHTTPMiddleware):
                 exc_info=True
             )
             raise
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    """
+    Replay the stored response for mutating requests that repeat an Idempotency-Key.
+
+    Concurrent duplicates wait (up to IDEMPOTENCY_WAIT_SECONDS) for the request
+    that claimed the key, then replay its response. The store is read from
+    ``app.state.idempotency_store``.
+    """
+
+    METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+    # Never persist one-time secrets (plain API keys, webhook signing secrets)
+    EXCLUDED_PATHS = {"/api-keys/", "/webhooks/"}
+    MAX_KEY_LENGTH = 255
+    WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+    POLL_SECONDS = 0.05
+
+    async def dispatch(self, request: Request, call_next):
+        key = request.headers.get("Idempotency-Key")
+        if not key or request.method not in self.METHODS or request.url.path in self.EXCLUDED_PATHS:
+            return await call_next(request)
+
+        if len(key) > self.MAX_KEY_LENGTH:
+            return JSONResponse(status_code=400, content={"detail": "Idempotency-Key is too long"})
+
+        store = request.app.state.idempotency_store
+        body = await request.body()
+        key_hash = idempotency.hash_key(request.headers.get("X-API-Key", ""), key)
+        request_hash = idempotency.hash_request(request.method, request.url.path, body)
+
+        deadline = time.monotonic() + self.WAIT_SECONDS
+        outcome = await run_in_threadpool(store.begin, key_hash, request_hash)
+        while outcome.action == idempotency.BUSY and time.monotonic() < deadline:
+            await asyncio.sleep(self.POLL_SECONDS)
+            outcome = await run_in_threadpool(store.begin, key_hash, request_hash)
+
+        if outcome.action == idempotency.REPLAY:
+            logger.info("Idempotent replay", extra={"path": request.url.path, "status_code": outcome.status_code})
+            return Response(
+                content=outcome.body,
+                status_code=outcome.status_code,
+                media_type=outcome.content_type,
+                headers={"Idempotent-Replayed": "true"},
+            )
+        if outcome.action == idempotency.MISMATCH:
+            return JSONResponse(
+                status_code=422,
+                content={"detail": "Idempotency-Key was already used with a different request"},
+            )
+        if outcome.action == idempotency.BUSY:
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "A request with this Idempotency-Key is still in progress"},
+                headers={"Retry-After": "1"},
+            )
+
+        try:
+            response = await call_next(request)
+        except Exception:
+            await run_in_threadpool(store.release, key_hash)
+            raise
+
+        response_body = b"".join([chunk async for chunk in response.body_iterator])
+        if self._is_final(response.status_code):
+            await run_in_threadpool(
+                store.complete, key_hash, response.status_code, response.headers.get("content-type"), response_body
+            )
+        else:
+            await run_in_threadpool(store.release, key_hash)
+
+        buffered = Response(content=response_body, status_code=response.status_code)
+        # The raw list keeps repeated headers (Set-Cookie, Vary) that a dict would collapse
+        buffered.raw_headers = list(response.headers.raw)
+        return buffered
+
+    @staticmethod
+    def _is_final(status_code: int) -> bool:
+        """Transient failures (auth, conflicts, rate limits, server errors) may be retried for real."""
+        return status_code < 500 and status_code not in (401, 403, 409, 429)
+
+
+class AdmissionControlMiddleware(BaseHTTPMiddleware):
+    """
+    Bound in-flight requests with an adaptive limit and shed low-priority work first.
+
+    Requests that cannot be admitted within their class's queueing time get
+    503 with Retry-After. Runs in front of the slowapi per-client limits.
+    """
+
+    EXEMPT_PATHS = {"/", "/docs", "/redoc", "/openapi.json"}
+    RETRY_AFTER_SECONDS = os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1")
+
+    def __init__(self, app: ASGIApp, limiter: admission.AdaptiveConcurrencyLimiter = None):
+        super().__init__(app)
+        self.limiter = limiter or admission.AdaptiveConcurrencyLimiter.from_env()
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path in self.EXEMPT_PATHS or request.method == "OPTIONS":
+            return await call_next(request)
+
+        priority = admission.classify(request.method, request.url.path)
+        if not await self.limiter.acquire(priority):
+            logger.warning(
+                "Request shed by admission control",
+                extra={
+                    "path": request.url.path,
+                    "priority": priority.name,
+                    "limit": round(self.limiter.limit, 2),
+                    "inflight": self.limiter.inflight,
+                },
+            )
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "Server is overloaded, please retry later"},
+                headers={"Retry-After": self.RETRY_AFTER_SECONDS},
+            )
+
+        start_time = time.monotonic()
+        try:
+            return await call_next(request)
+        finally:
+            await self.limiter.release(time.monotonic() - start_time)
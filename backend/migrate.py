@@ -0,0 +1,157 @@
+"""
+Indexes for existing databases.
+
+create_all creates missing tables with their indexes, but it never touches
+a table that already exists. Indexes declared on existing tables since
+(e.g. ``licenses(product_id, customer_id)``) are built by this command and
+not at startup, where every worker would block on building them over a
+large table.
+
+On PostgreSQL each index is built with ``CREATE INDEX CONCURRENTLY IF NOT
+EXISTS``, which does not lock out writes. A concurrent build that failed
+leaves an invalid index behind; it is dropped and built again. Two runs
+racing are fine: the loser sees the index and moves on. The trigram
+indexes are left to ``python -m backend.search rebuild``.
+
+Some indexes need the data cleaned up first. The unique index on
+``license.expired`` events fails to build while an older release's
+concurrent expiry scans have left duplicates behind, so those are removed
+right before it is built: the first event per license is kept, pending
+deliveries of the others are dropped (they would announce the expiry again)
+and sent or dead ones are moved onto the kept event.
+
+The API logs a warning at startup while indexes are missing.
+
+Usage:
+    python -m backend.migrate
+"""
+from sqlalchemy import delete, func, inspect, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+from typing import List
+import argparse
+import logging
+
+from . import models
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+EXPIRED = "license.expired"
+
+
+def _declared_indexes():
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if not index.name.endswith("_trgm"):
+                yield index
+
+
+def _existing(connection, table_name: str) -> set:
+    return {index["name"] for index in inspect(connection).get_indexes(table_name)}
+
+
+def missing_indexes(engine: Engine) -> List[str]:
+    """Names of declared indexes that the database does not have yet."""
+    with engine.connect() as connection:
+        tables = set(inspect(connection).get_table_names())
+        existing = {}
+        missing = []
+        for index in _declared_indexes():
+            name = index.table.name
+            if name not in tables:
+                continue
+            if name not in existing:
+                existing[name] = _existing(connection, name)
+            if index.name not in existing[name]:
+                missing.append(index.name)
+        return missing
+
+
+def _drop_invalid(connection, index_name: str):
+    """Drop the leftover of a concurrent build that failed, so it can be built again."""
+    invalid = connection.exec_driver_sql(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+        "WHERE pg_class.relname = %(name)s AND NOT pg_index.indisvalid",
+        {"name": index_name},
+    ).scalar()
+    if invalid:
+        logger.warning("Dropping invalid index %s left by a failed build", index_name)
+        connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"')
+
+
+def _dedupe_expired_events(connection) -> int:
+    """Keep the first license.expired event per license; returns the number of duplicates removed."""
+    events = models.OutboxEvent.__table__
+    deliveries = models.WebhookDelivery.__table__
+    candidate, kept, duplicate = events.alias("candidate"), events.alias("kept"), events.alias("duplicate")
+    duplicates = select(candidate.c.id).where(
+        candidate.c.event_type == EXPIRED,
+        candidate.c.id != select(func.min(kept.c.id)).where(
+            kept.c.event_type == EXPIRED, kept.c.subject_id == candidate.c.subject_id
+        ).scalar_subquery(),
+    )
+    connection.execute(delete(deliveries).where(
+        deliveries.c.event_id.in_(duplicates), deliveries.c.status == "pending"
+    ))
+    connection.execute(update(deliveries).where(deliveries.c.event_id.in_(duplicates)).values(
+        event_id=select(func.min(kept.c.id)).select_from(duplicate).join(
+            kept, kept.c.subject_id == duplicate.c.subject_id
+        ).where(duplicate.c.id == deliveries.c.event_id, kept.c.event_type == EXPIRED).scalar_subquery()
+    ))
+    removed = connection.execute(delete(events).where(events.c.id.in_(duplicates))).rowcount
+    if removed:
+        logger.warning("Removed %d duplicate license.expired events", removed)
+    return removed
+
+
+# Data fixes that must run right before an index can be built
+PREPARE = {
+    "uq_outbox_events_expired_subject_id": _dedupe_expired_events,
+}
+
+
+def create_index(engine: Engine, index):
+    """Build one declared index if it is missing, without blocking writes on PostgreSQL."""
+    if index.name in PREPARE:
+        with engine.begin() as connection:
+            PREPARE[index.name](connection)
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if engine.dialect.name == "postgresql":
+            _drop_invalid(connection, index.name)
+            ddl = ddl.replace(" INDEX IF NOT EXISTS ", " INDEX CONCURRENTLY IF NOT EXISTS ", 1)
+        try:
+            connection.exec_driver_sql(ddl)
+        except DBAPIError:
+            # Another run created it between the check and the build
+            if index.name not in _existing(connection, index.table.name):
+                raise
+
+
+def create_missing_indexes(engine: Engine) -> List[str]:
+    """Build every missing declared index; returns the names built."""
+    missing = missing_indexes(engine)
+    for index in _declared_indexes():
+        if index.name in missing:
+            logger.info("Creating index %s on %s", index.name, index.table.name)
+            create_index(engine, index)
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build indexes missing from an existing database.")
+    parser.parse_args()
+
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    Base.metadata.create_all(bind=engine)
+    built = create_missing_indexes(engine)
+    print(f"Created {len(built)} missing indexes ({engine.dialect.name})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, LargeBinary, Index, Text, text
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -23,6 +23,9 @@ class Product(Base):
     brand = relationship("Brand", back_populates="products")
     licenses = relationship("License", back_populates="product")
 
+    # Tenant-leading index: per-brand listings and scope checks touch only that brand's rows
+    __table_args__ = (Index("ix_products_brand_id_id", "brand_id", "id"),)
+
 
 class Customer(Base):
     __tablename__ = "customers"
@@ -32,6 +35,21 @@ class Customer(Base):
     
     licenses = relationship("License", back_populates="customer")
 
+    # Trigram indexes back substring search on PostgreSQL (see search.py)
+    __table_args__ = (
+        Index("ix_customers_email_trgm", "email", postgresql_using="gin",
+              postgresql_ops={"email": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+class BrandCustomer(Base):
+    """A customer a brand registered or attached by email; brand keys may only license these."""
+    __tablename__ = "brand_customers"
+
+    brand_id = Column(Integer, ForeignKey("brands.id"), primary_key=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 
 class License(Base):
     __tablename__ = "licenses"
@@ -44,7 +62,8 @@ class License(Base):
     is_active = Column(Boolean, default=True)
     expiration_date = Column(DateTime)
     max_seats = Column(Integer, default=1)
-    active_seats = Column(Integer, default=0)
+    active_seats = Column(Integer, default=0)  # Live for unstriped licenses; reconciled snapshot when striped
+    seat_slots = Column(Integer, default=0, nullable=False)  # >0: seats are counted in license_seat_counters
     
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
@@ -52,6 +71,27 @@ class License(Base):
     product = relationship("Product", back_populates="licenses")
     activations = relationship("Activation", back_populates="license")
 
+    __table_args__ = (
+        Index("ix_licenses_product_id_id", "product_id", "id"),
+        Index("ix_licenses_customer_id_product_id", "customer_id", "product_id"),
+        Index("ix_licenses_product_id_customer_id", "product_id", "customer_id"),
+        Index("ix_licenses_key_trgm", "key", postgresql_using="gin",
+              postgresql_ops={"key": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+class LicenseSeatCounter(Base):
+    """
+    One slot of a striped seat counter. Each slot owns a share of max_seats
+    (capacity), so activations on a large license update different rows.
+    """
+    __tablename__ = "license_seat_counters"
+
+    license_id = Column(Integer, ForeignKey("licenses.id"), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    capacity = Column(Integer, nullable=False)
+    used = Column(Integer, nullable=False, default=0)
+
 
 class Activation(Base):
     __tablename__ = "activations"
@@ -64,6 +104,14 @@ class Activation(Base):
 
     license = relationship("License", back_populates="activations")
 
+    __table_args__ = (
+        Index("ix_activations_license_id_machine_id", "license_id", "machine_id"),
+        Index("ix_activations_machine_id_trgm", "machine_id", postgresql_using="gin",
+              postgresql_ops={"machine_id": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_activations_friendly_name_trgm", "friendly_name", postgresql_using="gin",
+              postgresql_ops={"friendly_name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
 
 class APIKey(Base):
     __tablename__ = "api_keys"
@@ -71,7 +119,7 @@ class APIKey(Base):
     id = Column(Integer, primary_key=True, index=True)
     key_hash = Column(String, unique=True, index=True, nullable=False)
     name = Column(String, nullable=False)  # Descriptive name for the key
-    brand_id = Column(Integer, ForeignKey("brands.id"), nullable=True)  # Optional: associate with brand
+    brand_id = Column(Integer, ForeignKey("brands.id"), nullable=True, index=True)  # Optional: scopes the key to one brand
     
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -79,3 +127,119 @@ class APIKey(Base):
     expires_at = Column(DateTime, nullable=True)  # Optional expiration
     
     brand = relationship("Brand", backref="api_keys")
+
+
+class TableVersion(Base):
+    """Per-table change counter, bumped in the same transaction as each write. Backs HTTP ETags."""
+    __tablename__ = "table_versions"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyRecord(Base):
+    """Stored outcome of a mutating request sent with an Idempotency-Key header."""
+    __tablename__ = "idempotency_records"
+
+    key_hash = Column(String(64), primary_key=True)  # sha256 of (API key, Idempotency-Key)
+    request_hash = Column(String(64), nullable=False)  # sha256 of (method, path, body)
+    status = Column(String(16), nullable=False)  # "in_progress" or "completed"
+    status_code = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# Analytics rollups, maintained incrementally by crud (see analytics.py)
+class ProductUsageRollup(Base):
+    __tablename__ = "rollup_product_usage"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True, default=0)  # Spreads increments; readers sum shards
+    licenses_total = Column(Integer, nullable=False, default=0)
+    licenses_active = Column(Integer, nullable=False, default=0)
+    seats_total = Column(Integer, nullable=False, default=0)  # Sum of max_seats
+    seats_used = Column(Integer, nullable=False, default=0)  # Sum of active_seats
+
+
+class ActivationDailyRollup(Base):
+    __tablename__ = "rollup_activations_daily"
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True, default=0)
+    activations = Column(Integer, nullable=False, default=0)
+    deactivations = Column(Integer, nullable=False, default=0)
+
+
+class LicenseExpiryRollup(Base):
+    __tablename__ = "rollup_license_expiry_monthly"
+
+    month = Column(String(7), primary_key=True)  # YYYY-MM
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    licenses = Column(Integer, nullable=False, default=0)
+
+
+# Webhooks: transactional outbox and deliveries (see webhooks.py)
+class WebhookEndpoint(Base):
+    __tablename__ = "webhook_endpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    brand_id = Column(Integer, ForeignKey("brands.id"), nullable=False, index=True)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False)  # HMAC key; must be readable to sign, so it is not hashed
+    event_types = Column(String, nullable=True)  # Comma-separated; NULL subscribes to all events
+    max_concurrency = Column(Integer, nullable=False, default=4)  # Requests in flight to this URL
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class OutboxEvent(Base):
+    """Domain event written in the same transaction as the change it describes."""
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String(64), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)  # Resolves the brand at fan-out
+    subject_id = Column(Integer, nullable=True)  # License id
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    dispatched_at = Column(DateTime, nullable=True)  # Set once deliveries have been created
+
+    __table_args__ = (
+        Index("ix_outbox_events_dispatched_at_id", "dispatched_at", "id"),
+        Index("ix_outbox_events_event_type_subject_id", "event_type", "subject_id"),
+        # A license expires once: concurrent expiry scans cannot both announce it
+        Index(
+            "uq_outbox_events_expired_subject_id", "subject_id", unique=True,
+            sqlite_where=text("event_type = 'license.expired'"),
+            postgresql_where=text("event_type = 'license.expired'"),
+        ),
+    )
+
+
+class WebhookDelivery(Base):
+    """One event for one endpoint: pending until delivered, or dead after the last failed attempt."""
+    __tablename__ = "webhook_deliveries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, ForeignKey("outbox_events.id"), nullable=False)
+    endpoint_id = Column(Integer, ForeignKey("webhook_endpoints.id"), nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending, delivered, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    leased_until = Column(DateTime, nullable=True)  # Set while a dispatcher is sending it; counts toward max_concurrency
+    last_status_code = Column(Integer, nullable=True)
+    last_error = Column(String, nullable=True)
+    delivered_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    event = relationship("OutboxEvent")
+    endpoint = relationship("WebhookEndpoint")
+
+    __table_args__ = (
+        Index("ix_webhook_deliveries_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_webhook_deliveries_endpoint_id_status", "endpoint_id", "status"),
+    )
+
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Dict, List, Literal, Optional
+from datetime import date, datetime
 
 # Brand Schemas
 class BrandBase(BaseModel):
@@ -54,6 +54,8 @@ class LicenseBase(BaseModel):
 
 class LicenseCreate(LicenseBase):
     key: Optional[str] = None
+    # Striped seat counter slots; None picks a default from max_seats, 0 disables striping
+    seat_slots: Optional[int] = Field(None, ge=0, le=256)
 
 class License(LicenseBase):
     id: int
@@ -85,6 +87,24 @@ class Activation(ActivationBase):
     class Config:
         from_attributes = True
 
+class BulkDeactivate(BaseModel):
+    """Exactly one selector: every activation of a machine, of a license, or a list of ids"""
+    machine_id: Optional[str] = None
+    license_id: Optional[int] = None
+    activation_ids: Optional[List[int]] = Field(None, min_length=1, max_length=100000)
+
+    @model_validator(mode="after")
+    def check_one_selector(self):
+        selectors = [self.machine_id, self.license_id, self.activation_ids]
+        if sum(selector is not None for selector in selectors) != 1:
+            raise ValueError("Provide exactly one of machine_id, license_id or activation_ids")
+        return self
+
+class BulkDeactivateResult(BaseModel):
+    deleted: int
+    licenses_affected: int
+    batches: int
+
 # Rebuild License model to resolve forward reference
 License.model_rebuild()
 
@@ -115,3 +135,119 @@ class APIKey(BaseModel):
     
     class Config:
         from_attributes = True
+
+# Analytics Schemas
+class SeatUtilization(BaseModel):
+    """Seat usage per product (or per brand when grouped by brand)"""
+    product_id: Optional[int] = None
+    name: Optional[str] = None
+    brand_id: Optional[int]
+    licenses_total: int
+    licenses_active: int
+    seats_total: int
+    seats_used: int
+    utilization: float
+
+class ActivationCount(BaseModel):
+    day: date
+    activations: int
+    deactivations: int
+
+class ExpiryCount(BaseModel):
+    month: str  # YYYY-MM
+    licenses: int
+
+# Search Schemas
+class SearchHit(BaseModel):
+    kind: str  # customer, license or activation
+    id: int
+    value: Optional[str] = None  # Email, license key or machine id
+    label: Optional[str] = None  # Activation friendly_name
+    score: float
+
+# Dashboard Schemas
+class DashboardProduct(BaseModel):
+    name: str
+    brand_id: Optional[int] = None
+
+class DashboardCounts(BaseModel):
+    brands: int
+    products: int
+    customers: int
+    activations: int
+    licenses: int
+    licenses_active: int
+    seats_total: int
+    seats_used: int
+
+class RecentLicense(BaseModel):
+    id: int
+    key: str
+    customer_id: int
+    product_id: int
+    is_active: bool
+    created_at: Optional[datetime] = None
+
+class RecentActivation(BaseModel):
+    id: int
+    license_id: int
+    machine_id: str
+    friendly_name: Optional[str] = None
+    activated_at: Optional[datetime] = None
+
+class DashboardSummary(BaseModel):
+    """Map entries added since the request's cursor, plus current counters and recent items"""
+    brands: Dict[int, str]
+    products: Dict[int, DashboardProduct]
+    customers: Dict[int, str]
+    cursor: str  # Pass back as ?since= to fetch only newer map entries
+    complete: bool  # False when a map hit the row limit; call again with cursor
+    counts: DashboardCounts
+    recent_licenses: List[RecentLicense]
+    recent_activations: List[RecentActivation]
+
+# Webhook Schemas
+WebhookEventType = Literal["license.activated", "license.deactivated", "license.suspended", "license.resumed", "license.expired"]
+
+class WebhookEndpointCreate(BaseModel):
+    url: str = Field(..., pattern=r"^https?://", max_length=2048)
+    brand_id: Optional[int] = None  # Required for unscoped keys; defaults to the key's brand
+    event_types: Optional[List[WebhookEventType]] = None  # None subscribes to every event
+    max_concurrency: int = Field(4, ge=1, le=64)
+
+class WebhookEndpoint(BaseModel):
+    """Webhook endpoint without its signing secret (for listing)"""
+    id: int
+    brand_id: int
+    url: str
+    event_types: Optional[List[str]] = None
+    max_concurrency: int
+    is_active: bool
+    created_at: datetime
+
+    @field_validator("event_types", mode="before")
+    @classmethod
+    def split_event_types(cls, value):
+        return value.split(",") if isinstance(value, str) else value
+
+    class Config:
+        from_attributes = True
+
+class WebhookEndpointResponse(WebhookEndpoint):
+    """Response when creating an endpoint - includes the signing secret (shown only once)"""
+    secret: str
+
+class WebhookDelivery(BaseModel):
+    id: int
+    event_id: int
+    endpoint_id: int
+    status: str  # pending, delivered or dead
+    attempts: int
+    next_attempt_at: datetime
+    last_status_code: Optional[int] = None
+    last_error: Optional[str] = None
+    delivered_at: Optional[datetime] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,225 @@
+"""
+Indexed substring search over customers, licenses and activations.
+
+PostgreSQL answers searches from pg_trgm GIN indexes on the base columns
+(declared in models.py), which serve ``ILIKE '%term%'``, and ranks with
+``similarity()``. SQLite has no trigram indexes, so there the searchable
+text is copied into an FTS5 table with the trigram tokenizer
+(``search_index``), ranked with bm25. The crud mutations keep it in sync
+inside the same transaction as the write; ``rebuild`` recreates it from the
+base tables.
+
+Terms need at least three characters, the shortest string a trigram index
+can look up.
+
+Usage:
+    python -m backend.search rebuild
+"""
+from sqlalchemy import DDL, Integer, String, and_, column, event, func, literal, literal_column, or_, select, table, union_all
+from sqlalchemy.orm import Session
+from typing import Iterable, Optional, Sequence
+import argparse
+import logging
+
+from . import models
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+MIN_TERM_LENGTH = 3
+
+CUSTOMER = "customer"
+LICENSE = "license"
+ACTIVATION = "activation"
+KINDS = (CUSTOMER, LICENSE, ACTIVATION)
+
+# SQLite FTS5 shadow table. value is the primary match (email, license key,
+# machine id), label the activation's friendly_name; kind and ref_id point
+# back at the source row and are not tokenized.
+_CREATE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "kind UNINDEXED, ref_id UNINDEXED, value, label, tokenize='trigram')"
+)
+_BACKFILL = (
+    "INSERT INTO search_index (kind, ref_id, value, label) "
+    f"SELECT '{CUSTOMER}', id, email, NULL FROM customers WHERE email IS NOT NULL "
+    f"UNION ALL SELECT '{LICENSE}', id, key, NULL FROM licenses WHERE key IS NOT NULL "
+    f"UNION ALL SELECT '{ACTIVATION}', id, machine_id, friendly_name FROM activations"
+)
+
+search_index = table(
+    "search_index",
+    column("kind", String),
+    column("ref_id", Integer),
+    column("value", String),
+    column("label", String),
+)
+_MATCH = literal_column("search_index")
+_RANK = literal_column("rank")  # FTS5 hidden column, bm25 by default (lower is better)
+
+# The trigram indexes in models.py need the extension before any table is created
+event.listen(
+    Base.metadata, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    """Create the SQLite shadow table, filling it from existing rows the first time."""
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    ).first()
+    if not exists:
+        connection.exec_driver_sql(_CREATE_FTS)
+        connection.exec_driver_sql(_BACKFILL)
+
+
+def _uses_fts(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+# Incremental maintenance, called by crud before its commit. On PostgreSQL the
+# GIN indexes on the base tables keep themselves up to date.
+def _add(db: Session, kind: str, ref_id: int, value: Optional[str], label: Optional[str] = None):
+    if _uses_fts(db):
+        db.execute(search_index.insert().values(kind=kind, ref_id=ref_id, value=value, label=label))
+
+
+def index_customer(db: Session, db_customer: models.Customer):
+    _add(db, CUSTOMER, db_customer.id, db_customer.email)
+
+
+def index_license(db: Session, db_license: models.License):
+    _add(db, LICENSE, db_license.id, db_license.key)
+
+
+def index_activation(db: Session, db_activation: models.Activation):
+    _add(db, ACTIVATION, db_activation.id, db_activation.machine_id, db_activation.friendly_name)
+
+
+def remove_activations(db: Session, activation_ids: Iterable[int]):
+    ids = list(activation_ids)
+    if ids and _uses_fts(db):
+        db.execute(search_index.delete().where(
+            search_index.c.kind == ACTIVATION,
+            search_index.c.ref_id.in_(ids),
+        ))
+
+
+def _visible_ids(kind: str, brand_id: int):
+    """Ids of one kind of row that a brand-scoped key may see."""
+    brand_licenses = select(models.License.id).where(models.License.product_id.in_(
+        select(models.Product.id).where(models.Product.brand_id == brand_id)
+    ))
+    if kind == CUSTOMER:
+        return select(models.License.customer_id).where(models.License.id.in_(brand_licenses))
+    if kind == LICENSE:
+        return brand_licenses
+    return select(models.Activation.id).where(models.Activation.license_id.in_(brand_licenses))
+
+
+def _fts_statement(term: str, kinds: Sequence[str], brand_id: Optional[int]):
+    phrase = '"' + term.replace('"', '""') + '"'
+    statement = select(
+        search_index.c.kind,
+        search_index.c.ref_id.label("id"),
+        search_index.c.value,
+        search_index.c.label,
+        (-_RANK).label("score"),
+    ).select_from(search_index).where(
+        _MATCH.op("MATCH")(phrase),
+        search_index.c.kind.in_(kinds),
+    )
+    if brand_id is not None:
+        statement = statement.where(or_(*(
+            and_(search_index.c.kind == kind, search_index.c.ref_id.in_(_visible_ids(kind, brand_id)))
+            for kind in kinds
+        )))
+    exact = or_(search_index.c.value == term, search_index.c.label == term)
+    return statement.order_by(exact.desc(), _RANK, search_index.c.ref_id)
+
+
+def _trigram_statement(term: str, kinds: Sequence[str], brand_id: Optional[int]):
+    """One SELECT per kind (kinds in KINDS order), each served by its GIN index."""
+    # "!" as the LIKE escape avoids backslash quoting differences between servers
+    pattern = "%" + term.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+    no_label = literal(None, String).label("label")
+    parts = []
+    if CUSTOMER in kinds:
+        parts.append(select(
+            literal(CUSTOMER).label("kind"), models.Customer.id, models.Customer.email.label("value"), no_label,
+            func.similarity(models.Customer.email, term).label("score"),
+        ).where(models.Customer.email.ilike(pattern, escape="!")))
+    if LICENSE in kinds:
+        parts.append(select(
+            literal(LICENSE).label("kind"), models.License.id, models.License.key.label("value"), no_label,
+            func.similarity(models.License.key, term).label("score"),
+        ).where(models.License.key.ilike(pattern, escape="!")))
+    if ACTIVATION in kinds:
+        parts.append(select(
+            literal(ACTIVATION).label("kind"), models.Activation.id, models.Activation.machine_id.label("value"),
+            models.Activation.friendly_name.label("label"),
+            func.greatest(
+                func.similarity(models.Activation.machine_id, term),
+                func.similarity(func.coalesce(models.Activation.friendly_name, ""), term),
+            ).label("score"),
+        ).where(or_(
+            models.Activation.machine_id.ilike(pattern, escape="!"),
+            models.Activation.friendly_name.ilike(pattern, escape="!"),
+        )))
+    if brand_id is not None:
+        id_columns = {CUSTOMER: models.Customer.id, LICENSE: models.License.id, ACTIVATION: models.Activation.id}
+        parts = [part.where(id_columns[kind].in_(_visible_ids(kind, brand_id))) for kind, part in zip(kinds, parts)]
+    hits = union_all(*parts).subquery()
+    return select(hits).order_by(hits.c.score.desc(), hits.c.kind, hits.c.id)
+
+
+def search(db: Session, term: str, kinds: Optional[Sequence[str]] = None, skip: int = 0, limit: int = 20,
+           brand_id: Optional[int] = None):
+    """Ranked matches of term as rows of (kind, id, value, label, score), best first."""
+    kinds = [kind for kind in KINDS if kinds is None or kind in kinds]
+    if len(term) < MIN_TERM_LENGTH or not kinds:
+        return []
+    builder = _fts_statement if _uses_fts(db) else _trigram_statement
+    return db.execute(builder(term, kinds, brand_id).offset(skip).limit(limit)).all()
+
+
+def rebuild(db: Session):
+    """Recreate the search index from the base tables."""
+    bind = db.get_bind()
+    if _uses_fts(db):
+        db.execute(search_index.delete())
+        db.connection().exec_driver_sql(_BACKFILL)
+        db.commit()
+        return
+    # create_all does not add indexes to tables that already exist
+    db.connection().exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    db.commit()
+    for model in (models.Customer, models.License, models.Activation):
+        for index in model.__table__.indexes:
+            if index.name.endswith("_trgm"):
+                index.create(bind=bind, checkfirst=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search index maintenance.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    from .database import SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        rebuild(db)
+        print(f"Rebuilt search index ({engine.dialect.name})")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Seat counting for licenses, with an optional striped mode for large licenses.
+
+Unstriped licenses keep the live seat count in ``licenses.active_seats`` and
+claim a seat with one guarded UPDATE. Striped licenses (``seat_slots > 0``)
+split ``max_seats`` across N rows of ``license_seat_counters``. A claim
+increments one slot that still has capacity, so concurrent activations on
+the same license update different rows. Because every slot enforces its own
+capacity and the capacities sum to ``max_seats``, the cap holds without a
+license-wide lock. The live count is the sum of the slots.
+
+``reconcile`` recomputes seat counts from the ``activations`` table and
+repairs drift, moving the analytics seat rollup by the same amount. A
+license can hold more activations than seats (e.g. after ``max_seats`` was
+lowered); the overage is kept in its last slot, which then rejects claims,
+and the license is reported instead of being capped.
+
+``licenses.seat_slots`` was added after the first release. ``create_all``
+does not add columns to existing tables, so it is added on startup when an
+existing database lacks it (unstriped, the old behaviour).
+
+Usage:
+    python -m backend.seats reconcile [--license-id ID]
+"""
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from typing import Iterable, Optional
+import argparse
+import logging
+import os
+import random
+
+from . import models
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+# Licenses with at least this many seats are striped on creation (0 disables)
+SEAT_STRIPING_THRESHOLD = int(os.getenv("SEAT_STRIPING_THRESHOLD", "1000"))
+SEAT_STRIPE_SLOTS = int(os.getenv("SEAT_STRIPE_SLOTS", "16"))
+
+Counter = models.LicenseSeatCounter
+
+# Live seat count of a license row, usable in any query selecting from licenses
+active_seats_expr = case(
+    (
+        models.License.seat_slots > 0,
+        select(func.coalesce(func.sum(Counter.used), 0))
+        .where(Counter.license_id == models.License.id)
+        .correlate(models.License)
+        .scalar_subquery(),
+    ),
+    else_=models.License.active_seats,
+)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _add_seat_slots_column(target, connection, **kw):
+    """Add licenses.seat_slots to databases created before striping existed."""
+    columns = {column["name"] for column in inspect(connection).get_columns("licenses")}
+    if "seat_slots" in columns:
+        return
+    # Workers starting together may race here: PostgreSQL skips the column with
+    # IF NOT EXISTS, SQLite (which lacks it) reports a duplicate column instead
+    if_not_exists = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+    try:
+        connection.exec_driver_sql(
+            f"ALTER TABLE licenses ADD COLUMN {if_not_exists}seat_slots INTEGER NOT NULL DEFAULT 0"
+        )
+    except OperationalError as exc:
+        if "duplicate column" not in str(exc):
+            raise
+        return
+    logger.info("Added licenses.seat_slots")
+
+
+def default_slots(max_seats: int) -> int:
+    if not SEAT_STRIPING_THRESHOLD or (max_seats or 0) < SEAT_STRIPING_THRESHOLD:
+        return 0
+    return min(SEAT_STRIPE_SLOTS, max_seats)
+
+
+def _split(total: int, parts: int):
+    """Spread total over parts as evenly as possible."""
+    base, remainder = divmod(total, parts)
+    return [base + (1 if i < remainder else 0) for i in range(parts)]
+
+
+def _fill(capacities, used: int):
+    """Place used seats into slots up to their capacities; any overage goes into the last slot."""
+    filled = []
+    for capacity in capacities:
+        take = min(capacity, used)
+        filled.append(take)
+        used -= take
+    if filled:
+        filled[-1] += used
+    return filled
+
+
+def create_slots(db: Session, db_license: models.License, slots: int):
+    """Set up the counter slots for a newly created (flushed) license."""
+    slots = min(slots, db_license.max_seats or 0)
+    db_license.seat_slots = max(slots, 0)
+    if not db_license.seat_slots:
+        return
+    capacities = _split(db_license.max_seats, slots)
+    used = _fill(capacities, db_license.active_seats or 0)
+    db.add_all(
+        Counter(license_id=db_license.id, slot=slot, capacity=capacity, used=used[slot])
+        for slot, capacity in enumerate(capacities)
+    )
+
+
+def get_active_seats(db: Session, db_license: models.License) -> int:
+    if not db_license.seat_slots:
+        return db_license.active_seats
+    return db.query(func.coalesce(func.sum(Counter.used), 0)).filter(Counter.license_id == db_license.id).scalar()
+
+
+def claim_seat(db: Session, db_license: models.License) -> bool:
+    """Take one seat in the caller's transaction. False when the license is full."""
+    if not db_license.seat_slots:
+        claimed = db.query(models.License).filter(
+            models.License.id == db_license.id,
+            models.License.active_seats < models.License.max_seats,
+        ).update({models.License.active_seats: models.License.active_seats + 1}, synchronize_session=False)
+        return claimed == 1
+
+    # Start at a random slot so concurrent claims land on different rows
+    start = random.randrange(db_license.seat_slots)
+    for offset in range(db_license.seat_slots):
+        slot = (start + offset) % db_license.seat_slots
+        claimed = db.query(Counter).filter(
+            Counter.license_id == db_license.id,
+            Counter.slot == slot,
+            Counter.used < Counter.capacity,
+        ).update({Counter.used: Counter.used + 1}, synchronize_session=False)
+        if claimed:
+            return True
+    return False
+
+
+def release_seats(db: Session, db_license: models.License, count: int = 1) -> int:
+    """Give back up to count seats in the caller's transaction; returns seats released."""
+    if count <= 0:
+        return 0
+    if not db_license.seat_slots:
+        released = min(count, db_license.active_seats or 0)
+        if released:
+            db.query(models.License).filter(models.License.id == db_license.id).update(
+                {models.License.active_seats: case(
+                    (models.License.active_seats >= released, models.License.active_seats - released),
+                    else_=0,
+                )},
+                synchronize_session=False,
+            )
+        return released
+
+    # Read the slots once, then take as many seats from each slot as it holds in one
+    # guarded UPDATE. A guard that fails (a concurrent release emptied the slot) gets
+    # one more pass with fresh counts, so this is at most 2 * (seat_slots + 1) statements.
+    released = 0
+    for _ in range(2):
+        slots = db.query(Counter.slot, Counter.used).filter(
+            Counter.license_id == db_license.id, Counter.used > 0
+        ).all()
+        random.shuffle(slots)
+        for slot, used in slots:
+            if released == count:
+                return released
+            take = min(used, count - released)
+            if db.query(Counter).filter(
+                Counter.license_id == db_license.id,
+                Counter.slot == slot,
+                Counter.used >= take,
+            ).update({Counter.used: Counter.used - take}, synchronize_session=False):
+                released += take
+        if released == count or not slots:
+            break
+    return released
+
+
+def release_seats_bulk(db: Session, counts: dict):
+    """
+    Give back seats for many licenses at once ({license_id: seats}).
+
+    Unstriped licenses that release the same number of seats share one UPDATE.
+    Returns {product_id: seats released} for the analytics rollups.
+    """
+    rows = db.query(
+        models.License.id, models.License.product_id, models.License.seat_slots, models.License.active_seats
+    ).filter(models.License.id.in_(list(counts))).all()
+
+    released_by_product = {}
+    unstriped_by_count = {}
+    for row in rows:
+        count = counts[row.id]
+        if row.seat_slots:
+            released = release_seats(db, row, count)
+        else:
+            released = min(count, row.active_seats or 0)
+            if released:
+                unstriped_by_count.setdefault(released, []).append(row.id)
+        released_by_product[row.product_id] = released_by_product.get(row.product_id, 0) + released
+
+    for released, license_ids in unstriped_by_count.items():
+        db.query(models.License).filter(models.License.id.in_(license_ids)).update(
+            {models.License.active_seats: case(
+                (models.License.active_seats >= released, models.License.active_seats - released),
+                else_=0,
+            )},
+            synchronize_session=False,
+        )
+    return released_by_product
+
+
+def reconcile(db: Session, license_ids: Optional[Iterable[int]] = None, batch_size: int = 500):
+    """
+    Recompute seat counts from the activations table and repair drift.
+
+    Each batch of licenses is locked (FOR UPDATE where supported) and fixed in
+    its own transaction, together with the analytics seat rollup. Returns a
+    list of (license_id, recorded, actual) for every license that was
+    repaired. Licenses with more activations than seats are logged.
+    """
+    from .analytics import record_seats_repaired
+    from .crud import bump_table_versions
+
+    query = db.query(models.License.id).order_by(models.License.id)
+    if license_ids is not None:
+        query = query.filter(models.License.id.in_(list(license_ids)))
+    ids = [row.id for row in query]
+
+    repaired = []
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        batch_repaired = 0
+        licenses = db.query(models.License).filter(models.License.id.in_(batch)).with_for_update().all()
+        actual_counts = dict(
+            db.query(models.Activation.license_id, func.count(models.Activation.id))
+            .filter(models.Activation.license_id.in_(batch))
+            .group_by(models.Activation.license_id)
+        )
+        for db_license in licenses:
+            actual = actual_counts.get(db_license.id, 0)
+            recorded = get_active_seats(db, db_license)
+            if actual > (db_license.max_seats or 0):
+                logger.warning(
+                    "License has more activations than seats",
+                    extra={"license_id": db_license.id, "max_seats": db_license.max_seats, "actual": actual},
+                )
+            if db_license.seat_slots and recorded != actual:
+                counters = db.query(Counter).filter(
+                    Counter.license_id == db_license.id
+                ).order_by(Counter.slot).with_for_update().all()
+                for counter, used in zip(counters, _fill([c.capacity for c in counters], actual)):
+                    counter.used = used
+            # For striped licenses this refreshes the snapshot column
+            if db_license.active_seats != actual:
+                db_license.active_seats = actual
+            if recorded != actual:
+                record_seats_repaired(db, db_license.product_id, actual - recorded)
+                batch_repaired += 1
+                repaired.append((db_license.id, recorded, actual))
+                logger.warning(
+                    "Repaired seat count drift",
+                    extra={"license_id": db_license.id, "recorded": recorded, "actual": actual},
+                )
+        if batch_repaired:
+            bump_table_versions(db, "licenses")
+        db.commit()
+    return repaired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seat counter maintenance.")
+    parser.add_argument("command", choices=["reconcile"])
+    parser.add_argument("--license-id", type=int, action="append", help="Only reconcile these licenses")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from .database import SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        repaired = reconcile(db, license_ids=args.license_id, batch_size=args.batch_size)
+        print(f"Reconciled seat counts, repaired {len(repaired)} license(s)")
+        for license_id, recorded, actual in repaired:
+            print(f"  license {license_id}: {recorded} -> {actual}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
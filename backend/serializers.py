@@ -0,0 +1,90 @@
+"""
+Fast-path JSON serialization for hot read endpoints.
+
+The list and validate endpoints select plain column tuples and encode them
+with orjson instead of building ORM objects, validating them through the
+Pydantic response models and encoding with the stdlib json module. Field
+names and order mirror the schemas in schemas.py, so the wire format and
+the OpenAPI document are unchanged; the endpoints keep their
+``response_model`` declarations for documentation only.
+"""
+from collections import defaultdict
+from fastapi.responses import ORJSONResponse
+from . import models, seats
+
+# Column selections, in the same order as the fields of the matching schema
+BRAND_COLUMNS = (models.Brand.name, models.Brand.email, models.Brand.id)
+BRAND_FIELDS = ("name", "email", "id")
+
+PRODUCT_COLUMNS = (models.Product.name, models.Product.id, models.Product.brand_id)
+PRODUCT_FIELDS = ("name", "id", "brand_id")
+
+CUSTOMER_COLUMNS = (models.Customer.email, models.Customer.id)
+CUSTOMER_FIELDS = ("email", "id")
+
+LICENSE_COLUMNS = (
+    models.License.customer_id,
+    models.License.product_id,
+    models.License.is_active,
+    models.License.expiration_date,
+    models.License.max_seats,
+    seats.active_seats_expr.label("active_seats"),
+    models.License.id,
+    models.License.key,
+    models.License.created_at,
+)
+LICENSE_FIELDS = (
+    "customer_id",
+    "product_id",
+    "is_active",
+    "expiration_date",
+    "max_seats",
+    "active_seats",
+    "id",
+    "key",
+    "created_at",
+)
+
+ACTIVATION_COLUMNS = (
+    models.Activation.machine_id,
+    models.Activation.friendly_name,
+    models.Activation.id,
+    models.Activation.license_id,
+    models.Activation.activated_at,
+)
+ACTIVATION_FIELDS = ("machine_id", "friendly_name", "id", "license_id", "activated_at")
+
+VALIDATION_COLUMNS = (
+    models.License.id,
+    models.License.product_id,
+    models.License.is_active,
+    models.License.expiration_date,
+    models.License.max_seats,
+    seats.active_seats_expr.label("active_seats"),
+)
+
+SEARCH_FIELDS = ("kind", "id", "value", "label", "score")
+
+
+def rows_to_dicts(rows, fields):
+    """Zip column tuples into dicts keyed by schema field name."""
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def licenses_to_dicts(license_rows, activation_rows):
+    """Build License payloads with their activations nested, in schema order."""
+    activations_by_license = defaultdict(list)
+    for row in activation_rows:
+        activations_by_license[row.license_id].append(dict(zip(ACTIVATION_FIELDS, row)))
+
+    licenses = []
+    for row in license_rows:
+        item = dict(zip(LICENSE_FIELDS, row))
+        item["activations"] = activations_by_license.get(row.id, [])
+        licenses.append(item)
+    return licenses
+
+
+def json_response(content, status_code: int = 200, headers=None) -> ORJSONResponse:
+    """Encode an already JSON-shaped payload with orjson, skipping validation."""
+    return ORJSONResponse(content=content, status_code=status_code, headers=headers)
@@ -0,0 +1,170 @@
+"""
+Production entry point for the API.
+
+Runs ``backend.main:app`` under gunicorn with uvicorn workers, one per
+available core. Each worker uses uvloop and httptools when they are
+installed, and falls back to asyncio and h11 otherwise.
+
+The settings assume nginx sits in front:
+
+* The keep-alive timeout is longer than nginx's upstream
+  ``keepalive_timeout`` (60s). nginx then always closes idle connections
+  first and never sends a request on a socket the worker is closing.
+* The listen backlog absorbs bursts while every worker is busy.
+* ``X-Forwarded-For`` is trusted from ``FORWARDED_ALLOW_IPS``, so rate
+  limits apply per client and not per proxy.
+
+Each worker's database pool gets an equal share of ``DB_MAX_CONNECTIONS``
+(see ``database.pool_limits``), so adding cores does not push PostgreSQL past
+its ``max_connections``.
+
+Workers are recycled after ``SERVER_MAX_REQUESTS`` requests, plus a random
+jitter so they do not all restart at once. A recycled worker stops
+accepting, finishes its in-flight requests within
+``SERVER_GRACEFUL_TIMEOUT`` and is replaced. The app is preloaded in the
+master, so the workers share its memory and tables are created once. The
+database pool is reset in each worker after the fork.
+
+Without gunicorn (e.g. on Windows), uvicorn's own process manager runs the
+workers. It does not replace workers that exit, so recycling is off there.
+
+Usage:
+    python -m backend.server [--bind 0.0.0.0:8000] [--workers 4]
+"""
+import argparse
+import importlib.util
+import logging
+import os
+
+try:
+    from uvicorn.workers import UvicornWorker
+except ImportError:  # gunicorn is not installed
+    UvicornWorker = None
+
+APP = "backend.main:app"
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> int:
+    """Cores this process may run on, honouring CPU affinity and a cgroup v2 quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(int(quota) // int(period), 1))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_count() -> int:
+    """WEB_CONCURRENCY if set, else one worker per core (at least 2, so a recycle never empties the pool)."""
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(int(os.environ["WEB_CONCURRENCY"]), 1)
+    return max(available_cpus(), 2)
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def settings(bind: str = None, workers: int = None) -> dict:
+    """Launcher settings from the environment; command-line values take precedence."""
+    return {
+        "bind": bind or os.getenv("SERVER_BIND", "0.0.0.0:8000"),
+        "workers": workers or worker_count(),
+        "backlog": int(os.getenv("SERVER_BACKLOG", "2048")),
+        "keepalive": int(os.getenv("SERVER_KEEPALIVE", "75")),
+        "timeout": int(os.getenv("SERVER_TIMEOUT", "60")),
+        "graceful_timeout": int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30")),
+        "max_requests": int(os.getenv("SERVER_MAX_REQUESTS", "20000")),
+        "max_requests_jitter": int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "2000")),
+        "forwarded_allow_ips": os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        "preload": os.getenv("SERVER_PRELOAD", "true").lower() == "true",
+    }
+
+
+if UvicornWorker is not None:
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {"loop": event_loop(), "http": http_protocol(), "server_header": False}
+
+
+def post_fork(server, worker):
+    """Drop the pooled connections inherited from the master without closing them under its feet."""
+    from .database import engine
+
+    engine.dispose(close=False)
+
+
+def run_gunicorn(options: dict):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", [options["bind"]])
+            self.cfg.set("worker_class", "backend.server.Worker")
+            self.cfg.set("post_fork", post_fork)
+            for name in ("workers", "backlog", "keepalive", "timeout", "graceful_timeout", "max_requests",
+                         "max_requests_jitter", "forwarded_allow_ips"):
+                self.cfg.set(name, options[name])
+            self.cfg.set("preload_app", options["preload"])
+
+        def load(self):
+            from .main import app
+
+            return app
+
+    Application().run()
+
+
+def run_uvicorn(options: dict):
+    import uvicorn
+
+    host, _, port = options["bind"].rpartition(":")
+    logger.warning("gunicorn is not installed; running uvicorn workers without recycling")
+    uvicorn.run(
+        APP,
+        host=host or "0.0.0.0",
+        port=int(port),
+        workers=options["workers"],
+        loop=event_loop(),
+        http=http_protocol(),
+        backlog=options["backlog"],
+        timeout_keep_alive=options["keepalive"],
+        timeout_graceful_shutdown=options["graceful_timeout"],
+        forwarded_allow_ips=options["forwarded_allow_ips"],
+        server_header=False,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with a production worker setup.")
+    parser.add_argument("--bind", help="host:port to listen on (default SERVER_BIND or 0.0.0.0:8000)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default WEB_CONCURRENCY or one per core)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    options = settings(args.bind, args.workers)
+    # database.py sizes each worker's pool from the worker count
+    os.environ["WEB_CONCURRENCY"] = str(options["workers"])
+    logger.info(
+        "Starting %s workers on %s (loop=%s, http=%s)",
+        options["workers"], options["bind"], event_loop(), http_protocol(),
+    )
+    if UvicornWorker is not None:
+        run_gunicorn(options)
+    else:
+        run_uvicorn(options)
+
+
+if __name__ == "__main__":
+    main()
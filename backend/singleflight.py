@@ -0,0 +1,131 @@
+"""
+In-process request coalescing ("single flight").
+
+Concurrent callers asking for the same key share one execution of the
+loader: the first caller runs it, the others wait for its result. A
+finished result can be shared for a short, bounded window afterwards.
+
+Every coalesced call records the worker's commit generation when it
+started. Commits in this worker that change a watched table (as recorded
+by crud.bump_table_versions) advance the generation, and callers never join
+a call from an older generation, so a coalesced result is never older than
+a commit already made by this worker.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for the sharing window, whatever the configuration says
+MAX_WINDOW_SECONDS = 1.0
+
+
+class _Call:
+    __slots__ = ("generation", "event", "result", "error", "finished_at")
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """Coalesce concurrent identical lookups within one worker process."""
+
+    def __init__(self, window_seconds: float = 0.0, max_keys: int = 10000, wait_timeout: float = 5.0):
+        self.window = min(max(window_seconds, 0.0), MAX_WINDOW_SECONDS)
+        self.max_keys = max_keys
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._generation = 0
+
+    def invalidate(self):
+        """Stop sharing anything started before now."""
+        with self._lock:
+            self._generation += 1
+            self._calls.clear()
+
+    def do(self, key, loader):
+        """Return loader()'s result, sharing it with concurrent callers of the same key."""
+        now = time.monotonic()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.generation == self._generation and (
+                call.finished_at is None or now - call.finished_at <= self.window
+            ):
+                leader = False
+            elif len(self._calls) >= self.max_keys and not self._evict(now):
+                # Table is full of in-flight calls: do not coalesce rather than grow unbounded
+                call, leader = None, True
+            else:
+                call = _Call(self._generation)
+                self._calls[key] = call
+                leader = True
+
+        if call is None:
+            return loader()
+        if leader:
+            return self._run(key, call, loader)
+
+        if not call.event.wait(self.wait_timeout):
+            logger.warning("Coalesced call timed out, loading directly")
+            return loader()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _run(self, key, call: _Call, loader):
+        try:
+            call.result = loader()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                call.finished_at = time.monotonic()
+                # Failures are only shared with callers already waiting; finished calls
+                # are dropped straight away when there is no sharing window
+                if (call.error is not None or self.window == 0) and self._calls.get(key) is call:
+                    del self._calls[key]
+            call.event.set()
+
+    def _evict(self, now: float) -> bool:
+        """Drop finished calls outside the window. Caller holds the lock."""
+        expired = [
+            key for key, call in self._calls.items()
+            if call.finished_at is not None and now - call.finished_at > self.window
+        ]
+        for key in expired:
+            del self._calls[key]
+        return len(self._calls) < self.max_keys
+
+
+# Commit tracking
+_subscriptions = []
+
+
+def invalidate_on_commit(flight: SingleFlight, *table_names: str):
+    """Invalidate a flight whenever a commit in this process changes one of the tables."""
+    _subscriptions.append((flight, frozenset(table_names)))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    changed = session.info.pop("changed_tables", None)
+    if not changed:
+        return
+    for flight, table_names in _subscriptions:
+        if table_names & changed:
+            flight.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("changed_tables", None)
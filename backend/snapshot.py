@@ -0,0 +1,147 @@
+"""
+Exporter for license validation snapshots used by edge gateways.
+
+``export_snapshot`` writes every license (or one brand's licenses) in the
+binary format described in snapshot_reader.py. ``export_delta`` compares the
+current database with the state a gateway already has (a base snapshot plus
+any deltas applied so far) and writes only the records that changed.
+Files are written to a temporary name and renamed into place, so a gateway
+never maps a half-written snapshot.
+
+The signing key comes from ``SNAPSHOT_SIGNING_KEY``; gateways need the same
+key to open the files.
+
+Usage:
+    python -m backend.snapshot export --out licenses.snap [--brand-id 3]
+    python -m backend.snapshot delta --base licenses.snap [--apply d1.delta ...] --out d2.delta
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Iterable, Optional
+import argparse
+import hashlib
+import os
+import secrets
+import time
+
+from . import models, serializers
+from .snapshot_reader import (
+    FLAG_ACTIVE, FLAG_DELETED, FORMAT_VERSION, HEADER, KIND_DELTA, KIND_FULL, MAGIC, NO_BRAND, RECORD,
+    SnapshotReader, hash_key, sign_header, to_timestamp,
+)
+
+EXPORT_BATCH_SIZE = 10000
+
+
+def signing_key_from_env() -> bytes:
+    key = os.getenv("SNAPSHOT_SIGNING_KEY")
+    if not key:
+        raise RuntimeError("SNAPSHOT_SIGNING_KEY is not set")
+    return key.encode()
+
+
+def _sequence() -> int:
+    """Millisecond clock, so later exports always carry a higher sequence."""
+    return time.time_ns() // 1_000_000
+
+
+def _license_records(db: Session, salt: bytes, brand_id: Optional[int]):
+    """Packed records for the licenses in scope, keyed by key hash."""
+    statement = select(models.License.key, *serializers.VALIDATION_COLUMNS).where(models.License.key.isnot(None))
+    if brand_id is not None:
+        statement = statement.where(models.License.product_id.in_(
+            select(models.Product.id).where(models.Product.brand_id == brand_id)
+        ))
+    records = {}
+    for row in db.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE)):
+        digest = hash_key(salt, row.key)
+        records[digest] = RECORD.pack(
+            digest,
+            row.product_id,
+            FLAG_ACTIVE if row.is_active else 0,
+            to_timestamp(row.expiration_date),
+            row.max_seats or 0,
+            row.active_seats or 0,
+        )
+    return records
+
+
+def write_snapshot(path: str, records: Iterable[bytes], signing_key: bytes, salt: bytes, kind: int = KIND_FULL,
+                   sequence: Optional[int] = None, base_sequence: int = 0, brand_id: Optional[int] = None) -> int:
+    """Sort packed records by key hash and write a signed file atomically. Returns the sequence."""
+    body = b"".join(sorted(records))
+    sequence = _sequence() if sequence is None else sequence
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, kind, sequence, base_sequence, int(time.time()), len(body) // RECORD.size,
+        NO_BRAND if brand_id is None else brand_id, salt, hashlib.sha256(body).digest(),
+    )
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(sign_header(signing_key, header))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return sequence
+
+
+def export_snapshot(db: Session, path: str, signing_key: bytes, brand_id: Optional[int] = None) -> int:
+    """Write a full snapshot with a fresh key salt. Returns the number of licenses."""
+    salt = secrets.token_bytes(16)
+    records = _license_records(db, salt, brand_id)
+    write_snapshot(path, records.values(), signing_key, salt, brand_id=brand_id)
+    return len(records)
+
+
+def export_delta(db: Session, reader: SnapshotReader, path: str, signing_key: bytes) -> int:
+    """Write the changes between the reader's state and the database. Returns the number of records."""
+    brand_id = None if reader.header.brand_id == NO_BRAND else reader.header.brand_id
+    current = _license_records(db, reader.salt, brand_id)
+    changed = []
+    for digest, packed in current.items():
+        known = reader.lookup_hash(digest)
+        if known is None or RECORD.pack(*known) != packed:
+            changed.append(packed)
+    for record in reader.records():
+        if record.key_hash not in current:
+            changed.append(RECORD.pack(record.key_hash, 0, FLAG_DELETED, 0, 0, 0))
+    write_snapshot(
+        path, changed, signing_key, reader.salt, kind=KIND_DELTA,
+        sequence=max(_sequence(), reader.sequence + 1), base_sequence=reader.sequence, brand_id=brand_id,
+    )
+    return len(changed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export license validation snapshots for edge gateways.")
+    parser.add_argument("command", choices=["export", "delta"])
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--brand-id", type=int, help="Only export this brand's licenses (export only)")
+    parser.add_argument("--base", help="Full snapshot the gateways have (delta only)")
+    parser.add_argument("--apply", action="append", default=[], help="Deltas already applied, in order (delta only)")
+    args = parser.parse_args()
+
+    from .database import SessionLocal, engine
+
+    signing_key = signing_key_from_env()
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.command == "export":
+            count = export_snapshot(db, args.out, signing_key, brand_id=args.brand_id)
+            print(f"Wrote {count} licenses to {args.out}")
+        else:
+            if not args.base:
+                parser.error("delta needs --base")
+            with SnapshotReader(args.base, signing_key) as reader:
+                for delta in args.apply:
+                    reader.apply_delta(delta)
+                count = export_delta(db, reader, args.out, signing_key)
+            print(f"Wrote {count} changed licenses to {args.out}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Memory-mapped reader for license validation snapshots.
+
+Edge gateways use this module to keep validating licenses while the backend
+is unreachable. It only needs the standard library, so it can be copied onto
+a gateway on its own. Snapshots are written by ``backend.snapshot``.
+
+File layout (little-endian):
+
+    header   96 bytes   magic, format version, kind (full/delta), sequence,
+                        base sequence, created_at, record count, brand id,
+                        key salt, SHA-256 of the records
+    signature 32 bytes  HMAC-SHA256 of the header, keyed with the signing key
+    records  40 bytes each, sorted by key hash:
+                        key hash (16), product_id, flags, expiration, max_seats,
+                        active_seats
+
+License keys are never stored. A record is found by the keyed BLAKE2b hash of
+the key (the salt is in the header), using a binary search over the mapped
+file. The records are not read into memory, so a snapshot with millions of
+licenses adds almost nothing to RSS, and each lookup takes a few
+microseconds.
+
+A delta file has the same layout. It holds the records that changed after
+the snapshot state with ``base sequence``, and deleted licenses as
+tombstones. ``apply_delta`` keeps them in a small in-memory overlay on top
+of the mapped base.
+"""
+from typing import Dict, NamedTuple, Optional
+import calendar
+import datetime
+import hashlib
+import hmac
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"LSNP"
+FORMAT_VERSION = 1
+KIND_FULL = 1
+KIND_DELTA = 2
+
+HEADER = struct.Struct("<4sHHQQQQq16s32s")
+SIGNATURE_SIZE = 32
+HEADER_SIZE = HEADER.size + SIGNATURE_SIZE
+RECORD = struct.Struct("<16sIB3xqII")
+DIGEST_SIZE = 16
+
+FLAG_ACTIVE = 1
+FLAG_DELETED = 2
+
+NO_BRAND = -1
+
+
+class SnapshotError(Exception):
+    """The file is not a valid snapshot, fails verification, or does not fit the loaded state."""
+
+
+class Header(NamedTuple):
+    magic: bytes
+    format_version: int
+    kind: int
+    sequence: int
+    base_sequence: int
+    created_at: int
+    count: int
+    brand_id: int
+    salt: bytes
+    body_digest: bytes
+
+
+class Record(NamedTuple):
+    key_hash: bytes
+    product_id: int
+    flags: int
+    expiration: int  # Unix seconds, 0 when the license never expires
+    max_seats: int
+    active_seats: int
+
+    @property
+    def is_active(self) -> bool:
+        return bool(self.flags & FLAG_ACTIVE)
+
+
+def hash_key(salt: bytes, key: str) -> bytes:
+    return hashlib.blake2b(key.encode(), digest_size=DIGEST_SIZE, key=salt).digest()
+
+
+def to_timestamp(value: Optional[datetime.datetime]) -> int:
+    """Naive UTC datetime (as stored by the backend) to Unix seconds; 0 for None."""
+    return calendar.timegm(value.utctimetuple()) if value else 0
+
+
+def sign_header(signing_key: bytes, header: bytes) -> bytes:
+    return hmac.new(signing_key, header, hashlib.sha256).digest()
+
+
+def _digest_body(buffer, start: int, end: int) -> bytes:
+    """SHA-256 of buffer[start:end] in chunks, so a mapped file is not copied into memory."""
+    digest = hashlib.sha256()
+    view = memoryview(buffer)
+    try:
+        for offset in range(start, end, 1 << 20):
+            digest.update(view[offset:min(offset + (1 << 20), end)])
+    finally:
+        view.release()
+    return digest.digest()
+
+
+def _read_header(buffer, signing_key: bytes, verify_body: bool) -> Header:
+    if len(buffer) < HEADER_SIZE:
+        raise SnapshotError("File is too short to be a snapshot")
+    raw = bytes(buffer[:HEADER.size])
+    header = Header(*HEADER.unpack(raw))
+    if header.magic != MAGIC:
+        raise SnapshotError("Not a license snapshot")
+    if header.format_version != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version {header.format_version}")
+    signature = bytes(buffer[HEADER.size:HEADER_SIZE])
+    if not hmac.compare_digest(sign_header(signing_key, raw), signature):
+        raise SnapshotError("Snapshot signature does not match")
+    end = HEADER_SIZE + header.count * RECORD.size
+    if len(buffer) != end:
+        raise SnapshotError("Snapshot length does not match its record count")
+    if verify_body and not hmac.compare_digest(_digest_body(buffer, HEADER_SIZE, end), header.body_digest):
+        raise SnapshotError("Snapshot records do not match the signed digest")
+    return header
+
+
+class SnapshotReader:
+    """Answers validation queries from a mapped snapshot plus applied deltas."""
+
+    def __init__(self, path: str, signing_key: bytes, verify_body: bool = True):
+        self.path = path
+        self._signing_key = signing_key
+        with open(path, "rb") as f:
+            # Zero-length files cannot be mapped; _read_header rejects them anyway
+            size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            self.header = _read_header(self._mm, signing_key, verify_body)
+        except SnapshotError:
+            self.close()
+            raise
+        if self.header.kind != KIND_FULL:
+            self.close()
+            raise SnapshotError("Expected a full snapshot, got a delta")
+        self.salt = self.header.salt
+        self.sequence = self.header.sequence
+        self._overlay: Dict[bytes, Record] = {}
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.header.count
+
+    def _search(self, digest: bytes) -> Optional[Record]:
+        mm, lo, hi = self._mm, 0, self.header.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = HEADER_SIZE + mid * RECORD.size
+            probe = mm[start:start + DIGEST_SIZE]
+            if probe < digest:
+                lo = mid + 1
+            elif probe > digest:
+                hi = mid
+            else:
+                return Record(*RECORD.unpack_from(mm, start))
+        return None
+
+    def lookup_hash(self, digest: bytes) -> Optional[Record]:
+        record = self._overlay.get(digest)
+        if record is None:
+            record = self._search(digest)
+        if record is None or record.flags & FLAG_DELETED:
+            return None
+        return record
+
+    def lookup(self, key: str) -> Optional[Record]:
+        return self.lookup_hash(hash_key(self.salt, key))
+
+    def records(self):
+        """Every live record, base records first, then records only present in deltas."""
+        for index in range(self.header.count):
+            record = Record(*RECORD.unpack_from(self._mm, HEADER_SIZE + index * RECORD.size))
+            current = self._overlay.get(record.key_hash, record)
+            if not current.flags & FLAG_DELETED:
+                yield current
+        for digest, record in self._overlay.items():
+            if not record.flags & FLAG_DELETED and self._search(digest) is None:
+                yield record
+
+    def validate(self, key: str, product_id: int, now: Optional[float] = None) -> dict:
+        """
+        Same decision as ``POST /licenses/validate``.
+
+        The API's 404 and 400 responses become ``valid: False`` with the
+        API's error message as the reason.
+        """
+        record = self.lookup(key)
+        if record is None:
+            return {"valid": False, "reason": "License not found"}
+        if record.product_id != product_id:
+            return {"valid": False, "reason": "License invalid for this product"}
+        if not record.is_active:
+            return {"valid": False, "reason": "License is inactive"}
+        if record.expiration and record.expiration < (time.time() if now is None else now):
+            return {"valid": False, "reason": "License expired"}
+        return {
+            "valid": True,
+            "seats_available": record.max_seats - record.active_seats,
+            "activations_count": record.active_seats,
+        }
+
+    def apply_delta(self, path: str):
+        """Apply a delta written against this reader's current sequence."""
+        with open(path, "rb") as f:
+            data = f.read()
+        header = _read_header(data, self._signing_key, verify_body=True)
+        if header.kind != KIND_DELTA:
+            raise SnapshotError("Expected a delta, got a full snapshot")
+        if header.salt != self.salt or header.brand_id != self.header.brand_id:
+            raise SnapshotError("Delta belongs to a different snapshot")
+        if header.base_sequence != self.sequence:
+            raise SnapshotError(
+                f"Delta applies to sequence {header.base_sequence}, reader is at {self.sequence}"
+            )
+        for index in range(header.count):
+            record = Record(*RECORD.unpack_from(data, HEADER_SIZE + index * RECORD.size))
+            self._overlay[record.key_hash] = record
+        self.sequence = header.sequence
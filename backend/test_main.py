@@ -1,10 +1,22 @@
+from datetime import datetime, timedelta
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import pytest
+import socket
+import threading
+import time
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+from . import admission, analytics, auth, crud, database, migrate, models, schemas, search, seats, server, snapshot, webhooks
 from .database import Base
+from .idempotency import IdempotencyStore, EXECUTE, BUSY, REPLAY, MISMATCH
 from .main import app, get_db
+from .singleflight import SingleFlight, invalidate_on_commit
+from .snapshot_reader import SnapshotError, SnapshotReader
 
 # Setup in-memory SQLite database for testing
 SQLALCHEMY_DATABASE_URL = "sqlite://"
@@ -25,14 +37,20 @@ def override_get_db():
     finally:
         db.close()
 
+def override_get_api_key():
+    return models.APIKey(id=0, name="test", brand_id=None, is_active=True)
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[auth.get_api_key] = override_get_api_key
+app.state.limiter.enabled = False
+app.state.idempotency_store = IdempotencyStore(TestingSessionLocal)
 
 client = TestClient(app)
 
 def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"message": "Welcome to the Centralized License System API"}
+    assert response.json()["message"] == "Welcome to the Centralized License System API"
 
 def test_create_brand():
     response = client.post(
@@ -136,3 +154,854 @@ def test_max_seats_limit():
     )
     assert response.status_code == 400
     assert response.json()["detail"] == "Max seats reached"
+
+def test_fast_path_matches_response_models():
+    customer_id = client.post("/customers/", json={"email": "fast@cust.com"}).json()["id"]
+    lic_res = client.post(
+        "/licenses/",
+        json={"customer_id": customer_id, "product_id": 1, "max_seats": 3}
+    )
+    key = lic_res.json()["key"]
+    client.post("/licenses/activate", json={"license_key": key, "machine_id": "FAST-1"})
+
+    db = TestingSessionLocal()
+    try:
+        customer = crud.get_customer_by_email(db, email="fast@cust.com")
+        expected_licenses = [
+            schemas.License.model_validate(lic).model_dump(mode="json")
+            for lic in crud.get_licenses_by_customer(db, customer_id=customer.id)
+        ]
+        expected_brands = [schemas.Brand.model_validate(b).model_dump(mode="json") for b in crud.get_brands(db)]
+        expected_customers = [schemas.Customer.model_validate(c).model_dump(mode="json") for c in crud.get_customers(db)]
+    finally:
+        db.close()
+
+    response = client.get("/customers/fast@cust.com/licenses")
+    assert response.status_code == 200
+    assert response.json() == expected_licenses
+    assert response.json()[0]["activations"][0]["machine_id"] == "FAST-1"
+    assert client.get("/brands/").json() == expected_brands
+    assert client.get("/customers/").json() == expected_customers
+
+def test_etag_conditional_requests():
+    first = client.get("/brands/")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "private, no-cache"
+
+    cached = client.get("/brands/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    # Different query parameters are a different representation
+    assert client.get("/brands/?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+    client.post("/brands/", json={"name": "EtagBrand", "email": "etag@brand.com"})
+    changed = client.get("/brands/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+def test_etag_changes_on_activation():
+    customer_id = client.post("/customers/", json={"email": "etag@cust.com"}).json()["id"]
+    key = client.post(
+        "/licenses/",
+        json={"customer_id": customer_id, "product_id": 1, "max_seats": 2}
+    ).json()["key"]
+    etag = client.get("/customers/etag@cust.com/licenses").headers["etag"]
+    assert client.get("/customers/etag@cust.com/licenses", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/licenses/activate", json={"license_key": key, "machine_id": "ETAG-1"})
+    response = client.get("/customers/etag@cust.com/licenses", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[0]["active_seats"] == 1
+
+    # Activations bump one of several shard rows instead of a single shared row
+    db = TestingSessionLocal()
+    try:
+        names = [name for name, in db.query(models.TableVersion.table_name)]
+        assert "activations" not in names
+        assert any(name.startswith("activations:") for name in names)
+        before = crud.get_table_versions(db, "activations")["activations"]
+        for _ in range(5):
+            crud.bump_table_versions(db, "activations", "licenses")
+        db.commit()
+        assert crud.get_table_versions(db, "activations")["activations"] == before + 5
+    finally:
+        db.close()
+
+def test_idempotent_replay():
+    headers = {"Idempotency-Key": "create-idem-customer"}
+    first = client.post("/customers/", json={"email": "idem@cust.com"}, headers=headers)
+    assert first.status_code == 200
+
+    replay = client.post("/customers/", json={"email": "idem@cust.com"}, headers=headers)
+    assert replay.status_code == 200
+    assert replay.json() == first.json()
+    assert replay.headers["idempotent-replayed"] == "true"
+
+    # Without the key the duplicate is executed and rejected
+    assert client.post("/customers/", json={"email": "idem@cust.com"}).status_code == 400
+
+    # Reusing the key for a different request is an error
+    other = client.post("/customers/", json={"email": "other@cust.com"}, headers=headers)
+    assert other.status_code == 422
+
+def test_idempotency_keeps_repeated_headers():
+    from fastapi import FastAPI, Response
+    from .middleware import IdempotencyMiddleware
+
+    cookie_app = FastAPI()
+    cookie_app.state.idempotency_store = IdempotencyStore(TestingSessionLocal)
+    cookie_app.add_middleware(IdempotencyMiddleware)
+
+    @cookie_app.post("/cookies")
+    def set_cookies(response: Response):
+        response.set_cookie("first", "1")
+        response.set_cookie("second", "2")
+        response.headers.append("Vary", "Accept-Encoding")
+        return {"ok": True}
+
+    response = TestClient(cookie_app).post("/cookies", headers={"Idempotency-Key": "repeated-headers"})
+    assert response.status_code == 200
+    assert [value.split("=")[0] for value in response.headers.get_list("set-cookie")] == ["first", "second"]
+    assert response.headers.get_list("vary") == ["Accept-Encoding"]
+    assert response.json() == {"ok": True}
+
+def test_idempotency_store_claims_once():
+    store = IdempotencyStore(TestingSessionLocal)
+    assert store.begin("claim-key", "req-a").action == EXECUTE
+    assert store.begin("claim-key", "req-a").action == BUSY
+    assert store.begin("claim-key", "req-b").action == MISMATCH
+
+    store.complete("claim-key", 201, "application/json", b'{"ok":true}')
+    outcome = store.begin("claim-key", "req-a")
+    assert outcome.action == REPLAY
+    assert outcome.status_code == 201
+    assert outcome.body == b'{"ok":true}'
+
+    # A failed request releases its claim so the retry executes
+    assert store.begin("failed-key", "req-a").action == EXECUTE
+    store.release("failed-key")
+    assert store.begin("failed-key", "req-a").action == EXECUTE
+
+def test_brand_scoped_api_key():
+    brand_a = client.post("/brands/", json={"name": "TenantA", "email": "a@tenant.com"}).json()["id"]
+    brand_b = client.post("/brands/", json={"name": "TenantB", "email": "b@tenant.com"}).json()["id"]
+    product_a = client.post("/products/", json={"name": "ProductA", "brand_id": brand_a}).json()["id"]
+    product_b = client.post("/products/", json={"name": "ProductB", "brand_id": brand_b}).json()["id"]
+    customer_id = client.post("/customers/", json={"email": "tenant@cust.com"}).json()["id"]
+    key_b = client.post(
+        "/licenses/", json={"customer_id": customer_id, "product_id": product_b}
+    ).json()["key"]
+
+    app.dependency_overrides[auth.get_api_key] = lambda: models.APIKey(id=1, name="a", brand_id=brand_a, is_active=True)
+    try:
+        assert [b["id"] for b in client.get("/brands/").json()] == [brand_a]
+        assert [p["id"] for p in client.get("/products/").json()] == [product_a]
+        assert client.post("/products/", json={"name": "Sneaky", "brand_id": brand_b}).status_code == 403
+        assert client.post("/brands/", json={"name": "TenantC", "email": "c@tenant.com"}).status_code == 403
+
+        # Customer is invisible until it holds one of brand A's licenses
+        assert client.get("/customers/tenant@cust.com/licenses").status_code == 404
+        assert client.post("/licenses/validate", json={"key": key_b, "product_id": product_b}).status_code == 404
+        assert client.post(
+            "/licenses/", json={"customer_id": customer_id, "product_id": product_b}
+        ).status_code == 404
+
+        # Another tenant's customer cannot be reached by id; the brand attaches it by email first
+        assert client.post(
+            "/licenses/", json={"customer_id": customer_id, "product_id": product_a}
+        ).status_code == 404
+        assert client.get("/customers/").json() == []
+        assert client.post("/customers/", json={"email": "tenant@cust.com"}).json()["id"] == customer_id
+        key_a = client.post(
+            "/licenses/", json={"customer_id": customer_id, "product_id": product_a}
+        ).json()["key"]
+        licenses = client.get("/customers/tenant@cust.com/licenses").json()
+        assert [lic["key"] for lic in licenses] == [key_a]
+        assert [c["email"] for c in client.get("/customers/").json()] == ["tenant@cust.com"]
+
+        # Customers the brand registers itself can be licensed right away
+        new_customer = client.post("/customers/", json={"email": "fresh@tenant.com"}).json()["id"]
+        assert client.post(
+            "/licenses/", json={"customer_id": new_customer, "product_id": product_a}
+        ).status_code == 200
+    finally:
+        app.dependency_overrides[auth.get_api_key] = override_get_api_key
+
+    # The scoped customer listing starts from the brand's licenses instead of scanning customers
+    db = TestingSessionLocal()
+    try:
+        statement = crud._scope_customers(db.query(models.Customer.id), brand_a).statement
+        sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+        plan = " ".join(row[3] for row in db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+        assert "SCAN customers" not in plan
+        assert "ix_licenses_product_id_customer_id" in plan
+    finally:
+        db.close()
+
+def test_api_key_creation_requires_admin_key():
+    brand_a = client.post("/brands/", json={"name": "KeyBrandA", "email": "a@keybrand.com"}).json()["id"]
+    brand_b = client.post("/brands/", json={"name": "KeyBrandB", "email": "b@keybrand.com"}).json()["id"]
+
+    # The first key can be created without one; after that a key is required
+    admin = client.post("/api-keys/", json={"name": "bootstrap"}).json()["key"]
+    assert client.post("/api-keys/", json={"name": "anonymous"}).status_code == 401
+    assert client.post("/api-keys/", json={"name": "forged"}, headers={"X-API-Key": "lsk_live_nope"}).status_code == 401
+
+    brand_key = client.post("/api-keys/", json={"name": "a", "brand_id": brand_a}, headers={"X-API-Key": admin}).json()["key"]
+    for brand_id in (brand_b, None):
+        response = client.post("/api-keys/", json={"name": "escalate", "brand_id": brand_id}, headers={"X-API-Key": brand_key})
+        assert response.status_code == 403
+    response = client.post("/api-keys/", json={"name": "a2", "brand_id": brand_a}, headers={"X-API-Key": brand_key})
+    assert response.status_code == 200 and response.json()["brand_id"] == brand_a
+
+def test_analytics_rollups():
+    brand_id = client.post("/brands/", json={"name": "StatsBrand", "email": "stats@brand.com"}).json()["id"]
+    product_id = client.post("/products/", json={"name": "StatsProduct", "brand_id": brand_id}).json()["id"]
+    customer_id = client.post("/customers/", json={"email": "stats@cust.com"}).json()["id"]
+    lic = client.post(
+        "/licenses/",
+        json={"customer_id": customer_id, "product_id": product_id, "max_seats": 4,
+              "expiration_date": "2031-05-20T00:00:00"}
+    ).json()
+    activation = client.post("/licenses/activate", json={"license_key": lic["key"], "machine_id": "STATS-1"}).json()
+    client.post("/licenses/activate", json={"license_key": lic["key"], "machine_id": "STATS-2"})
+    client.delete(f"/activations/{activation['id']}")
+    client.put(f"/licenses/{lic['id']}/suspend")
+
+    usage = [u for u in client.get("/analytics/seat-utilization").json() if u["product_id"] == product_id]
+    assert usage == [{
+        "product_id": product_id, "name": "StatsProduct", "brand_id": brand_id,
+        "licenses_total": 1, "licenses_active": 0, "seats_total": 4, "seats_used": 1, "utilization": 0.25,
+    }]
+
+    days = client.get(f"/analytics/activations?product_id={product_id}").json()
+    assert [(d["activations"], d["deactivations"]) for d in days] == [(2, 1)]
+    assert client.get(f"/analytics/expirations?product_id={product_id}").json() == [{"month": "2031-05", "licenses": 1}]
+
+    # Rebuilding from the base tables reproduces the incremental seat counts
+    db = TestingSessionLocal()
+    try:
+        before = analytics.get_seat_utilization(db)
+        analytics.rebuild(db)
+        assert analytics.get_seat_utilization(db) == before
+        # Deactivation history survives a rebuild unless it is reset explicitly
+        history = analytics.get_activation_counts(db, product_id=product_id)
+        assert [(d["activations"], d["deactivations"]) for d in history] == [(2, 1)]
+        analytics.rebuild(db, reset_history=True)
+        history = analytics.get_activation_counts(db, product_id=product_id)
+        assert [(d["activations"], d["deactivations"]) for d in history] == [(1, 0)]
+    finally:
+        db.close()
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return "row"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["row"] * 8
+    assert len(calls) == 1
+
+    # Without a window, a finished call is not reused
+    assert flight.do("k", lambda: "fresh") == "fresh"
+
+def test_coalesced_validation_sees_own_commits():
+    flight = SingleFlight(window_seconds=1.0)
+    invalidate_on_commit(flight, "licenses")
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.do("k", lambda: 2) == 1
+
+    db = TestingSessionLocal()
+    try:
+        crud.bump_table_versions(db, "licenses")
+        db.commit()
+    finally:
+        db.close()
+    assert flight.do("k", lambda: 3) == 3
+
+def test_striped_seat_counter():
+    customer_id = client.post("/customers/", json={"email": "striped@cust.com"}).json()["id"]
+    lic = client.post(
+        "/licenses/",
+        json={"customer_id": customer_id, "product_id": 1, "max_seats": 5, "seat_slots": 3}
+    ).json()
+    activation_ids = []
+    for n in range(5):
+        response = client.post("/licenses/activate", json={"license_key": lic["key"], "machine_id": f"STRIPE-{n}"})
+        assert response.status_code == 200
+        activation_ids.append(response.json()["id"])
+
+    response = client.post("/licenses/activate", json={"license_key": lic["key"], "machine_id": "STRIPE-X"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Max seats reached"
+
+    client.delete(f"/activations/{activation_ids[0]}")
+    validation = client.post("/licenses/validate", json={"key": lic["key"], "product_id": 1}).json()
+    assert validation["activations_count"] == 4
+    assert validation["seats_available"] == 1
+    assert client.get("/customers/striped@cust.com/licenses").json()[0]["active_seats"] == 4
+
+def test_seat_slots_column_added_to_existing_database(tmp_path):
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE licenses (id INTEGER PRIMARY KEY, key VARCHAR UNIQUE, customer_id INTEGER, "
+            "product_id INTEGER, is_active BOOLEAN, expiration_date DATETIME, max_seats INTEGER, "
+            "active_seats INTEGER, created_at DATETIME)"
+        )
+        connection.exec_driver_sql("INSERT INTO licenses (id, key, max_seats, active_seats) VALUES (1, 'OLD', 5, 2)")
+    Base.metadata.create_all(bind=old_engine)
+    Base.metadata.create_all(bind=old_engine)  # Idempotent
+    assert "seat_slots" in {column["name"] for column in inspect(old_engine).get_columns("licenses")}
+    with old_engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT seat_slots FROM licenses").scalar() == 0
+
+    # Indexes on the existing table are left to the migrate command
+    assert "ix_licenses_product_id_customer_id" in migrate.missing_indexes(old_engine)
+    assert "ix_licenses_product_id_customer_id" in migrate.create_missing_indexes(old_engine)
+    assert migrate.missing_indexes(old_engine) == [] and migrate.create_missing_indexes(old_engine) == []
+    assert "ix_licenses_product_id_customer_id" in {index["name"] for index in inspect(old_engine).get_indexes("licenses")}
+    old_engine.dispose()
+
+def test_reconcile_repairs_seat_drift(caplog):
+    customer_id = client.post("/customers/", json={"email": "drift@cust.com"}).json()["id"]
+    plain = client.post("/licenses/", json={"customer_id": customer_id, "product_id": 1, "max_seats": 3}).json()
+    striped = client.post(
+        "/licenses/", json={"customer_id": customer_id, "product_id": 1, "max_seats": 4, "seat_slots": 2}
+    ).json()
+    over_cap = client.post(
+        "/licenses/", json={"customer_id": customer_id, "product_id": 1, "max_seats": 2, "seat_slots": 2}
+    ).json()
+    client.post("/licenses/activate", json={"license_key": plain["key"], "machine_id": "DRIFT-1"})
+    client.post("/licenses/activate", json={"license_key": plain["key"], "machine_id": "DRIFT-2"})
+    client.post("/licenses/activate", json={"license_key": striped["key"], "machine_id": "DRIFT-3"})
+
+    def seats_used(db):
+        return next(row["seats_used"] for row in analytics.get_seat_utilization(db) if row["product_id"] == 1)
+
+    db = TestingSessionLocal()
+    try:
+        before = seats_used(db)
+        # Rows changed behind the API's back: the counters and the rollup still count them
+        db.query(models.Activation).filter(models.Activation.machine_id.in_(["DRIFT-1", "DRIFT-3"])).delete()
+        db.add_all(models.Activation(license_id=over_cap["id"], machine_id=f"OVER-{i}") for i in range(3))
+        db.commit()
+
+        with caplog.at_level("WARNING", logger="backend.seats"):
+            repaired = seats.reconcile(db, license_ids=[plain["id"], striped["id"], over_cap["id"]])
+        assert sorted(repaired) == sorted([(plain["id"], 2, 1), (striped["id"], 1, 0), (over_cap["id"], 0, 3)])
+        assert seats.get_active_seats(db, crud.get_license(db, striped["id"])) == 0
+        # The overage is kept rather than capped, and the license is reported
+        assert seats.get_active_seats(db, crud.get_license(db, over_cap["id"])) == 3
+        assert [r.license_id for r in caplog.records if r.getMessage() == "License has more activations than seats"] == [
+            over_cap["id"]
+        ]
+        assert seats_used(db) == before - 1 - 1 + 3
+        assert seats.reconcile(db, license_ids=[plain["id"], striped["id"], over_cap["id"]]) == []
+        assert seats_used(db) == before + 1
+    finally:
+        db.close()
+    assert client.post("/licenses/activate", json={"license_key": over_cap["key"], "machine_id": "OVER-3"}).status_code == 400
+
+def test_bulk_deactivation():
+    customer_id = client.post("/customers/", json={"email": "bulk@cust.com"}).json()["id"]
+    keys = [
+        client.post("/licenses/", json={"customer_id": customer_id, "product_id": 1, "max_seats": 5}).json()["key"]
+        for _ in range(3)
+    ]
+    striped_key = client.post(
+        "/licenses/", json={"customer_id": customer_id, "product_id": 1, "max_seats": 5, "seat_slots": 2}
+    ).json()["key"]
+    ids = []
+    for key in keys + [striped_key]:
+        ids.append(client.post("/licenses/activate", json={"license_key": key, "machine_id": "RETIRED-IMAGE"}).json()["id"])
+        ids.append(client.post("/licenses/activate", json={"license_key": key, "machine_id": "KEEP"}).json()["id"])
+
+    db = TestingSessionLocal()
+    try:
+        summary = crud.bulk_delete_activations(db, machine_id="RETIRED-IMAGE", batch_size=2)
+    finally:
+        db.close()
+    assert summary == {"deleted": 4, "licenses_affected": 4, "batches": 2}
+    for key in keys + [striped_key]:
+        assert client.post("/licenses/validate", json={"key": key, "product_id": 1}).json()["activations_count"] == 1
+
+    response = client.post("/activations/bulk-deactivate", json={"activation_ids": [ids[1], ids[3], 999999]})
+    assert response.json() == {"deleted": 2, "licenses_affected": 2, "batches": 1}
+
+    # A large striped license releases its seats with one UPDATE per slot, not one per seat
+    site = client.post(
+        "/licenses/", json={"customer_id": customer_id, "product_id": 1, "max_seats": 300, "seat_slots": 4}
+    ).json()
+    db = TestingSessionLocal()
+    try:
+        for n in range(300):
+            crud.create_activation(db, license_id=site["id"], machine_id=f"SITE-{n}")
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            summary = crud.bulk_delete_activations(db, license_id=site["id"])
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        assert summary == {"deleted": 300, "licenses_affected": 1, "batches": 1}
+        assert sum(statement.startswith("UPDATE license_seat_counters") for statement in statements) == 4
+        assert seats.get_active_seats(db, crud.get_license(db, site["id"])) == 0
+    finally:
+        db.close()
+    assert client.post("/licenses/validate", json={"key": keys[0], "product_id": 1}).json()["activations_count"] == 0
+
+    assert client.post("/activations/bulk-deactivate", json={"machine_id": "KEEP", "license_id": 1}).status_code == 422
+
+def test_search():
+    customer_id = client.post("/customers/", json={"email": "findme.support@cust.com"}).json()["id"]
+    key = client.post(
+        "/licenses/", json={"customer_id": customer_id, "product_id": 1, "key": "SRCH-7Q2X-ALPHA", "max_seats": 3}
+    ).json()["key"]
+    activation_id = client.post(
+        "/licenses/activate", json={"license_key": key, "machine_id": "M-SRCH-1", "friendly_name": "Dana's ThinkPad"}
+    ).json()["id"]
+
+    hits = client.get("/search", params={"q": "findme"}).json()
+    assert [(hit["kind"], hit["id"], hit["value"]) for hit in hits] == [("customer", customer_id, "findme.support@cust.com")]
+    hits = client.get("/search", params={"q": "7q2x"}).json()  # Case-insensitive
+    assert [(hit["kind"], hit["value"]) for hit in hits] == [("license", key)]
+    hits = client.get("/search", params={"q": "thinkpad", "kind": "activation"}).json()
+    assert [(hit["id"], hit["label"]) for hit in hits] == [(activation_id, "Dana's ThinkPad")]
+    assert client.get("/search", params={"q": "thinkpad", "kind": "license"}).json() == []
+    assert client.get("/search", params={"q": "ab"}).status_code == 422
+
+    # Exact matches rank first; results paginate
+    client.post("/customers/", json={"email": "findme@cust.com"})
+    hits = client.get("/search", params={"q": "findme@cust.com"}).json()
+    assert hits[0]["value"] == "findme@cust.com"
+    assert len(client.get("/search", params={"q": "findme", "limit": 1}).json()) == 1
+    assert client.get("/search", params={"q": "findme", "skip": 1, "limit": 1}).json()[0]["value"] != hits[0]["value"]
+
+    # Deactivation removes the activation from the index; brand-scoped keys only see their rows
+    client.delete(f"/activations/{activation_id}")
+    assert client.get("/search", params={"q": "thinkpad"}).json() == []
+    other_brand = client.post("/brands/", json={"name": "SearchBrand", "email": "s@brand.com"}).json()["id"]
+    app.dependency_overrides[auth.get_api_key] = lambda: models.APIKey(id=1, name="s", brand_id=other_brand, is_active=True)
+    try:
+        assert client.get("/search", params={"q": "findme"}).json() == []
+    finally:
+        app.dependency_overrides[auth.get_api_key] = override_get_api_key
+
+    # rebuild recreates the index from the base tables
+    db = TestingSessionLocal()
+    try:
+        search.rebuild(db)
+        assert [row.id for row in search.search(db, "SRCH-7Q2X", kinds=["license"])] == [
+            crud.get_license_by_key(db, key).id
+        ]
+    finally:
+        db.close()
+
+def test_dashboard_summary():
+    full = client.get("/dashboard/summary").json()
+    assert full["complete"] is True
+    assert full["counts"]["brands"] == len(full["brands"])
+    assert full["counts"]["customers"] == len(full["customers"])
+    assert full["counts"]["licenses"] >= len(full["recent_licenses"]) > 0
+
+    # Nothing new since the cursor; then only the new rows come back
+    cursor = full["cursor"]
+    delta = client.get("/dashboard/summary", params={"since": cursor}).json()
+    assert (delta["brands"], delta["products"], delta["customers"]) == ({}, {}, {})
+    brand_id = client.post("/brands/", json={"name": "DashBrand", "email": "dash@brand.com"}).json()["id"]
+    product_id = client.post("/products/", json={"name": "DashProduct", "brand_id": brand_id}).json()["id"]
+    customer_id = client.post("/customers/", json={"email": "dash@cust.com"}).json()["id"]
+    delta = client.get("/dashboard/summary", params={"since": cursor}).json()
+    assert delta["brands"] == {str(brand_id): "DashBrand"}
+    assert delta["products"] == {str(product_id): {"name": "DashProduct", "brand_id": brand_id}}
+    assert delta["customers"] == {str(customer_id): "dash@cust.com"}
+    assert delta["counts"]["brands"] == full["counts"]["brands"] + 1
+
+    # Maps page through the limit; unchanged summaries revalidate with 304
+    page = client.get("/dashboard/summary", params={"limit": 1}).json()
+    assert page["complete"] is False and len(page["customers"]) == 1
+    response = client.get("/dashboard/summary", params={"since": delta["cursor"]})
+    assert client.get(
+        "/dashboard/summary", params={"since": delta["cursor"]}, headers={"If-None-Match": response.headers["etag"]}
+    ).status_code == 304
+    assert client.get("/dashboard/summary", params={"since": "1.2"}).status_code == 400
+
+    # A brand-scoped key learns about an existing customer once it holds one of the brand's licenses
+    app.dependency_overrides[auth.get_api_key] = lambda: models.APIKey(id=1, name="d", brand_id=brand_id, is_active=True)
+    try:
+        scoped = client.get("/dashboard/summary").json()
+        assert scoped["brands"] == {str(brand_id): "DashBrand"} and scoped["customers"] == {}
+        old_customer = full["recent_licenses"][0]["customer_id"]
+        client.post("/customers/", json={"email": full["customers"][str(old_customer)]})
+        client.post("/licenses/", json={"customer_id": old_customer, "product_id": product_id})
+        scoped_delta = client.get("/dashboard/summary", params={"since": scoped["cursor"]}).json()
+        assert list(scoped_delta["customers"]) == [str(old_customer)]
+        assert scoped_delta["counts"]["licenses"] == 1
+    finally:
+        app.dependency_overrides[auth.get_api_key] = override_get_api_key
+
+def test_webhook_outbox_delivery(monkeypatch):
+    monkeypatch.setattr(webhooks, "ALLOW_PRIVATE_TARGETS", True)  # The partner listens on localhost
+    received = []
+    responses = [500]  # The partner fails once, then accepts
+
+    class Partner(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append((self.headers[webhooks.SIGNATURE_HEADER], body))
+            self.send_response(responses.pop(0) if responses else 204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Partner)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        closed_port = sock.getsockname()[1]
+
+    brand_id = client.post("/brands/", json={"name": "HookBrand", "email": "hook@brand.com"}).json()["id"]
+    product_id = client.post("/products/", json={"name": "HookProduct", "brand_id": brand_id}).json()["id"]
+    customer_id = client.post("/customers/", json={"email": "hook@cust.com"}).json()["id"]
+    endpoint = client.post("/webhooks/", json={
+        "url": f"http://127.0.0.1:{server.server_address[1]}/hook", "brand_id": brand_id,
+        "event_types": ["license.activated", "license.suspended"],
+    }).json()
+    down = client.post("/webhooks/", json={"url": f"http://127.0.0.1:{closed_port}/hook", "brand_id": brand_id}).json()
+    assert "secret" not in client.get("/webhooks/").json()[0]
+
+    license = client.post("/licenses/", json={"customer_id": customer_id, "product_id": product_id, "max_seats": 2}).json()
+    activation = client.post("/licenses/activate", json={"license_key": license["key"], "machine_id": "HOOK-1"}).json()
+    client.put(f"/licenses/{license['id']}/suspend")
+    client.delete(f"/activations/{activation['id']}")
+
+    db = TestingSessionLocal()
+    try:
+        # Events were committed with the writes; nothing has been sent yet
+        assert [event.event_type for event in db.query(models.OutboxEvent).filter(
+            models.OutboxEvent.subject_id == license["id"]
+        ).order_by(models.OutboxEvent.id)] == ["license.activated", "license.suspended", "license.deactivated"]
+        assert received == []
+    finally:
+        db.close()
+
+    def make_due():
+        db = TestingSessionLocal()
+        try:
+            db.query(models.WebhookDelivery).update({models.WebhookDelivery.next_attempt_at: models.WebhookDelivery.created_at})
+            db.commit()
+        finally:
+            db.close()
+
+    async def dispatch():
+        # One delivery at a time: the test database is a single shared connection
+        dispatcher = webhooks.Dispatcher(TestingSessionLocal, concurrency=1, max_attempts=2)
+        try:
+            for _ in range(2):
+                while await dispatcher.run_once():
+                    await dispatcher.drain()
+                make_due()
+        finally:
+            await dispatcher.client.aclose()
+
+    asyncio.run(dispatch())
+    server.shutdown()
+
+    # The failed attempt was retried; every request carries a valid signature
+    assert len(received) == 3
+    events = [json.loads(body) for _, body in received]
+    assert sorted(event["type"] for event in events[1:]) == ["license.activated", "license.suspended"]
+    assert all(webhooks.verify_signature(endpoint["secret"], header, body) for header, body in received)
+    assert not webhooks.verify_signature(down["secret"], *received[0])
+
+    deliveries = client.get(f"/webhooks/{endpoint['id']}/deliveries").json()
+    assert [d["status"] for d in deliveries] == ["delivered", "delivered"]
+    dead = client.get(f"/webhooks/{down['id']}/deliveries", params={"status": "dead"}).json()
+    assert len(dead) == 3 and all(d["attempts"] == 2 for d in dead)
+    retried = client.post(f"/webhooks/deliveries/{dead[0]['id']}/retry").json()
+    assert (retried["status"], retried["attempts"]) == ("pending", 0)
+    assert client.delete(f"/webhooks/{down['id']}").json()["is_active"] is False
+    assert client.get(f"/webhooks/{down['id']}/deliveries", params={"status": "pending"}).json() == []
+
+def test_webhook_private_targets_rejected(monkeypatch):
+    hits = []
+
+    class Internal(BaseHTTPRequestHandler):
+        def do_POST(self):
+            hits.append(self.path)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Internal)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    internal_url = f"http://localhost:{server.server_address[1]}/hook"
+
+    brand_id = client.post("/brands/", json={"name": "SsrfBrand", "email": "ssrf@brand.com"}).json()["id"]
+    for url in [internal_url, "http://169.254.169.254/latest/meta-data", "http://10.0.0.5/", "http://[::1]/",
+                "http://[::ffff:127.0.0.1]/", "http://0.0.0.0/"]:
+        response = client.post("/webhooks/", json={"url": url, "brand_id": brand_id})
+        assert response.status_code == 400, url
+    assert client.post("/webhooks/", json={"url": "http://no-such-host.invalid/", "brand_id": brand_id}).status_code == 400
+    assert webhooks.check_url("https://93.184.216.34/hooks") is None
+
+    # An endpoint that passed registration but now points inside is refused at connect time
+    db = TestingSessionLocal()
+    try:
+        db_endpoint = models.WebhookEndpoint(brand_id=brand_id, url=internal_url, secret="whsec_test", max_concurrency=1)
+        db.add(db_endpoint)
+        db.commit()
+        endpoint_id = db_endpoint.id
+        job = webhooks.Job(delivery_id=0, attempts=0, endpoint_id=endpoint_id, url=internal_url,
+                           secret="whsec_test", event_type="license.activated", body=b"{}")
+    finally:
+        db.close()
+
+    recorded = []
+
+    async def send():
+        dispatcher = webhooks.Dispatcher(TestingSessionLocal)
+        dispatcher._run = lambda fn, job, status_code, error: recorded.append((status_code, error))
+        dispatcher.client = webhooks.make_client()
+        try:
+            await dispatcher._send(job)
+        finally:
+            await dispatcher.client.aclose()
+
+    asyncio.run(send())
+    assert hits == []
+    assert recorded[0][0] is None and recorded[0][1].startswith("UnsafeTargetError")
+
+    # The same transport delivers once the address counts as public
+    monkeypatch.setattr(webhooks, "_is_public", lambda address: True)
+    asyncio.run(send())
+    server.shutdown()
+    assert hits == ["/hook"] and recorded[1] == (204, None)
+
+def test_webhook_concurrency_limit_spans_dispatchers():
+    brand_id = client.post("/brands/", json={"name": "LimitBrand", "email": "limit@brand.com"}).json()["id"]
+    db = TestingSessionLocal()
+    try:
+        db_endpoint = models.WebhookEndpoint(brand_id=brand_id, url="https://partner.example/hook",
+                                             secret="whsec_test", max_concurrency=2)
+        db.add(db_endpoint)
+        db.flush()
+        db_event = models.OutboxEvent(event_type="license.activated", payload="{}")
+        db.add(db_event)
+        db.flush()
+        past = datetime.utcnow() - timedelta(minutes=1)
+        db.add_all([
+            models.WebhookDelivery(event_id=db_event.id, endpoint_id=db_endpoint.id, status="pending",
+                                   attempts=0, next_attempt_at=past)
+            for _ in range(5)
+        ])
+        db.commit()
+        endpoint_id = db_endpoint.id
+    finally:
+        db.close()
+
+    def claim(dispatcher):
+        return [job for job in dispatcher._run(dispatcher._claim, 10) if job.endpoint_id == endpoint_id]
+
+    # Each API worker runs its own dispatcher; together they stay within max_concurrency
+    first, second = webhooks.Dispatcher(TestingSessionLocal), webhooks.Dispatcher(TestingSessionLocal)
+    leased = claim(first)
+    assert len(leased) == 2 and claim(second) == []
+    first._run(first._record, leased[0], 204, None)
+    assert len(claim(second)) == 1 and claim(first) == []
+
+def test_expiry_announced_once():
+    customer_id = client.post("/customers/", json={"email": "expiry@cust.com"}).json()["id"]
+    expired_at = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    license = client.post("/licenses/", json={
+        "customer_id": customer_id, "product_id": 1, "expiration_date": expired_at,
+    }).json()
+
+    # Another dispatcher announces the license between this scan's SELECT and its INSERT
+    raced = []
+
+    def concurrent_scan(conn, cursor, statement, parameters, context, executemany):
+        if not raced and statement.startswith("SELECT licenses.") and "outbox_events" in statement:
+            raced.append(True)
+            cursor.connection.execute(
+                "INSERT INTO outbox_events (event_type, subject_id, payload) VALUES ('license.expired', ?, '{}')",
+                (license["id"],),
+            )
+
+    event.listen(engine, "after_cursor_execute", concurrent_scan)
+    db = TestingSessionLocal()
+    try:
+        assert webhooks.enqueue_expirations(db) == 0
+        assert raced and webhooks.enqueue_expirations(db) == 0
+        assert db.query(models.OutboxEvent).filter(
+            models.OutboxEvent.event_type == "license.expired", models.OutboxEvent.subject_id == license["id"]
+        ).count() == 1
+    finally:
+        event.remove(engine, "after_cursor_execute", concurrent_scan)
+        db.close()
+
+def test_migrate_dedupes_expired_events(tmp_path):
+    # A database written by the release whose expiry scans raced: no unique index, duplicate events
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'dupes.db'}")
+    Base.metadata.create_all(bind=old_engine)
+    with old_engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX uq_outbox_events_expired_subject_id")
+        connection.exec_driver_sql("INSERT INTO brands (id, name, email) VALUES (1, 'B', 'b@b.com')")
+        connection.exec_driver_sql(
+            "INSERT INTO webhook_endpoints (id, brand_id, url, secret, max_concurrency) VALUES (1, 1, 'https://x', 's', 4)"
+        )
+        for event_id, event_type, subject_id in [(1, "license.expired", 7), (2, "license.expired", 7),
+                                                 (3, "license.expired", 7), (4, "license.expired", 8),
+                                                 (5, "license.activated", 7), (6, "license.activated", 7)]:
+            connection.exec_driver_sql(
+                "INSERT INTO outbox_events (id, event_type, subject_id, payload) VALUES (?, ?, ?, '{}')",
+                (event_id, event_type, subject_id),
+            )
+        for delivery_id, event_id, status in [(1, 1, "delivered"), (2, 2, "delivered"), (3, 3, "pending")]:
+            connection.exec_driver_sql(
+                "INSERT INTO webhook_deliveries (id, event_id, endpoint_id, status, attempts, next_attempt_at) "
+                "VALUES (?, ?, 1, ?, 1, '2026-01-01')",
+                (delivery_id, event_id, status),
+            )
+    with pytest.raises(Exception):
+        with old_engine.begin() as connection:
+            connection.exec_driver_sql(
+                "CREATE UNIQUE INDEX uq_outbox_events_expired_subject_id ON outbox_events (subject_id) "
+                "WHERE event_type = 'license.expired'"
+            )
+
+    assert migrate.create_missing_indexes(old_engine) == ["uq_outbox_events_expired_subject_id"]
+    with old_engine.connect() as connection:
+        events = connection.exec_driver_sql("SELECT id, event_type FROM outbox_events ORDER BY id").fetchall()
+        assert [row[0] for row in events] == [1, 4, 5, 6]
+        # The sent duplicate's history moves to the kept event; the unsent one is dropped
+        assert connection.exec_driver_sql(
+            "SELECT id, event_id, status FROM webhook_deliveries ORDER BY id"
+        ).fetchall() == [(1, 1, "delivered"), (2, 1, "delivered")]
+    assert migrate.missing_indexes(old_engine) == []
+    old_engine.dispose()
+
+def test_validation_snapshot(tmp_path):
+    customer_id = client.post("/customers/", json={"email": "snap@cust.com"}).json()["id"]
+    licenses = [
+        client.post("/licenses/", json={"customer_id": customer_id, "product_id": 1, "max_seats": 3}).json()
+        for _ in range(3)
+    ]
+    keys = [license["key"] for license in licenses]
+    client.post("/licenses/activate", json={"license_key": keys[0], "machine_id": "SNAP-1"})
+    expired = client.post("/licenses/", json={
+        "customer_id": customer_id, "product_id": 1, "expiration_date": "2020-01-01T00:00:00",
+    }).json()["key"]
+
+    signing_key = b"test-signing-key"
+    base = str(tmp_path / "licenses.snap")
+    db = TestingSessionLocal()
+    try:
+        count = snapshot.export_snapshot(db, base, signing_key)
+        assert count == db.query(models.License).count()
+    finally:
+        db.close()
+
+    def api(key, product_id=1):
+        response = client.post("/licenses/validate", json={"key": key, "product_id": product_id})
+        if response.status_code != 200:
+            return {"valid": False, "reason": response.json()["detail"]}
+        return response.json()
+
+    with SnapshotReader(base, signing_key) as reader:
+        assert reader.lookup(keys[0]).active_seats == 1
+        for key, product_id in [(keys[0], 1), (keys[1], 1), (expired, 1), (keys[0], 2), ("missing-key", 1)]:
+            assert reader.validate(key, product_id) == api(key, product_id)
+
+        # Deltas carry only the changes since the state the gateway has
+        client.put(f"/licenses/{licenses[1]['id']}/suspend")
+        new_key = client.post("/licenses/", json={"customer_id": customer_id, "product_id": 1}).json()["key"]
+        delta = str(tmp_path / "1.delta")
+        db = TestingSessionLocal()
+        try:
+            assert snapshot.export_delta(db, reader, delta, signing_key) == 2
+        finally:
+            db.close()
+        reader.apply_delta(delta)
+        for key in (keys[1], new_key, keys[2]):
+            assert reader.validate(key, 1) == api(key)
+        with pytest.raises(SnapshotError):
+            reader.apply_delta(delta)  # Already at its sequence
+
+    # Gateways reject files that were not signed with their key or were modified
+    with pytest.raises(SnapshotError):
+        SnapshotReader(base, b"wrong-key")
+    data = bytearray(open(base, "rb").read())
+    data[-1] ^= 1
+    tampered = tmp_path / "tampered.snap"
+    tampered.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError):
+        SnapshotReader(str(tampered), signing_key)
+
+def test_admission_control_sheds_low_priority_first():
+    assert admission.classify("POST", "/licenses/validate") is admission.CRITICAL
+    assert admission.classify("GET", "/customers/") is admission.LOW
+    assert admission.classify("DELETE", "/activations/1") is admission.NORMAL
+
+    async def scenario():
+        limiter = admission.AdaptiveConcurrencyLimiter(initial_limit=4, min_limit=2, max_limit=8, target_latency=0.1)
+        low = admission.PriorityClass("low", 0.5, 0.01)
+        assert await limiter.acquire(low)
+        assert await limiter.acquire(low)
+        # Low priority is capped at half the limit and fails fast
+        assert not await limiter.acquire(low)
+        # Critical traffic still has headroom
+        assert await limiter.acquire(admission.CRITICAL)
+
+        # Slow responses shrink the limit multiplicatively
+        await limiter.release(1.0)
+        assert limiter.limit == 4 * 0.9
+        # Fast responses grow it additively
+        await limiter.release(0.01)
+        assert limiter.limit > 4 * 0.9
+        assert limiter.inflight == 1
+
+    asyncio.run(scenario())
+
+def test_server_settings(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    monkeypatch.setenv("SERVER_MAX_REQUESTS", "500")
+    options = server.settings()
+    assert options["workers"] == 3
+    assert options["max_requests"] == 500
+    # Keep-alive must outlast nginx's upstream keepalive_timeout (60s)
+    assert options["keepalive"] > 60
+    assert server.settings(bind="127.0.0.1:9000", workers=1)["workers"] == 1
+
+    # Each worker's pool is a share of the connection budget
+    monkeypatch.setattr(database, "DB_MAX_CONNECTIONS", 80)
+    assert database.pool_limits() == (8, 18)
+    monkeypatch.setenv("WEB_CONCURRENCY", "16")
+    assert database.pool_limits() == (1, 4)
+    monkeypatch.setenv("DB_POOL_SIZE", "2")
+    assert database.pool_limits() == (2, 3)
+
+    monkeypatch.delenv("WEB_CONCURRENCY")
+    assert database.pool_limits()[0] + database.pool_limits()[1] == 30
+    assert server.worker_count() == max(server.available_cpus(), 2)
+    assert server.event_loop() in ("uvloop", "asyncio")
+    assert server.http_protocol() in ("httptools", "h11")
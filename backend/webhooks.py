@@ -0,0 +1,604 @@
+"""
+Webhook notifications through a transactional outbox.
+
+crud writes an ``outbox_events`` row in the same transaction as each
+activation, deactivation and status change, so an event exists exactly when
+its change was committed and the request path never calls a partner.
+Expirations have no write to hook into; the dispatcher scans for licenses
+that expired recently and enqueues them once.
+
+The dispatcher runs in the background (inside each API worker, or on its own
+with ``python -m backend.webhooks dispatch``):
+
+* fan-out turns new events into one ``webhook_deliveries`` row per matching
+  endpoint of the event's brand;
+* due deliveries are claimed with a lease, so several dispatchers can run
+  side by side, and sent concurrently, with at most ``max_concurrency``
+  requests in flight per endpoint across all dispatchers (counted from the
+  leases in the database) so one slow partner cannot take every slot;
+* each request is signed with HMAC-SHA256 over ``"{timestamp}.{body}"``
+  (``X-Webhook-Signature: t=...,v1=...``);
+* failures are retried with exponential backoff and jitter, and a delivery
+  that fails ``WEBHOOK_MAX_ATTEMPTS`` times is dead-lettered (``status =
+  "dead"``) until someone retries it through the API.
+
+Usage:
+    python -m backend.webhooks dispatch
+    python -m backend.webhooks purge
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, insert, inspect, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import secrets
+import socket
+import time
+
+import httpcore
+import httpx
+
+from . import models
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = (
+    "license.activated",
+    "license.deactivated",
+    "license.suspended",
+    "license.resumed",
+    "license.expired",
+)
+
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "32"))  # Requests in flight per dispatcher
+TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE_SECONDS", "10"))
+BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "3600"))
+POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL_SECONDS", "1"))
+RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "30"))
+# Only for development: lets endpoints point at localhost and private networks
+ALLOW_PRIVATE_TARGETS = os.getenv("WEBHOOK_ALLOW_PRIVATE_TARGETS", "false").lower() == "true"
+
+# A claimed delivery is invisible to other dispatchers for this long
+LEASE = timedelta(seconds=TIMEOUT * 3)
+# Licenses that expired longer ago than this are not announced (e.g. on first deploy)
+EXPIRY_LOOKBACK = timedelta(days=7)
+EXPIRY_SCAN_INTERVAL = 60.0
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _add_leased_until_column(target, connection, **kw):
+    """Add webhook_deliveries.leased_until to databases created before it existed."""
+    columns = {column["name"] for column in inspect(connection).get_columns("webhook_deliveries")}
+    if "leased_until" in columns:
+        return
+    # Same race as seats._add_seat_slots_column: several workers may start together
+    if_not_exists = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+    try:
+        connection.exec_driver_sql(f"ALTER TABLE webhook_deliveries ADD COLUMN {if_not_exists}leased_until TIMESTAMP")
+    except OperationalError as exc:
+        if "duplicate column" not in str(exc):
+            raise
+        return
+    logger.info("Added webhook_deliveries.leased_until")
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+# Enqueueing, called by crud before its commit
+def enqueue(db: Session, event_type: str, product_id: Optional[int], subject_id: Optional[int], data: dict):
+    db.add(models.OutboxEvent(
+        event_type=event_type, product_id=product_id, subject_id=subject_id, payload=json.dumps(data),
+    ))
+
+
+def _license_data(db_license: models.License) -> dict:
+    return {
+        "license_id": db_license.id,
+        "key": db_license.key,
+        "customer_id": db_license.customer_id,
+        "product_id": db_license.product_id,
+        "is_active": db_license.is_active,
+        "expiration_date": _iso(db_license.expiration_date),
+    }
+
+
+def record_activated(db: Session, db_license: models.License, db_activation: models.Activation):
+    data = _license_data(db_license)
+    data.update(
+        activation_id=db_activation.id,
+        machine_id=db_activation.machine_id,
+        friendly_name=db_activation.friendly_name,
+        activated_at=_iso(db_activation.activated_at),
+    )
+    enqueue(db, "license.activated", db_license.product_id, db_license.id, data)
+
+
+def record_deactivated(db: Session, db_license: models.License, db_activation: models.Activation):
+    data = _license_data(db_license)
+    data.update(activation_id=db_activation.id, machine_id=db_activation.machine_id)
+    enqueue(db, "license.deactivated", db_license.product_id, db_license.id, data)
+
+
+def record_deactivations(db: Session, rows: Iterable):
+    """
+    Enqueue license.deactivated for bulk deletions in one INSERT.
+
+    rows hold (id, license_id, machine_id, product_id); the payload carries
+    ids only, since the licenses themselves are not loaded.
+    """
+    events = [
+        {
+            "event_type": "license.deactivated",
+            "product_id": row.product_id,
+            "subject_id": row.license_id,
+            "payload": json.dumps({
+                "license_id": row.license_id,
+                "product_id": row.product_id,
+                "activation_id": row.id,
+                "machine_id": row.machine_id,
+            }),
+        }
+        for row in rows
+    ]
+    if events:
+        db.execute(insert(models.OutboxEvent), events)
+
+
+def record_status_changed(db: Session, db_license: models.License):
+    event_type = "license.resumed" if db_license.is_active else "license.suspended"
+    enqueue(db, event_type, db_license.product_id, db_license.id, _license_data(db_license))
+
+
+def enqueue_expirations(db: Session, now: Optional[datetime] = None, batch_size: int = 1000) -> int:
+    """Enqueue license.expired once for licenses that expired within EXPIRY_LOOKBACK."""
+    now = now or datetime.utcnow()
+    announced = select(models.OutboxEvent.id).where(
+        models.OutboxEvent.event_type == "license.expired",
+        models.OutboxEvent.subject_id == models.License.id,
+    ).exists()
+    licenses = db.query(models.License).filter(
+        models.License.expiration_date <= now,
+        models.License.expiration_date > now - EXPIRY_LOOKBACK,
+        ~announced,
+    ).order_by(models.License.id).limit(batch_size).all()
+    enqueued = 0
+    for db_license in licenses:
+        try:
+            with db.begin_nested():
+                enqueue(db, "license.expired", db_license.product_id, db_license.id, _license_data(db_license))
+        except IntegrityError:
+            # Another dispatcher's scan announced it first
+            continue
+        enqueued += 1
+    db.commit()
+    return enqueued
+
+
+# Fan-out
+def _subscribed(endpoint: models.WebhookEndpoint, event_type: str) -> bool:
+    return not endpoint.event_types or event_type in endpoint.event_types.split(",")
+
+
+def fan_out(db: Session, batch_size: int = BATCH_SIZE) -> int:
+    """Create deliveries for a batch of new events; returns the number of events processed."""
+    events = db.query(
+        models.OutboxEvent.id, models.OutboxEvent.event_type, models.Product.brand_id,
+    ).outerjoin(models.Product, models.Product.id == models.OutboxEvent.product_id).filter(
+        models.OutboxEvent.dispatched_at.is_(None)
+    ).order_by(models.OutboxEvent.id).limit(batch_size).with_for_update(skip_locked=True, of=models.OutboxEvent).all()
+    if not events:
+        return 0
+
+    endpoints_by_brand = defaultdict(list)
+    brand_ids = {event.brand_id for event in events if event.brand_id is not None}
+    if brand_ids:
+        for endpoint in db.query(models.WebhookEndpoint).filter(
+            models.WebhookEndpoint.brand_id.in_(brand_ids), models.WebhookEndpoint.is_active == True
+        ):
+            endpoints_by_brand[endpoint.brand_id].append(endpoint)
+
+    now = datetime.utcnow()
+    deliveries = [
+        {"event_id": event.id, "endpoint_id": endpoint.id, "status": "pending", "attempts": 0,
+         "next_attempt_at": now, "created_at": now}
+        for event in events
+        for endpoint in endpoints_by_brand.get(event.brand_id, ())
+        if _subscribed(endpoint, event.event_type)
+    ]
+    if deliveries:
+        db.execute(insert(models.WebhookDelivery), deliveries)
+    db.query(models.OutboxEvent).filter(models.OutboxEvent.id.in_([event.id for event in events])).update(
+        {models.OutboxEvent.dispatched_at: now}, synchronize_session=False
+    )
+    db.commit()
+    return len(events)
+
+
+# Targets
+class UnsafeTargetError(ValueError):
+    """The endpoint's host resolves to an address the server must not call."""
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])  # Drop an IPv6 zone id
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _public_address(host: str, infos) -> str:
+    """First resolved address, if every address of host is public."""
+    addresses = [info[4][0] for info in infos]
+    for address in addresses:
+        if not _is_public(address):
+            raise UnsafeTargetError(f"{host} resolves to non-public address {address}")
+    return addresses[0]
+
+
+def check_url(url: str):
+    """
+    Reject endpoint URLs whose host is private, loopback, link-local or
+    otherwise not publicly routable (cloud metadata, the database host...).
+    """
+    if ALLOW_PRIVATE_TARGETS:
+        return
+    parts = urlsplit(url)
+    if not parts.hostname:
+        raise UnsafeTargetError("URL has no host")
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise UnsafeTargetError(f"{parts.hostname} does not resolve")
+    _public_address(parts.hostname, infos)
+
+
+class _PublicNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    Checks the address when each connection is opened and connects to exactly
+    that address, so DNS cannot hand the dispatcher a different, private one
+    after the endpoint was registered. TLS still verifies the hostname.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend):
+        self._backend = backend
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = _public_address(host, infos)
+        return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise UnsafeTargetError("Unix sockets are not webhook targets")
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+class _ResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
+class PublicTransport(httpx.AsyncBaseTransport):
+    """httpx transport over a connection pool whose every connection goes through _PublicNetworkBackend."""
+
+    def __init__(self):
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            network_backend=_PublicNetworkBackend(httpcore.AnyIOBackend()),
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._pool.handle_async_request(httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme, host=request.url.raw_host,
+                port=request.url.port, target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        ))
+        return httpx.Response(
+            status_code=response.status, headers=response.headers,
+            stream=_ResponseStream(response.stream), extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self._pool.aclose()
+
+
+def make_client() -> httpx.AsyncClient:
+    """HTTP client for deliveries; it only connects to public addresses unless ALLOW_PRIVATE_TARGETS."""
+    if ALLOW_PRIVATE_TARGETS:
+        return httpx.AsyncClient(timeout=TIMEOUT)
+    return httpx.AsyncClient(timeout=TIMEOUT, transport=PublicTransport())
+
+
+# Delivery
+def generate_secret() -> str:
+    return "whsec_" + secrets.token_urlsafe(32)
+
+
+def sign(secret: str, body: bytes, timestamp: Optional[int] = None) -> str:
+    """Value of the signature header for a request body."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret: str, header: str, body: bytes, tolerance: int = 300) -> bool:
+    """Check a signature header the way a receiver should, rejecting stale timestamps."""
+    try:
+        parts = dict(item.split("=", 1) for item in header.split(","))
+        timestamp = int(parts["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign(secret, body, timestamp), header)
+
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before the next attempt after attempts failures, with jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+@dataclass
+class Job:
+    delivery_id: int
+    attempts: int
+    endpoint_id: int
+    url: str
+    secret: str
+    event_type: str
+    body: bytes
+
+
+class Dispatcher:
+    """Claims due deliveries and sends them, bounded globally and per endpoint."""
+
+    def __init__(self, session_factory, client: Optional[httpx.AsyncClient] = None,
+                 concurrency: int = CONCURRENCY, batch_size: int = BATCH_SIZE, max_attempts: int = MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.client = client
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._tasks = set()
+        self._last_expiry_scan = 0.0
+
+    def _run(self, fn, *args):
+        db = self.session_factory()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    def _claim(self, db: Session, free: int):
+        """
+        Lease up to free due deliveries, skipping endpoints that are already at
+        their limit. The limit counts the leases of every dispatcher, so it holds
+        however many API workers run one.
+        """
+        now = datetime.utcnow()
+        candidates = db.query(
+            models.WebhookDelivery.id, models.WebhookDelivery.next_attempt_at,
+            models.WebhookDelivery.endpoint_id, models.WebhookEndpoint.max_concurrency,
+        ).join(models.WebhookEndpoint, models.WebhookEndpoint.id == models.WebhookDelivery.endpoint_id).filter(
+            models.WebhookDelivery.status == "pending",
+            models.WebhookDelivery.next_attempt_at <= now,
+            models.WebhookEndpoint.is_active == True,
+        ).order_by(models.WebhookDelivery.next_attempt_at).limit(free * 4).all()
+        if not candidates:
+            db.commit()
+            return []
+
+        # Claimers of the same endpoint take turns (row locks on PostgreSQL, the write lock on
+        # SQLite), so two dispatchers cannot both see a free slot and fill it
+        endpoint_ids = sorted({row.endpoint_id for row in candidates})
+        db.query(models.WebhookEndpoint.id).filter(models.WebhookEndpoint.id.in_(endpoint_ids)).order_by(
+            models.WebhookEndpoint.id
+        ).with_for_update().all()
+        inflight = dict(db.query(models.WebhookDelivery.endpoint_id, func.count()).filter(
+            models.WebhookDelivery.endpoint_id.in_(endpoint_ids),
+            models.WebhookDelivery.status == "pending",
+            models.WebhookDelivery.leased_until > now,
+        ).group_by(models.WebhookDelivery.endpoint_id).all())
+
+        claimed = []
+        taken = defaultdict(int)
+        for row in candidates:
+            if len(claimed) == free:
+                break
+            if inflight.get(row.endpoint_id, 0) + taken[row.endpoint_id] >= row.max_concurrency:
+                continue
+            # Optimistic claim: loses cleanly if another dispatcher leased the row first
+            if db.query(models.WebhookDelivery).filter(
+                models.WebhookDelivery.id == row.id,
+                models.WebhookDelivery.status == "pending",
+                models.WebhookDelivery.next_attempt_at == row.next_attempt_at,
+            ).update({
+                models.WebhookDelivery.next_attempt_at: now + LEASE,
+                models.WebhookDelivery.leased_until: now + LEASE,
+            }, synchronize_session=False):
+                claimed.append(row.id)
+                taken[row.endpoint_id] += 1
+        db.commit()
+        if not claimed:
+            return []
+
+        rows = db.query(
+            models.WebhookDelivery.id, models.WebhookDelivery.attempts,
+            models.WebhookEndpoint.id.label("endpoint_id"), models.WebhookEndpoint.url, models.WebhookEndpoint.secret,
+            models.OutboxEvent.id.label("event_id"), models.OutboxEvent.event_type,
+            models.OutboxEvent.created_at, models.OutboxEvent.payload,
+        ).join(models.WebhookEndpoint, models.WebhookEndpoint.id == models.WebhookDelivery.endpoint_id).join(
+            models.OutboxEvent, models.OutboxEvent.id == models.WebhookDelivery.event_id
+        ).filter(models.WebhookDelivery.id.in_(claimed)).all()
+        return [
+            Job(
+                delivery_id=row.id, attempts=row.attempts, endpoint_id=row.endpoint_id, url=row.url,
+                secret=row.secret, event_type=row.event_type,
+                body=json.dumps({
+                    "id": row.event_id,
+                    "type": row.event_type,
+                    "created_at": _iso(row.created_at),
+                    "data": json.loads(row.payload),
+                }).encode(),
+            )
+            for row in rows
+        ]
+
+    def _record(self, db: Session, job: Job, status_code: Optional[int], error: Optional[str]):
+        attempts = job.attempts + 1
+        values = {
+            models.WebhookDelivery.attempts: attempts,
+            models.WebhookDelivery.last_status_code: status_code,
+            models.WebhookDelivery.last_error: error,
+            models.WebhookDelivery.leased_until: None,
+        }
+        now = datetime.utcnow()
+        if error is None:
+            values[models.WebhookDelivery.status] = "delivered"
+            values[models.WebhookDelivery.delivered_at] = now
+        elif attempts >= self.max_attempts:
+            values[models.WebhookDelivery.status] = "dead"
+            logger.warning(
+                "Webhook delivery dead-lettered",
+                extra={"delivery_id": job.delivery_id, "endpoint_id": job.endpoint_id, "error": error},
+            )
+        else:
+            values[models.WebhookDelivery.next_attempt_at] = now + backoff(attempts)
+        db.query(models.WebhookDelivery).filter(
+            models.WebhookDelivery.id == job.delivery_id, models.WebhookDelivery.status == "pending"
+        ).update(values, synchronize_session=False)
+        db.commit()
+
+    async def _send(self, job: Job):
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "license-service-webhooks/1.0",
+            "X-Webhook-Id": str(job.delivery_id),
+            "X-Webhook-Event": job.event_type,
+            SIGNATURE_HEADER: sign(job.secret, job.body),
+        }
+        status_code = error = None
+        try:
+            response = await self.client.post(job.url, content=job.body, headers=headers, timeout=TIMEOUT)
+            status_code = response.status_code
+            if not 200 <= status_code < 300:
+                error = f"HTTP {status_code}"
+        except Exception as exc:  # Any failure to deliver is retried, never raised into the loop
+            error = f"{type(exc).__name__}: {exc}"[:500]
+        await asyncio.to_thread(self._run, self._record, job, status_code, error)
+
+    async def run_once(self) -> int:
+        """Fan out new events and start deliveries for the free slots; returns deliveries started."""
+        if self.client is None:
+            self.client = make_client()
+        if time.monotonic() - self._last_expiry_scan >= EXPIRY_SCAN_INTERVAL:
+            self._last_expiry_scan = time.monotonic()
+            await asyncio.to_thread(self._run, enqueue_expirations)
+        while await asyncio.to_thread(self._run, fan_out, self.batch_size) == self.batch_size:
+            pass
+
+        free = self.concurrency - len(self._tasks)
+        if free <= 0:
+            return 0
+        jobs = await asyncio.to_thread(self._run, self._claim, min(free, self.batch_size))
+        for job in jobs:
+            task = asyncio.create_task(self._send(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return len(jobs)
+
+    async def drain(self):
+        """Wait for the deliveries in flight."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def run_forever(self):
+        try:
+            while True:
+                try:
+                    started = await self.run_once()
+                except Exception:
+                    logger.exception("Webhook dispatcher iteration failed")
+                    started = 0
+                if not started:
+                    await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            await self.drain()
+            if self.client is not None:
+                await self.client.aclose()
+
+
+def purge(db: Session, retention_days: int = RETENTION_DAYS) -> int:
+    """Delete delivered deliveries and fully delivered events older than the retention period."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = db.query(models.WebhookDelivery).filter(
+        models.WebhookDelivery.status == "delivered", models.WebhookDelivery.created_at < cutoff
+    ).delete(synchronize_session=False)
+    remaining = select(models.WebhookDelivery.id).where(
+        models.WebhookDelivery.event_id == models.OutboxEvent.id
+    ).exists()
+    db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.dispatched_at < cutoff, ~remaining
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook outbox dispatcher.")
+    parser.add_argument("command", choices=["dispatch", "purge"])
+    args = parser.parse_args()
+
+    from .database import SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    models.Base.metadata.create_all(bind=engine)
+    if args.command == "dispatch":
+        try:
+            asyncio.run(Dispatcher(SessionLocal).run_forever())
+        except KeyboardInterrupt:
+            pass
+    else:
+        db = SessionLocal()
+        try:
+            print(f"Purged {purge(db)} delivered webhook deliveries")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
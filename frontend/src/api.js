@@ -30,6 +30,32 @@ export async function createProduct(data) {
     return res.json();
 }
 
+export async function fetchDashboardSummary(since) {
+    const params = since ? `?since=${encodeURIComponent(since)}` : '';
+    const res = await fetch(`${API_URL}/dashboard/summary${params}`);
+    if (!res.ok) throw new Error('Failed to fetch dashboard summary');
+    return res.json();
+}
+
+// Merges summary responses into { brands, products, customers } lookup maps,
+// fetching only entries added since the previous cursor.
+export async function syncDashboard(previous) {
+    let state = previous || { brands: {}, products: {}, customers: {}, cursor: null };
+    let summary;
+    do {
+        summary = await fetchDashboardSummary(state.cursor);
+        state = {
+            brands: { ...state.brands, ...summary.brands },
+            products: { ...state.products, ...summary.products },
+            customers: { ...state.customers, ...summary.customers },
+            cursor: summary.cursor,
+            counts: summary.counts,
+            recent_licenses: summary.recent_licenses,
+        };
+    } while (!summary.complete);
+    return state;
+}
+
 export async function fetchCustomers() {
     const res = await fetch(`${API_URL}/customers/`);
     return res.json();
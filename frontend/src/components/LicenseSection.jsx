@@ -1,9 +1,10 @@
 import { useState, useEffect } from 'react';
-import { fetchProducts, fetchCustomers, createLicense, validateLicense } from '../api';
+import { syncDashboard, createLicense, validateLicense } from '../api';
 
 export default function LicenseSection() {
-    const [products, setProducts] = useState([]);
-    const [customers, setCustomers] = useState([]);
+    const [summary, setSummary] = useState(null);
+    const products = summary ? Object.entries(summary.products).map(([id, p]) => ({ id, name: p.name })) : [];
+    const customers = summary ? Object.entries(summary.customers).map(([id, email]) => ({ id, email })) : [];
     const [formData, setFormData] = useState({
         customer_id: '',
         product_id: '',
@@ -19,8 +20,7 @@ export default function LicenseSection() {
     const [valResult, setValResult] = useState(null);
 
     useEffect(() => {
-        fetchProducts().then(setProducts);
-        fetchCustomers().then(setCustomers);
+        syncDashboard().then(setSummary);
     }, []);
 
     async function handleIssue(e) {
@@ -1,9 +1,8 @@
 import { useState, useEffect } from 'react';
-import { fetchProducts, createProduct, fetchBrands } from '../api';
+import { createProduct, syncDashboard } from '../api';
 
 export default function ProductSection() {
-    const [products, setProducts] = useState([]);
-    const [brands, setBrands] = useState([]);
+    const [summary, setSummary] = useState(null);
     const [newProduct, setNewProduct] = useState({ name: '', brand_id: '' });
     const [loading, setLoading] = useState(false);
 
@@ -11,12 +10,15 @@ export default function ProductSection() {
         loadData();
     }, []);
 
+    const products = summary ? Object.entries(summary.products).map(([id, p]) => ({ id, ...p })) : [];
+    const brands = summary ? Object.entries(summary.brands).map(([id, name]) => ({ id, name })) : [];
+
     async function loadData() {
-        const [pData, bData] = await Promise.all([fetchProducts(), fetchBrands()]);
-        setProducts(pData);
-        setBrands(bData);
-        if (bData.length > 0 && !newProduct.brand_id) {
-            setNewProduct(prev => ({ ...prev, brand_id: bData[0].id }));
+        const data = await syncDashboard(summary);
+        setSummary(data);
+        const brandIds = Object.keys(data.brands);
+        if (brandIds.length > 0 && !newProduct.brand_id) {
+            setNewProduct(prev => ({ ...prev, brand_id: brandIds[0] }));
         }
     }
 
@@ -28,8 +30,7 @@ export default function ProductSection() {
         try {
             await createProduct(newProduct);
             setNewProduct({ ...newProduct, name: '' });
-            const pData = await fetchProducts();
-            setProducts(pData);
+            await loadData();
         } catch (err) {
             alert('Failed to create product');
         } finally {
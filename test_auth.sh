@@ -2,6 +2,8 @@
 set -e
 
 BASE_URL="http://127.0.0.1:8000"
+# Admin key to create keys with; leave empty on a fresh database to bootstrap the first one
+ADMIN_API_KEY="${ADMIN_API_KEY:-}"
 
 echo "=== API Key Authentication Test ==="
 echo ""
@@ -10,6 +12,7 @@ echo ""
 echo "1. Generating API Key..."
 API_KEY_RESPONSE=$(curl -s -X POST "$BASE_URL/api-keys/" \
   -H "Content-Type: application/json" \
+  -H "X-API-Key: $ADMIN_API_KEY" \
   -d '{"name": "Test Key", "brand_id": null}')
 
 echo "$API_KEY_RESPONSE" | python3 -m json.tool
@@ -2,6 +2,8 @@
 set -e
 
 BASE_URL="http://127.0.0.1:8000"
+# Admin key to create keys with; leave empty on a fresh database to bootstrap the first one
+ADMIN_API_KEY="${ADMIN_API_KEY:-}"
 
 echo "=== Structured Logging Test ==="
 echo ""
@@ -10,6 +12,7 @@ echo ""
 echo "1. Performing an API call to trigger logs..."
 API_KEY_RESPONSE=$(curl -s -i -X POST "$BASE_URL/api-keys/" \
   -H "Content-Type: application/json" \
+  -H "X-API-Key: $ADMIN_API_KEY" \
   -d '{"name": "Logging Test Key"}')
 
 # Extract Request ID from headers
@@ -2,6 +2,8 @@
 set -e
 
 BASE_URL="http://127.0.0.1:8000"
+# Admin key to create keys with; leave empty on a fresh database to bootstrap the first one
+ADMIN_API_KEY="${ADMIN_API_KEY:-}"
 
 echo "=== Rate Limiting Test ==="
 echo ""
@@ -10,6 +12,7 @@ echo ""
 echo "1. Generating API Key..."
 API_KEY_RESPONSE=$(curl -s -X POST "$BASE_URL/api-keys/" \
   -H "Content-Type: application/json" \
+  -H "X-API-Key: $ADMIN_API_KEY" \
   -d '{"name": "Rate Limit Test Key"}')
 
 API_KEY=$(echo "$API_KEY_RESPONSE" | python3 -c "import sys, json; print(json.load(sys.stdin)['key'])")
@@ -25,6 +28,7 @@ RATE_LIMITED_COUNT=0
 for i in {1..12}; do
   HTTP_CODE=$(curl -s -o /dev/null -w "%{http_code}" -X POST "$BASE_URL/api-keys/" \
     -H "Content-Type: application/json" \
+    -H "X-API-Key: $API_KEY" \
     -d "{\"name\": \"Test Key $i\"}")
   
   if [ "$HTTP_CODE" == "200" ]; then